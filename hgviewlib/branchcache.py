@@ -0,0 +1,210 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""named branches of revisions
+
+Reading the branch of a revision requires to decompress its changelog entry.
+The `BranchIndex` maps every revision to an integer identifying its branch,
+so that revisions of a given branch are found by integer comparisons. It is
+stored next to the branch heads cache of mercurial
+(``.hg/cache/hgview-branches``) and only updated with new revisions by later
+launches.
+
+The `BranchSummary` holds the heads of every branch and whether it is closed,
+as needed by the graph, the branch selector and the branch colors.
+"""
+
+import sys
+from array import array
+
+from mercurial.node import hex, bin
+from mercurial import util, encoding
+
+# bump this each time the file format changes
+CACHE_VERSION = 1
+
+CACHE_FILE = 'cache/hgview-branches'
+
+
+class BranchIndex(object):
+    """
+    Branch of every revision of a repository.
+
+    Branch names are given integer identifiers, stored in ``branches`` for
+    each revision.
+    """
+    def __init__(self):
+        self.names = [] # identifier -> branch name
+        self.ids = {} # branch name -> identifier
+        self.branches = array('i') # revision -> identifier
+        self.tip = None # node of the last revision
+
+    def __len__(self):
+        return len(self.branches)
+
+    def branchid(self, name):
+        """Return the identifier of the branch ``name``, -1 if unknown"""
+        return self.ids.get(name, -1)
+
+    def branch(self, rev):
+        """Return the name of the branch of the revision ``rev``"""
+        return self.names[self.branches[rev]]
+
+    def _header(self, nrevs, tip):
+        return 'hgview-branches %i %s %s %i %s\n' % (
+            CACHE_VERSION, sys.byteorder, encoding.encoding, nrevs, hex(tip))
+
+    def uptodate(self, repo):
+        """Return True if the index covers all revisions of ``repo``"""
+        changelog = repo.changelog
+        return len(self) == len(changelog) and (
+            not len(self) or changelog.node(len(self) - 1) == self.tip)
+
+    def update(self, repo):
+        """Add revisions of ``repo`` missing from the index. The index is
+        emptied first if ``repo`` does not hold its revisions anymore."""
+        changelog = repo.changelog
+        if len(self) > len(changelog) or (
+            len(self) and changelog.node(len(self) - 1) != self.tip):
+            self.__init__()
+        start, stop = len(self), len(changelog)
+        if start == stop:
+            return False
+        getbranch = getattr(changelog, 'branch', None)
+        if getbranch is None: # mercurial < 1.6
+            getbranch = lambda rev: repo[rev].branch()
+        names, ids, branches = self.names, self.ids, self.branches
+        for rev in xrange(start, stop):
+            name = getbranch(rev)
+            branchid = ids.get(name)
+            if branchid is None:
+                branchid = ids[name] = len(names)
+                names.append(name)
+            branches.append(branchid)
+        self.tip = changelog.node(stop - 1)
+        return True
+
+    def read(self, repo):
+        """Read the index stored in the cache directory of ``repo``. Return
+        False if it is missing or invalid."""
+        try:
+            fobj = repo.opener(CACHE_FILE, 'rb')
+            try:
+                content = fobj.read()
+            finally:
+                fobj.close()
+        except (IOError, OSError):
+            return False
+        lines = content.split('\n', 2)
+        if len(lines) != 3:
+            return False
+        header, nnames, content = lines
+        try:
+            nrevs, tip = header.split()[4:6]
+            nrevs, nnames, tip = int(nrevs), int(nnames), bin(tip)
+        except (ValueError, TypeError):
+            return False
+        if header + '\n' != self._header(nrevs, tip):
+            return False
+        names = content.split('\n', nnames)
+        if len(names) != nnames + 1:
+            return False
+        branches = array('i')
+        data = names.pop()
+        if len(data) != nrevs * branches.itemsize:
+            return False
+        branches.fromstring(data)
+        if nrevs and not 0 <= min(branches) <= max(branches) < nnames:
+            return False
+        self.names = names
+        self.ids = dict((name, idx) for idx, name in enumerate(names))
+        self.branches = branches
+        self.tip = nrevs and tip or None
+        return True
+
+    def write(self, repo):
+        """Store the index in the cache directory of ``repo``"""
+        if not len(self):
+            return
+        try:
+            fobj = repo.opener(CACHE_FILE, 'wb', atomictemp=True)
+            fobj.write(self._header(len(self), self.tip))
+            fobj.write('%i\n' % len(self.names))
+            for name in self.names:
+                fobj.write(name + '\n')
+            fobj.write(self.branches.tostring())
+            fobj.close()
+        except (IOError, OSError, util.Abort):
+            # Abort may be raised by read only opener
+            pass
+
+def branchindex(repo):
+    """Return the up to date `BranchIndex` of ``repo``"""
+    index = getattr(repo, '_hgview_branchindex', None)
+    if index is not None and index.uptodate(repo):
+        return index
+    if index is None:
+        index = BranchIndex()
+        index.read(repo)
+    if index.update(repo):
+        index.write(repo)
+    repo._hgview_branchindex = index
+    return index
+
+
+class BranchSummary(object):
+    """
+    Heads of the named branches of a repository.
+
+    :heads: branch name -> head revisions, in increasing order
+    :openheads: branch name -> heads which do not close the branch
+    :closed: names of the branches with no open head
+    :colorslots: branch name -> index of its color, ``default`` and
+                 ``stable`` branches first then sorted by name
+    """
+    def __init__(self, repo):
+        changelog = repo.changelog
+        self.key = (len(changelog), changelog.tip())
+        self.heads = {}
+        self.openheads = {}
+        for name, nodes in repo.branchmap().iteritems():
+            heads = sorted(changelog.rev(node) for node in nodes)
+            self.heads[name] = heads
+            self.openheads[name] = [rev for rev in heads
+                                    if 'close' not in changelog.read(
+                                        changelog.node(rev))[5]]
+        self.closed = frozenset(name for name, heads in self.openheads.items()
+                                if not heads)
+        self.colorslots = {}
+        for name in ['default', 'stable'] + sorted(self.heads):
+            self.colorslots.setdefault(name, len(self.colorslots))
+
+    def names(self, closed=True):
+        """Return sorted branch names, including closed ones if ``closed``"""
+        return sorted(name for name in self.heads
+                      if closed or name not in self.closed)
+
+    def tip(self, name):
+        """Return the tip revision of the branch ``name``: its last open
+        head, or its last head if the branch is closed"""
+        return (self.openheads[name] or self.heads[name])[-1]
+
+def branchsummary(repo):
+    """Return the `BranchSummary` of ``repo``, computed again only if
+    changesets were added or removed since the last call"""
+    summary = getattr(repo, '_hgview_branchsummary', None)
+    changelog = repo.changelog
+    if summary is None or summary.key != (len(changelog), changelog.tip()):
+        summary = repo._hgview_branchsummary = BranchSummary(repo)
+    return summary
@@ -240,6 +240,15 @@ class HgConfig(object):
         val = str(self._fromconfig('displaydiffstats', default))
         return val.lower() in ['true', 'yes', '1', 'on']
 
+    @cached
+    def getDiffStatProcesses(self, default=0):
+        """
+        diffstatprocesses: number of processes computing the 'Diff' column
+                    and the renamed files of large file lists (0 computes
+                    them in the user interface)
+        """
+        return int(self._fromconfig('diffstatprocesses', default))
+
     @cached
     def getMaxFileSize(self, default=100000):
         """
@@ -248,6 +257,23 @@ class HgConfig(object):
         """
         return int(self._fromconfig('maxfilesize', default))
 
+    @cached
+    def getFileDataCacheSize(self, default=32768):
+        """
+        filedatacachesize: size (in kB) of the memory kept for displayed file
+                     contents and diffs (0 disables the cache)
+        """
+        return int(self._fromconfig('filedatacachesize', default))
+
+    @cached
+    def getFileDataDiskCache(self, default="no"):
+        """
+        filedatadiskcache: also store displayed file contents and diffs in
+                     the repository cache directory for later launches
+        """
+        val = str(self._fromconfig('filedatadiskcache', default))
+        return val.lower() in ['true', 'yes', '1', 'on']
+
     @cached
     def getDiffBGColor(self, default='black'):
         """
@@ -347,6 +373,15 @@ class HgConfig(object):
         """
         return bool(self._fromconfig('showobsolete', default))
 
+    @cached
+    def getGraphCache(self, default="yes"):
+        """
+        graphcache: store the computed revision graph layout in the
+                    repository cache directory to speed up later launches
+        """
+        val = str(self._fromconfig('graphcache', default))
+        return val.lower() in ['true', 'yes', '1', 'on']
+
     @cached
     def getExportTemplate(self):
         """
@@ -50,8 +50,11 @@ from hgviewlib.hgpatches.graphmod import (_fixlongrightedges,
                                           _getnodelineedgestail,
                                           _drawedges, _getpaddingline)
 
-from hgviewlib.util import tounicode
 from hgviewlib.hggraph import getlog, gettags, getdate, HgRepoListWalker
+from hgviewlib.hggraph import getauthor, getbranch, getbookmarks
+from hgviewlib.markcache import markindex
+from hgviewlib.flagcache import revflags
+from hgviewlib.hgpatches.phases import phasenames
 from hgviewlib.curses import connect_command, SelectableText
 
 # __________________________________________________________________ constants
@@ -60,17 +63,25 @@ COLORS = ["brown", "dark red", "dark magenta", "dark blue", "dark cyan",
           "dark green", "yellow", "light red", "light magenta", "light blue",
           "light cyan", "light green"]
 
+def _getbranch(model, ctx, gnode):
+    """Return the branch of ``ctx``, empty for the default one"""
+    branch = getbranch(model, ctx, gnode)
+    if branch == 'default':
+        return ''
+    return branch
+
 
 _COLUMNMAP = {
     'ID': lambda m, c, g: c.rev() is not None and str(c.rev()) or "",
     'Log': getlog,
-    'Author': lambda m, c, g: tounicode((c.user() if c.node() else '').split('<',1)[0]),
+    'Author': lambda m, c, g: getauthor(m, c, g).split(u'<', 1)[0],
     'Date': getdate,
     'Tags': gettags,
-    'Bookmarks': lambda m, c, g: ', '.join(c.bookmarks() or ()),
-    'Branch': lambda m, c, g: c.branch() != 'default' and c.branch(),
+    'Bookmarks': lambda m, c, g: ', '.join(getbookmarks(m, c, g)),
+    'Branch': _getbranch,
     'Filename': lambda m, c, g: g.extra[0],
-    'Phase': lambda model, ctx, gnode: ctx.phasestr(),
+    'Phase': lambda model, ctx, gnode: phasenames[
+        revflags(model.repo).phase(ctx.rev())],
     }
 GRAPH_MIN_WIDTH = 6
 
@@ -172,7 +183,7 @@ class RevisionsWalker(ListWalker):
         foc_style = {} # style modifier for focused
         all_styles = set(self._columns) | set(['GraphLog', 'GraphLog.node', None])
         important_styles = set(['ID', 'GraphLog.node'])
-        if ctx.obsolete():
+        if revflags(self.walker.repo).obsolete(gnode.rev):
             spec_style.update(dict.fromkeys(all_styles, 'obsolete'))
         # normal style: use special styles for working directory and tip
         style = None
@@ -197,10 +208,10 @@ class RevisionsWalker(ListWalker):
             char = '!' # pending changes
         elif not getattr(ctx, 'applied', True):
             char = ' '
-        elif set(ctx.tags()).intersection(self.walker.mqueues):
+        elif markindex(self.walker.repo).mqpatch(gnode.rev):
             char = '*'
         else:
-            phase = ctx.phase()
+            phase = revflags(self.walker.repo).phase(gnode.rev)
             try:
                 char = 'o#^'[phase]
             except IndexError:
@@ -0,0 +1,247 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""decoded contents and diffs of file revisions
+
+`hggraph.Graph.filedata` decodes the content of a file revision, or its diff
+against another revision of the file, each time a file is displayed or
+searched. The result only depends on the file revisions involved, so a
+`FileDataCache` keeps the recent ones, keyed by ``(parent filenode,
+filenode, kind)``, within a budget of bytes.
+
+Results may also be written in the repository cache directory
+(``.hg/cache/hgview-filedata/``), to be read back by later launches once they
+are dropped from memory.
+
+The diffs of the files of a changeset share a `ChangesetDiff`, which reads the
+status, the manifests and the copies of the changeset once for all of them.
+"""
+
+import os
+import sys
+try:
+    from hashlib import sha1
+except ImportError: # python < 2.5
+    from sha import sha as sha1
+
+from mercurial import mdiff, patch, copies
+
+from hgviewlib.util import LRUCache, isnode
+from hgviewlib.statuscache import repostatus, MODIFIED, ADDED, REMOVED
+
+# bump this each time the file format changes
+CACHE_VERSION = 1
+
+CACHE_DIR = 'cache/hgview-filedata'
+
+# the cache directory may hold this number of times the memory budget
+DISK_FACTOR = 8
+
+# number of `ChangesetDiff` kept for a repository
+CHANGESETDIFF_CACHE_SIZE = 4
+
+# bytes per character of unicode strings
+_UNICODE_SIZE = sys.maxunicode > 0xffff and 4 or 2
+
+def datasize(value):
+    """Return the approximate size in bytes of a (flag, data) result"""
+    data = value[1]
+    if isinstance(data, unicode):
+        return len(data) * _UNICODE_SIZE
+    return len(data)
+
+class FileDataCache(object):
+    """
+    (flag, data) results of `hggraph.Graph.filedata` for pairs of file
+    revisions of ``repo``, within ``maxsize`` bytes.
+
+    If ``persistent`` is True, results are also stored in the repository
+    cache directory. ``salt`` tells apart results computed with different
+    diff options.
+    """
+    def __init__(self, repo, maxsize, persistent=False, salt=''):
+        self.repo = repo
+        self.maxsize = maxsize
+        self.persistent = persistent
+        self.salt = salt
+        self._items = LRUCache(maxsize, datasize)
+        if persistent:
+            self._prune(maxsize * DISK_FACTOR)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _filename(self, key):
+        name = sha1('%i %s %r' % (CACHE_VERSION, self.salt, key))
+        return '%s/%s' % (CACHE_DIR, name.hexdigest())
+
+    def get(self, key):
+        """Return the (flag, data) result of ``key``, None if unknown"""
+        value = self._items.get(key)
+        if value is None and self.persistent:
+            value = self._read(key)
+            if value is not None:
+                self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        if self.persistent:
+            self._write(key, value)
+
+    def _read(self, key):
+        try:
+            fobj = self.repo.opener(self._filename(key), 'rb')
+            try:
+                content = fobj.read()
+            finally:
+                fobj.close()
+        except (IOError, OSError):
+            return None
+        flag, sep, data = content.partition('\n')
+        if not sep:
+            return None
+        try:
+            return flag, data.decode('utf-8')
+        except UnicodeError:
+            return None
+
+    def _write(self, key, value):
+        flag, data = value
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        try:
+            fobj = self.repo.opener(self._filename(key), 'wb',
+                                    atomictemp=True)
+            fobj.write('%s\n%s' % (flag, data))
+            fobj.close()
+        except (IOError, OSError):
+            # read-only repository
+            self.persistent = False
+
+    def _prune(self, maxsize):
+        """Remove least recently written files of the cache directory down to
+        3/4 of ``maxsize`` bytes if they exceed it"""
+        path = self.repo.join(CACHE_DIR)
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return
+        files = []
+        size = 0
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+            size += stat.st_size
+        if size <= maxsize:
+            return
+        files.sort()
+        for mtime, filesize, name in files:
+            if size <= maxsize * 3 // 4:
+                break
+            try:
+                os.unlink(os.path.join(path, name))
+            except OSError:
+                pass
+            size -= filesize
+
+# root of repository -> `FileDataCache`
+_caches = {}
+
+def filedatacache(repo, maxsize, persistent=False):
+    """Return the `FileDataCache` of ``repo``, None if ``maxsize`` is not
+    positive. It is kept when the repository is reloaded."""
+    if maxsize <= 0:
+        return None
+    opts = patch.diffopts(repo.ui)
+    salt = repr([(name, getattr(opts, name))
+                 for name in sorted(mdiff.diffopts.defaults)])
+    cache = _caches.get(repo.root)
+    if (cache is None or cache.maxsize != maxsize
+        or cache.persistent != persistent or cache.salt != salt):
+        cache = _caches[repo.root] = FileDataCache(repo, maxsize, persistent,
+                                                   salt)
+    cache.repo = repo
+    return cache
+
+def decodediff(data):
+    """Return the diff ``data`` as unicode"""
+    # XXX how to deal diff encodings?
+    try:
+        return unicode(data, "utf-8")
+    except UnicodeError:
+        # XXX use a default encoding from config?
+        return unicode(data, "iso-8859-15", 'ignore')
+
+def _getfilectx(filename, ctx):
+    return ctx.filectx(filename)
+
+class ChangesetDiff(object):
+    """
+    Hunks of the diffs of the files changed from ``ctx1`` to ``ctx2``, as
+    `patch.diff` gives them (file headers are left out).
+
+    Each file is diffed on its own when requested, its hunks being kept by
+    the `FileDataCache` of the caller.
+    """
+    def __init__(self, repo, ctx1, ctx2):
+        self.repo = repo
+        self.ctx1 = ctx1
+        self.ctx2 = ctx2
+        self.opts = patch.diffopts(repo.ui)
+        self.status = repostatus(repo, ctx1.node(), ctx2.node())
+        self._copies = None
+
+    def copies(self):
+        """Return the copies from ``ctx1`` to ``ctx2`` shown by the diffs"""
+        if self._copies is None:
+            self._copies = {}
+            if self.opts.git:
+                self._copies = copies.pathcopies(self.ctx1, self.ctx2)
+        return self._copies
+
+    def filediff(self, filename):
+        """Return the hunks of the diff of ``filename``, empty if it is
+        unchanged"""
+        kind = self.status.kind(filename)
+        if kind not in (MODIFIED, ADDED, REMOVED):
+            return u''
+        changes = ([], [], [])
+        changes[kind].append(filename)
+        modified, added, removed = changes
+        # contexts and their manifests are shared by the diffs of all files
+        text = ''.join(patch.trydiff(self.repo, None, self.ctx1, self.ctx2,
+                                     modified, added, removed, self.copies(),
+                                     _getfilectx, self.opts, None, ''))
+        # we assume that \n@@ marks the end of the diff header
+        text = ''.join(text.partition(os.linesep + '@@')[1:]).lstrip()
+        return decodediff(text)
+
+def changesetdiff(repo, ctx1, ctx2):
+    """Return the `ChangesetDiff` of ``repo`` from ``ctx1`` to ``ctx2``. It
+    is kept unless one of them is not a changeset."""
+    if not (isnode(repo, ctx1.node()) and isnode(repo, ctx2.node())):
+        return ChangesetDiff(repo, ctx1, ctx2)
+    cache = getattr(repo, '_hgview_changesetdiffs', None)
+    if cache is None:
+        cache = repo._hgview_changesetdiffs = LRUCache(
+            CHANGESETDIFF_CACHE_SIZE)
+    key = (ctx1.node(), ctx2.node())
+    csdiff = cache.get(key)
+    if csdiff is None:
+        csdiff = cache[key] = ChangesetDiff(repo, ctx1, ctx2)
+    return csdiff
@@ -0,0 +1,179 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""numbers of lines changed in files
+
+The Diff column of the file list shows how many lines of a file are added and
+removed by a changeset. They are counted from the matching blocks of lines
+of the two file revisions, without building a diff, and kept for a given
+pair of file revisions.
+
+Changesets with many files may have them computed by a `FileStatPool` of
+processes, each one with its own instance of the repository opened with the
+configuration of the parent process.
+"""
+
+from itertools import islice
+try:
+    import multiprocessing
+except ImportError: # python < 2.6
+    multiprocessing = None
+
+from mercurial import bdiff, mdiff, util, extensions, ui as uimod
+from mercurial.node import nullid
+from mercurial.error import LookupError
+
+from hgviewlib.util import LRUCache, build_repo
+
+# (parent filenode, filenode) -> (lines, added, removed)
+_stats = LRUCache(100000)
+
+def textstat(text1, text2):
+    """Return the numbers of lines added and removed from ``text1`` to
+    ``text2``, 0 for binary data"""
+    if util.binary(text1) or util.binary(text2):
+        return 0, 0
+    same = sum(block[1] - block[0] for block in bdiff.blocks(text1, text2))
+    return (len(mdiff.splitnewlines(text2)) - same,
+            len(mdiff.splitnewlines(text1)) - same)
+
+def diffstat(ctx, filename, pctx=None):
+    """Return the number of lines of ``filename`` in ``ctx`` and the numbers
+    of lines added and removed since ``pctx``, the first parent of ``ctx`` by
+    default"""
+    if pctx is None:
+        pctx = ctx.p1()
+    fctx = ctx.filectx(filename)
+    try:
+        pfctx = pctx.filectx(filename)
+        pnode = pfctx.filenode()
+    except LookupError:
+        pfctx, pnode = None, nullid
+    node = fctx.filenode()
+    key = (pnode, node)
+    stat = _stats.get(key)
+    if stat is None:
+        text = fctx.data()
+        ptext = pfctx is not None and pfctx.data() or ''
+        stat = (text.count('\n'),) + textstat(ptext, text)
+        if node is not None: # working directory files may change
+            _stats[key] = stat
+    return stat
+
+# repository of a worker process of a `FileStatPool`
+_workerrepo = None
+
+def _initworker(root, configitems):
+    """Open the repository at ``root`` with the (section, name, value)
+    ``configitems`` of the parent process"""
+    global _workerrepo
+    ui = uimod.ui()
+    for section, name, value in configitems:
+        ui.setconfig(section, name, value)
+    # already loaded if the process is forked
+    extensions.loadall(ui)
+    _workerrepo = build_repo(ui, root)
+
+def _runjobs(jobs):
+    """Return (job, result) for ``jobs`` of a `FileStatPool`"""
+    repo = _workerrepo
+    results = []
+    for job in jobs:
+        key, kind, rev, prev, filename = job
+        try:
+            if kind == 'stat':
+                result = diffstat(repo[rev], filename, repo[prev])
+            else: # 'renamed'
+                result = repo[rev].filectx(filename).renamed()
+        except Exception:
+            # a failing job must not lose the results of its chunk
+            result = None
+        results.append((job, result))
+    return results
+
+class FileStatPool(object):
+    """
+    Pool of processes computing jobs on files of a repository, given as
+    ``(key, kind, rev, prev, filename)`` tuples. ``kind`` is 'stat' for the
+    `diffstat` of ``filename`` between revisions ``rev`` and ``prev``, or
+    'renamed' for the ``renamed()`` value of the file in ``rev``. Results are
+    None if the file or the revision is unknown.
+
+    Jobs are sent to processes by chunks as results are collected, so that
+    submitting new jobs discards the previous ones at once.
+    """
+    chunksize = 32
+
+    def __init__(self, repo, processes):
+        self.key = _poolkey(repo)
+        self.processes = processes
+        # command line options and extensions of the parent are kept
+        self._pool = multiprocessing.Pool(processes, _initworker,
+                                          (repo.root,
+                                           list(repo.ui.walkconfig())))
+        self._jobs = iter(())
+        self._running = [] # AsyncResult of chunks of jobs
+
+    def submit(self, jobs):
+        """Compute ``jobs`` instead of the ones submitted before"""
+        self._jobs = iter(jobs)
+        self._running = []
+        self._feed()
+
+    def _feed(self):
+        while len(self._running) < 2 * self.processes:
+            chunk = list(islice(self._jobs, self.chunksize))
+            if not chunk:
+                break
+            self._running.append(self._pool.apply_async(_runjobs, (chunk,)))
+
+    def results(self):
+        """Return (job, result) for jobs computed since last call"""
+        results = []
+        running = []
+        for chunk in self._running:
+            if chunk.ready():
+                results.extend(chunk.get())
+            else:
+                running.append(chunk)
+        self._running = running
+        self._feed()
+        return results
+
+    def busy(self):
+        """Return True if some jobs are not computed yet"""
+        return bool(self._running)
+
+    def close(self):
+        self._pool.terminate()
+
+_pool = None
+
+def _poolkey(repo):
+    # a stripped repository may get back the same number of revisions
+    return repo.root, repo.changelog.tip()
+
+def filestatpool(repo, processes):
+    """Return a `FileStatPool` of ``processes`` for ``repo``, None if
+    processes are not available"""
+    global _pool
+    if multiprocessing is None or processes < 1:
+        return None
+    key = _poolkey(repo)
+    if _pool is None or _pool.key != key or _pool.processes != processes:
+        # processes of the previous pool do not know new revisions
+        if _pool is not None:
+            _pool.close()
+        _pool = FileStatPool(repo, processes)
+    return _pool
@@ -0,0 +1,105 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""phase and obsolescence state of revisions
+
+Rows are styled according to the phase of their revision and whether it is
+obsolete or troubled. `RevFlags` gathers them in a single byte per revision,
+computed in one pass from the phase cache and the obsolescence markers.
+"""
+
+from array import array
+
+from hgviewlib.hgpatches import phaserevs
+
+# bits of a revision flags, the two lowest ones hold the phase
+PHASE_MASK = 3
+OBSOLETE = 1 << 2
+TROUBLED = 1 << 3
+
+try:
+    from mercurial.obsolete import getrevs
+except ImportError:
+    # mercurial < 2.4
+    getrevs = None
+
+def _obsoleterevs(repo):
+    """Return obsolete and troubled revisions of ``repo``"""
+    if getrevs is not None:
+        troubled = set()
+        for name in ('unstable', 'bumped', 'divergent'):
+            troubled.update(getrevs(repo, name))
+        return getrevs(repo, 'obsolete'), troubled
+    if not getattr(repo, 'obsstore', None):
+        return (), ()
+    # markers of the mutable extension, rely on context methods
+    obsolete, troubled = [], []
+    for rev in repo:
+        ctx = repo[rev]
+        if ctx.obsolete():
+            obsolete.append(rev)
+        if ctx.troubles():
+            troubled.append(rev)
+    return obsolete, troubled
+
+
+class RevFlags(object):
+    """
+    Phase, obsolete and troubled state of every revision of a repository.
+
+    ``None`` stands for the working directory, and names of unapplied mq
+    patches for these patches, whose state is asked to their context.
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        nrevs = len(repo.changelog)
+        revphases = phaserevs(repo)
+        if revphases is None: # mercurial < 2.1
+            self.flags = array('B', [0]) * nrevs
+        else:
+            self.flags = array('B', revphases[:nrevs])
+        flags = self.flags
+        obsolete, troubled = _obsoleterevs(repo)
+        for rev in obsolete:
+            flags[rev] |= OBSOLETE
+        for rev in troubled:
+            flags[rev] |= TROUBLED
+
+    def __len__(self):
+        return len(self.flags)
+
+    def phase(self, rev):
+        """Return the phase of ``rev``"""
+        if not isinstance(rev, int):
+            return self.repo[rev].phase()
+        return self.flags[rev] & PHASE_MASK
+
+    def obsolete(self, rev):
+        """Return True if ``rev`` is obsolete"""
+        if not isinstance(rev, int):
+            return rev is not None and bool(self.repo[rev].obsolete())
+        return bool(self.flags[rev] & OBSOLETE)
+
+    def troubled(self, rev):
+        """Return True if ``rev`` is unstable, bumped or divergent"""
+        if not isinstance(rev, int):
+            return rev is not None and bool(self.repo[rev].troubles())
+        return bool(self.flags[rev] & TROUBLED)
+
+def revflags(repo):
+    """Return the `RevFlags` of ``repo``"""
+    flags = getattr(repo, '_hgview_revflags', None)
+    if flags is None or len(flags) != len(repo.changelog):
+        flags = repo._hgview_revflags = RevFlags(repo)
+    return flags
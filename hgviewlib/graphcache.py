@@ -0,0 +1,419 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""on-disk cache of revision graph layouts
+
+The layout computed by `hggraph.revision_grapher` (column, color, edges and
+parents of every row) only depends on the changelog content and on the
+grapher options. It is stored in the repository cache directory
+(``.hg/cache/hgview-graph-*``) so that later launches read the rows back
+instead of walking the whole history again.
+
+Every `CHECKPOINT_STEP` rows, the internal state of the grapher is saved
+along with the rows. Checkpoints make it possible to resume an interrupted
+layout, and to reuse the rows of a previous layout once new changesets were
+added to the repository (see `hggraph.Graph.splice`), within a launch or from
+the cache file of a former one.
+"""
+
+import os
+import sys
+from array import array
+from collections import namedtuple
+try:
+    from hashlib import sha1
+except ImportError: # python < 2.5
+    from sha import sha as sha1
+
+from mercurial.node import hex, bin
+from mercurial import util
+
+from hgviewlib.hgpatches import phases, hiddenrevs, phaserevs
+from hgviewlib.util import filestate
+from hgviewlib.branchcache import branchsummary
+
+# bump this each time the file format changes
+CACHE_VERSION = 4
+
+# number of rows between two checkpoints
+CHECKPOINT_STEP = 1000
+
+# kinds of chunk in cache files
+CHUNK_CHECKPOINT = 0
+CHUNK_END = 1
+
+# Repository data the layout depends on, besides parents of changesets:
+# number of revisions, tip node, hidden revisions, phase of each revision,
+# closed branches and state of the obsolescence markers file.
+RepoState = namedtuple('RepoState', 'nrevs tip hidden phases closed obsstore')
+
+def repostate(repo):
+    """Return the `RepoState` of ``repo``"""
+    changelog = repo.changelog
+    revphases = phaserevs(repo)
+    if revphases is not None:
+        revphases = array('b', revphases[:len(changelog)])
+    return RepoState(len(changelog), changelog.tip(),
+                     frozenset(hiddenrevs(repo)), revphases,
+                     branchsummary(repo).closed,
+                     filestate(repo.sjoin('obsstore')))
+
+# Summary of a `RepoState` for a layout: the number of revisions, the tip node
+# and a digest of the other data the layout of these revisions depends on
+# (see `layoutstamp`).
+LayoutStamp = namedtuple('LayoutStamp', 'nrevs tip digest')
+
+def _layoutdigest(state, nrevs, options):
+    """Return a digest of the data of the `RepoState` ``state`` the layout
+    computed by `revision_grapher` with ``options`` depends on for the
+    ``nrevs`` first revisions, besides parents of changesets"""
+    parts = ['\0'.join(sorted(state.closed))]
+    if options.get('show_obsolete'):
+        parts.append(state.obsstore)
+    if not options.get('show_hidden'):
+        parts.append(','.join(str(rev) for rev in sorted(state.hidden)
+                              if rev < nrevs))
+        if options.get('reorder'):
+            if state.phases is None: # mercurial < 2.1
+                parts.append('-')
+            else:
+                parts.append(state.phases[:nrevs].tostring())
+    return sha1('\0'.join(parts)).hexdigest()
+
+def layoutstamp(state, options):
+    """Return the `LayoutStamp` of the `RepoState` ``state`` for a layout
+    computed with ``options``"""
+    return LayoutStamp(state.nrevs, state.tip,
+                       _layoutdigest(state, state.nrevs, options))
+
+def appended(repo, old, new, options):
+    """Return True if ``repo`` (whose `RepoState` is ``new``) only differs
+    from the one of the `LayoutStamp` ``old`` by changesets added on top of
+    it, in a way which does not alter the layout computed by
+    `revision_grapher` with ``options`` for the former revisions."""
+    if new.nrevs < old.nrevs:
+        return False
+    if old.nrevs and repo.changelog.node(old.nrevs - 1) != old.tip:
+        return False
+    if _layoutdigest(new, old.nrevs, options) != old.digest:
+        return False
+    if options.get('reorder') and not options.get('show_hidden') \
+       and new.phases is not None and phases.public in new.phases[old.nrevs:]:
+        # new public changesets would be walked after old drafts
+        return False
+    return True
+
+def layoutkey(wdparents, options):
+    """Return a key identifying the layouts computed by `revision_grapher`
+    with ``options`` (a dict of its keyword arguments), whatever the state
+    of the repository.
+
+    ``wdparents`` are the nodes of working directory parents if the working
+    directory row is displayed (empty otherwise).
+    """
+    parts = [str(CACHE_VERSION), sys.byteorder, repr(bool(wdparents))]
+    parts.extend('%s=%r' % item for item in sorted(options.items()))
+    return sha1('\0'.join(parts)).hexdigest()
+
+
+class GrapherState(object):
+    """
+    Internal state of `revision_grapher` after a given row: the revisions of
+    the ongoing edges, their levels and colors, and the next free color.
+    """
+    def __init__(self, lastrev=None, revs=None, levels=None, rev_color=None,
+                 free_color=0):
+        self.lastrev = lastrev # last revision walked through
+        self.revs = revs or []
+        self.levels = levels or []
+        self.rev_color = rev_color or {}
+        self.free_color = free_color
+
+    def copy(self):
+        """Return a snapshot of the state, dropping colors of revisions which
+        are not needed anymore"""
+        return GrapherState(self.lastrev, self.revs[:], self.levels[:],
+                            dict((rev, self.rev_color[rev])
+                                 for rev in self.revs),
+                            self.free_color)
+
+    def encode(self, data):
+        """Append the state to the ``data`` array"""
+        data.extend((self.lastrev, self.free_color, len(self.revs)))
+        data.extend(self.revs)
+        data.extend(bool(level) for level in self.levels)
+        data.extend(self.rev_color[rev] for rev in self.revs)
+
+    @classmethod
+    def decode(cls, data, pos, end):
+        """Return the state encoded between offsets ``pos`` and ``end`` of the
+        ``data`` array"""
+        lastrev, free_color, nrevs = data[pos:pos + 3]
+        pos += 3
+        if pos + 3 * nrevs != end:
+            raise ValueError('malformed grapher state')
+        revs = data[pos:pos + nrevs].tolist()
+        levels = [bool(level) for level in data[pos + nrevs:pos + 2 * nrevs]]
+        colors = data[pos + 2 * nrevs:end].tolist()
+        return cls(lastrev, revs, levels, dict(zip(revs, colors)), free_color)
+
+# ``row`` is the number of rows walked through and ``state`` the grapher state
+# after the last of them.
+Checkpoint = namedtuple('Checkpoint', 'row state')
+
+
+class GraphLayoutCache(object):
+    """
+    Layout rows of one grapher configuration stored in the repository cache
+    directory.
+
+    The file holds a header line with the layout key, a line with the
+    `LayoutStamp` of the repository and the working directory parents, then
+    chunks of rows stored as columns of native integers (see
+    `hggraph.GraphRows`). Every chunk but the last one of a complete layout
+    ends with a checkpoint. Chunks are appended as the graph is built, so an
+    interrupted layout is resumed from its last checkpoint by later launches.
+
+    If changesets were added to the repository since the file was written,
+    its layout is kept as ``previous``, a `GraphLayoutCache` whose rows may
+    be reused by `hggraph.Graph.splice`.
+
+    ``options`` are the keyword arguments of `revision_grapher` and ``state``
+    the `GrapherState` instance it keeps up to date. If ``persistent`` is
+    False, checkpoints are only kept in memory.
+    """
+    def __init__(self, repo, options, state, step=CHECKPOINT_STEP,
+                 persistent=True):
+        self.repo = repo
+        self.options = options
+        self.state = state
+        self.step = step
+        self.persistent = persistent
+        self.filename = None
+        self.key = None
+        self.repostate = None # `RepoState` of repo when the layout is opened
+        self.stamp = None # `LayoutStamp` of repostate
+        self.wdparents = ()
+        self.previous = None
+        self.rows = None
+        self.checkpoints = []
+        self.ncached = 0 # number of rows read from disk
+        self.complete = False
+        self._chunkrows = 0 # number of rows already written
+        self._size = None # expected size of the file, None if not writable
+
+    def _header(self):
+        stamp = self.stamp
+        return 'hgview-graph %s\n%i %s %s %s\n' % (
+            self.key, stamp.nrevs, hex(stamp.tip), stamp.digest,
+            ','.join(hex(node) for node in self.wdparents) or '-')
+
+    def open(self, wdparents, rows):
+        """Compute the layout key and read rows stored in the cache file into
+        ``rows`` (an empty `hggraph.GraphRows` instance)
+
+        ``wdparents`` are the nodes of working directory parents if the
+        working directory row is displayed (empty otherwise).
+
+        Return True if cached rows are available. Otherwise, rows of a
+        layout computed before changesets were added are kept in
+        ``previous`` if the file holds one.
+        """
+        self.key = layoutkey(wdparents, self.options)
+        self.filename = 'cache/hgview-graph-%s' % self.key[:12]
+        self.repostate = repostate(self.repo)
+        self.stamp = layoutstamp(self.repostate, self.options)
+        self.wdparents = tuple(wdparents)
+        self.rows = rows
+        self._size = 0
+        if not self.persistent:
+            self._size = None
+            return False
+        try:
+            fobj = self.repo.opener(self.filename, 'rb')
+            try:
+                content = fobj.read()
+            finally:
+                fobj.close()
+        except (IOError, OSError):
+            return False
+        stored = self._read(content, type(rows)())
+        if stored is None:
+            return False
+        if stored.stamp != self.stamp or stored.wdparents != self.wdparents:
+            if appended(self.repo, stored.stamp, self.repostate,
+                        self.options):
+                self.previous = stored
+            return False
+        rows.extend(stored.rows.columns(0, len(stored.rows)),
+                    stored.rows.max_cols)
+        self.checkpoints = stored.checkpoints
+        self.complete = stored.complete
+        self.ncached = self._chunkrows = len(rows)
+        if self.complete:
+            self._size = None
+        else:
+            self._size = len(content)
+        return True
+
+    def _read(self, content, rows):
+        """Return a `GraphLayoutCache` holding the layout stored in the
+        ``content`` of a cache file, read into ``rows``, None if it is not
+        valid."""
+        header = 'hgview-graph %s\n' % self.key
+        if not content.startswith(header):
+            return None
+        end = content.find('\n', len(header)) + 1
+        fields = content[len(header):end].split()
+        if not end or len(fields) != 4:
+            return None
+        data = array('i')
+        if (len(content) - end) % data.itemsize:
+            return None
+        data.fromstring(content[end:])
+        stored = GraphLayoutCache(self.repo, self.options, None,
+                                  self.step, False)
+        try:
+            stored.stamp = LayoutStamp(int(fields[0]), bin(fields[1]),
+                                       fields[2])
+            if fields[3] != '-':
+                stored.wdparents = tuple(bin(node)
+                                         for node in fields[3].split(','))
+            valid = stored._parse(data, rows)
+        except (IndexError, ValueError, TypeError):
+            valid = False
+        if not valid or not len(rows):
+            return None
+        stored.rows = rows
+        return stored
+
+    def _parse(self, data, rows):
+        """Read chunks of the ``data`` array into ``rows``. Return False if it
+        is malformed."""
+        pos, end = 0, len(data)
+        while pos < end and not self.complete:
+            length, kind, nrows, maxcols = data[pos:pos + 4]
+            chunkend = pos + length
+            if length < 4 or chunkend > end:
+                return False
+            pos += 4
+            columns = []
+            for idx in xrange(7):
+                size = data[pos]
+                if size < 0 or pos + 1 + size > chunkend:
+                    return False
+                columns.append(data[pos + 1:pos + 1 + size])
+                pos += 1 + size
+            if len(columns[0]) != nrows:
+                return False
+            rows.extend(columns, maxcols)
+            if kind == CHUNK_END:
+                self.complete = True
+            elif kind == CHUNK_CHECKPOINT:
+                state = GrapherState.decode(data, pos, chunkend)
+                self.checkpoints.append(Checkpoint(len(rows), state))
+            else:
+                return False
+            pos = chunkend
+        return pos == end
+
+    def record(self, state=None):
+        """Take a checkpoint if needed once a new row was added.
+
+        ``state`` is the grapher state after this row if it is not the one
+        given at creation (see `hggraph.GrapherThread`).
+        """
+        if len(self.rows) - self._chunkrows < self.step:
+            return
+        if state is None:
+            state = self.state
+        if state.lastrev == self.rows.revs[-1]:
+            self.checkpoint(state)
+
+    def checkpoint(self, state=None):
+        """Save the grapher state and write pending rows"""
+        if state is None:
+            state = self.state
+        state = state.copy()
+        self.checkpoints.append(Checkpoint(len(self.rows), state))
+        self._flush(CHUNK_CHECKPOINT, state)
+
+    def finish(self):
+        """Mark the layout as complete and write pending rows"""
+        self.complete = True
+        if self.rows is not None:
+            self._flush(CHUNK_END)
+
+    def resume(self):
+        """Return a copy of the grapher state at the last checkpoint, and make
+        it the state to be saved by next checkpoints."""
+        self.state = self.checkpoints[-1].state.copy()
+        return self.state
+
+    def adopt(self, checkpoints, complete):
+        """Replace the content of the cache file by current rows, given the
+        ``checkpoints`` taken along them and whether they are ``complete``.
+        """
+        self.checkpoints = []
+        self.complete = False
+        self._chunkrows = 0
+        if self._size is not None:
+            self._size = 0
+        for checkpoint in checkpoints:
+            self.checkpoints.append(checkpoint)
+            self._flush(CHUNK_CHECKPOINT, checkpoint.state, checkpoint.row)
+        if complete:
+            self.finish()
+
+    def _flush(self, kind, state=None, stop=None):
+        if stop is None:
+            stop = len(self.rows)
+        start = self._chunkrows
+        chunk = array('i', (0, kind, stop - start,
+                            self.rows.maxcols(start, stop)))
+        for column in self.rows.columns(start, stop):
+            chunk.append(len(column))
+            chunk.extend(column)
+        if state is not None:
+            state.encode(chunk)
+        chunk[0] = len(chunk)
+        self._chunkrows = stop
+        self._write(chunk.tostring())
+
+    def _write(self, content):
+        """Append ``content`` to the cache file"""
+        if self._size is None:
+            return
+        try:
+            if not self._size:
+                fobj = self.repo.opener(self.filename, 'wb', atomictemp=True)
+                fobj.write(self._header())
+                fobj.write(content)
+                fobj.close()
+                self._size = len(self._header()) + len(content)
+                return
+            fobj = self.repo.opener(self.filename, 'ab')
+            try:
+                fobj.seek(0, os.SEEK_END)
+                if fobj.tell() != self._size:
+                    # file modified by another process
+                    self._size = None
+                    return
+                fobj.write(content)
+            finally:
+                fobj.close()
+            self._size += len(content)
+        except (IOError, OSError, util.Abort):
+            # Abort may be raised by read only opener
+            self._size = None
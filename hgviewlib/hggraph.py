@@ -21,21 +21,36 @@ revision grapher.
 import os
 from cStringIO import StringIO
 import difflib
+import threading
+import Queue
+from array import array
 from itertools import chain, count
 from time import strftime, localtime
 from functools import partial
 
-from mercurial.node import nullrev
+from mercurial.node import nullrev, nullid
 from mercurial import patch, util, match, error, hg
 
 import hgviewlib.hgpatches # force apply patches to mercurial
-from hgviewlib.hgpatches import mqsupport, phases, hiddenrevs
+from hgviewlib.hgpatches import mqsupport, phases, hiddenrevs, phaseroots
+from hgviewlib.hgpatches import phaserevs
 
-from hgviewlib.util import tounicode, isbfile, first_known_precursors, build_repo
+from hgviewlib.util import tounicode, isbfile, build_repo, LRUCache, isnode
 from hgviewlib.config import HgConfig
+from hgviewlib.graphcache import GraphLayoutCache, GrapherState, Checkpoint
+from hgviewlib.graphcache import appended
+from hgviewlib.branchcache import branchindex, branchsummary
+from hgviewlib.logcache import logcolumns
+from hgviewlib.markcache import markindex
+from hgviewlib.obscache import obsindex
+from hgviewlib.statuscache import repostatus
+from hgviewlib.diffcache import filedatacache, changesetdiff, decodediff
 
 DATE_FMT = '%F %R'
 
+# number of checkpoints of a previous layout tried when splicing it
+SPLICE_TRIES = 3
+
 def diff(repo, ctx1, ctx2=None, files=None):
     """
     Compute the diff of ``files`` between the 2 contexts ``ctx1`` and ``ctx2``.
@@ -67,53 +82,77 @@ def diff(repo, ctx1, ctx2=None, files=None):
     except:
         diffdata = '\n'.join(patch.diff(repo, ctx2.node(), ctx1.node(),
                                         match=matchfn, opts=diffopts))
-    # XXX how to deal diff encodings?
-    try:
-        diffdata = unicode(diffdata, "utf-8")
-    except UnicodeError:
-        # XXX use a default encoding from config?
-        diffdata = unicode(diffdata, "iso-8859-15", 'ignore')
-    return diffdata
+    return decodediff(diffdata)
 
 
-def __get_parents(repo, rev, branch=None):
+def __get_parents(repo, rev):
     """
-    Return non-null parents of `rev`. If branch is given, only return
-    parents that belongs to names branch `branch` (beware that this is
-    much slower).
+    Return non-null parents of `rev`.
     """
-    if not branch:
-        if rev is None:
-            return [x.rev() for x in repo.changectx(None).parents() if x]
-        return [x for x in repo.changelog.parentrevs(rev) if x != nullrev]
     if rev is None:
-        return [x.rev() for x in repo.changectx(None).parents() \
-                if x and repo.changectx(rev).branch() == branch]
-    return [x for x in repo.changelog.parentrevs(rev) \
-            if (x != nullrev and repo.changectx(rev).branch() == branch)]
+        return [x.rev() for x in repo.changectx(None).parents() if x]
+    return [x for x in repo.changelog.parentrevs(rev) if x != nullrev]
+
+def _incache(ctx):
+    """Return True if ``ctx`` is a changeset of the log caches (not the
+    working directory nor an unapplied mq patch, whose rev is its name)"""
+    return isinstance(ctx.rev(), int)
 
 def getlog(model, ctx, gnode):
-    if ctx.rev() is not None:
+    if _incache(ctx):
+        msg = logcolumns(model.repo).summary(ctx.rev())
+    elif ctx.rev() is not None: # unapplied mq patch
         msg = tounicode(ctx.description())
         if msg:
             msg = msg.splitlines()[0]
-    else:
+    elif model.wd_status is None:
+        msg = "WORKING DIRECTORY (checking for local modifications)"
+    elif [True for st in model.wd_status[0] if st]:
         msg = "WORKING DIRECTORY (locally modified)"
+    else:
+        msg = "WORKING DIRECTORY"
     return msg
 
 def gettags(model, ctx, gnode):
     if ctx.rev() is None:
         return ""
     mqtags = ['qbase', 'qtip', 'qparent']
-    tags = ctx.tags()
+    if _incache(ctx):
+        tags = markindex(model.repo).tags(ctx.rev())
+    else:
+        tags = ctx.tags()
     if model.hide_mq_tags:
         tags = [t for t in tags if t not in mqtags]
     return ",".join(tags)
 
+def getbookmarks(model, ctx, gnode):
+    if not _incache(ctx):
+        # bookmarks of the parents for the working directory
+        return ctx.bookmarks()
+    return markindex(model.repo).bookmarks(ctx.rev())
+
+def getauthor(model, ctx, gnode):
+    if ctx.rev() is None:
+        return u''
+    if not _incache(ctx):
+        return tounicode(ctx.user())
+    return logcolumns(model.repo).user(ctx.rev())
+
+def getbranch(model, ctx, gnode):
+    if not _incache(ctx):
+        return ctx.branch()
+    return logcolumns(model.repo).branch(ctx.rev())
+
+def getrevdate(model, ctx, gnode):
+    if not _incache(ctx):
+        return ctx.date()
+    return logcolumns(model.repo).date(ctx.rev())
+
 def getdate(model, ctx, gnode):
-    if not ctx.date():
+    date = getrevdate(model, ctx, gnode)
+    if not date:
         return ""
-    return strftime(DATE_FMT, localtime(int(ctx.date()[0])))
+    return strftime(DATE_FMT, localtime(int(date[0])))
 
 def ismerge(ctx):
     """
@@ -124,38 +163,53 @@ def ismerge(ctx):
         return len(ctx.parents()) == 2 and ctx.parents()[1]
     return False
 
-def _graph_iterator(repo, start_rev, stop_rev, reorder=False):
+def _graph_iterator(repo, start_rev, stop_rev, reorder=False, after=None):
     """Iter through revisions from start_rev to stop_rev (included)
     Handle Working directory as None.
+
+    If after is set, iteration goes on just after this revision.
     """
     # check parameters
     assert start_rev is None or start_rev >= stop_rev
     assert start_rev < len(repo)
     if start_rev is None:
-        yield start_rev
+        if after is None:
+            yield start_rev
         start_rev = len(repo.changelog) -1
 
     target_revs = xrange(start_rev, stop_rev-1, -1)
-    phaserevs = None
-    if getattr(repo, '_phasecache', None) is not None:
-        phaserevs = repo._phasecache._phaserevs
-    elif getattr(repo, '_phaserev', None) is not None:
-        phaserevs = repo._phaserev
-    if not reorder or phaserevs is None:
+    revphases = phaserevs(repo)
+    if not reorder or revphases is None:
         # old hg
+        if after is not None:
+            target_revs = xrange(after - 1, stop_rev - 1, -1)
         for curr_rev in target_revs:
             yield curr_rev
     else:
-        _cmp = lambda a, b: cmp(phases.public == phaserevs[a],
-                                phases.public == phaserevs[b])
-        for r in sorted(target_revs, cmp=_cmp):
-            yield r
+        # non public revisions first, then public ones. The former are all
+        # descendants of phase roots, so there is no need to look for them
+        # below the lowest root.
+        nodemap = repo.changelog.nodemap
+        roots = [nodemap[node] for nodes in phaseroots(repo)[phases.draft:]
+                 for node in nodes if node in nodemap]
+        lowest = max(min(roots or [start_rev + 1]), stop_rev)
+        top = start_rev
+        if after is not None:
+            top = after - 1
+        if after is None or revphases[after] != phases.public:
+            for curr_rev in xrange(top, lowest - 1, -1):
+                if revphases[curr_rev] != phases.public:
+                    yield curr_rev
+            top = start_rev
+        for curr_rev in xrange(top, stop_rev - 1, -1):
+            if curr_rev < lowest or revphases[curr_rev] == phases.public:
+                yield curr_rev
 
 
 
 def revision_grapher(repo, start_rev=None, stop_rev=0, branch=None, follow=False,
                      show_hidden=False, reorder=False, closed=False,
-                     show_obsolete=False):
+                     show_obsolete=False, state=None, show_wd=True):
     """incremental revision grapher
 
     This generator function walks through the revision history from
@@ -172,93 +226,143 @@ def revision_grapher(repo, start_rev=None, stop_rev=0, branch=None, follow=False
 
     If start_rev is -1, shown unapplied mq patches (if available)
 
-    If start_rev is None, started from working directory node
+    If start_rev is None, started from working directory node, whether it
+    holds local changes or not (see `Graph.removewd`), unless show_wd is
+    False.
 
     If follow is True, only generated the subtree from the start_rev head.
 
     If branch is set, only generated the subtree for the given named branch.
 
+    If state is set, it is a `GrapherState` instance kept up to date at each
+    yielded row. If it comes from a previous walk, the walk is resumed just
+    after the last revision it went through.
+
     """
     # follow is disabled when start_rev is None (== not revision specified)
     follow = start_rev is not None and follow # disable follow is start_rev is None
 
-    if show_hidden and start_rev == None and hasattr(repo, 'mq'):
-        series = list(reversed(repo.mq.series))
-        for patchname in series:
-            if not repo.mq.isapplied(patchname):
-                yield (patchname, 0, 0, [(0, 0 ,0, False)], [])
-
-    # No uncommitted change
-    if start_rev is None and repo.status() == ([],)*7:
+    if state is None:
+        state = GrapherState()
+    resumed = state.lastrev
+    if resumed is not None:
+        # unapplied patches and working directory were already walked
+        if start_rev is None:
+            start_rev = len(repo.changelog) -1
+    else:
+        if show_hidden and start_rev == None and hasattr(repo, 'mq'):
+            series = list(reversed(repo.mq.series))
+            for patchname in series:
+                if not repo.mq.isapplied(patchname):
+                    yield (patchname, 0, 0, [(0, 0 ,0, False)], [])
+    if start_rev is None and not show_wd:
         start_rev = len(repo.changelog) -1
+
     assert start_rev is None or start_rev >= stop_rev
 
     # all known revs for this line. This is used to compute column index
     # it's combined with next_revs to compute how we must draw lines
-    revs = []
-    levels = []     # a rev -> level mapping.
-                    # level are True for real relation (parent),
-                    #            False for weak one (obsolete)
-    rev_color = {}
-    free_color = count(0)
+    revs = state.revs
+    levels = state.levels # a rev -> level mapping.
+                          # level are True for real relation (parent),
+                          #            False for weak one (obsolete)
+    rev_color = state.rev_color
+    # rev -> index of revs, kept up to date from one row to the next one
+    positions = dict((rev, idx) for idx, rev in enumerate(revs))
     excluded = () if show_hidden else hiddenrevs(repo)
-    closedbranches = [tag for tag, node in repo.branchtags().items()
-                      if repo.lookup(node) not in repo.branchheads(tag, closed=False)]
-    for curr_rev in _graph_iterator(repo, start_rev, stop_rev, not show_hidden and reorder):
+    closedbranches = () if closed else branchsummary(repo).closed
+    if show_obsolete:
+        obsolete = obsindex(repo, excluded)
+    if branch or closedbranches:
+        # compare branch identifiers instead of reading branch names
+        index = branchindex(repo)
+        branchid = index.branchid(branch)
+        closedbranches = frozenset(index.branchid(name)
+                                   for name in closedbranches)
+        wdbranch = repo[None].branch()
+        if wdbranch == branch:
+            wdbranch = branchid
+        else:
+            wdbranch = index.ids.get(wdbranch, -2)
+        revbranches = index.branches
+        branchof = lambda rev: wdbranch if rev is None else revbranches[rev]
+    for curr_rev in _graph_iterator(repo, start_rev, stop_rev,
+                                    not show_hidden and reorder, resumed):
         # Compute revs and next_revs.
         if curr_rev in excluded:
             continue
-        if curr_rev not in revs: # rev not ancestor of already processed node
+        if curr_rev not in positions: # rev not ancestor of already processed node
             # shall we ignore this new heads ?
-            if (branch and repo[curr_rev].branch() != branch) or \
+            if (branch and branchof(curr_rev) != branchid) or \
                (follow and curr_rev != start_rev) or \
-               (not closed and repo[curr_rev].branch() in closedbranches):
+               (closedbranches and branchof(curr_rev) in closedbranches):
                 continue
             # we add this new head to know revision
+            positions[curr_rev] = len(revs)
             revs.append(curr_rev)
             levels.append(True)
-            rev_color[curr_rev] = curcolor = free_color.next()
+            rev_color[curr_rev] = curcolor = state.free_color
+            state.free_color += 1
         else:
             curcolor = rev_color[curr_rev]
-        # copy known revisions for this line
-        next_revs = revs[:]
+        # rev_index is also the column index
+        rev_index = positions.pop(curr_rev)
+        # copy known levels for this line
         next_levels = levels[:]
 
         # Add parents to next_revs.
-        parents = [(p, True) for p in __get_parents(repo, curr_rev, branch)]
+        if branch and branchof(curr_rev) != branchid:
+            # only the subtree of the branch is followed
+            parents = []
+        else:
+            parents = [(p, True) for p in __get_parents(repo, curr_rev)]
         if show_obsolete:
-            ctx = repo[curr_rev]
-            for prec in first_known_precursors(ctx, excluded):
-                parents.append((prec.rev(), False))
+            parents.extend((prec, False)
+                           for prec in obsolete.precursors(curr_rev))
         parents_to_add = []
-        max_levels = dict(zip(next_revs, next_levels))
+        added_levels = {}
         for idx, (parent, level) in enumerate(parents):
-            # could have been added by another children
-            if parent not in next_revs:
-                parents_to_add.append(parent)
-                if idx == 0:  # first parent inherit the color
-                    rev_color[parent] = curcolor
-                else:  # second don't
-                    rev_color[parent] = free_color.next()
-            max_levels[parent] = level or max_levels.get(parent, False)
-        # rev_index is also the column index
-        rev_index = next_revs.index(curr_rev)
+            pos = positions.get(parent)
+            if pos is not None:
+                # already added by another children
+                next_levels[pos] = level or next_levels[pos]
+                continue
+            if parent in added_levels:
+                # both parent and precursor of curr_rev
+                added_levels[parent] = level or added_levels[parent]
+                continue
+            parents_to_add.append(parent)
+            if idx == 0:  # first parent inherit the color
+                rev_color[parent] = curcolor
+            else:  # second don't
+                rev_color[parent] = state.free_color
+                state.free_color += 1
+            added_levels[parent] = level or added_levels.get(parent, False)
         # replace curr_rev by its parents.
-        next_revs[rev_index:rev_index + 1] = parents_to_add
-        next_levels = [max_levels[r] for r in next_revs]
-
-        lines = []
-        for i, rev in enumerate(revs):
-            if rev == curr_rev:
-                # one or more line to parents
-                targets = parents
-            else:
-                # single line to the same rev
-                targets = [(rev, levels[i])]
-            for trg, level in targets:
-                color = rev_color[trg]
-                lines.append((i, next_revs.index(trg), color, level))
-
+        next_revs = revs[:rev_index] + parents_to_add + revs[rev_index + 1:]
+        next_levels[rev_index:rev_index + 1] = [added_levels[r]
+                                                for r in parents_to_add]
+        # following edges are shifted by the number of added parents minus
+        # the one of curr_rev
+        shift = len(parents_to_add) - 1
+        if shift:
+            for idx in xrange(rev_index + 1, len(revs)):
+                positions[revs[idx]] += shift
+        for idx, parent in enumerate(parents_to_add):
+            positions.setdefault(parent, rev_index + idx)
+
+        # single line to the same rev for other edges, one or more line to
+        # parents for curr_rev
+        lines = [(i, i, rev_color[rev], levels[i])
+                 for i, rev in enumerate(revs[:rev_index])]
+        lines.extend((rev_index, positions[trg], rev_color[trg], level)
+                     for trg, level in parents)
+        lines.extend((i, i + shift, rev_color[revs[i]], levels[i])
+                     for i in xrange(rev_index + 1, len(revs)))
+
+        state.lastrev = curr_rev
+        state.revs = next_revs
+        state.levels = next_levels
         yield (curr_rev, rev_index, curcolor, lines, parents)
         revs = next_revs
         levels = next_levels
@@ -335,6 +439,9 @@ class GraphNode(object):
     Simple class to encapsulate e hg node in the revision graph. Does
     nothing but declaring attributes.
     """
+    __slots__ = ('rev', 'x', 'color', 'cols', 'parents', 'bottomlines',
+                 'toplines', 'extra')
+
     def __init__(self, rev, xposition, color, lines, parents, ncols=None,
                  extra=None):
         self.rev = rev
@@ -350,46 +457,363 @@ class GraphNode(object):
         self.toplines = []
         self.extra = extra
 
+class GrapherThread(threading.Thread):
+    """
+    Worker thread running `revision_grapher` with ``options`` on ``repo``,
+    which must not be used by other threads.
+
+    Rows are pushed by batches of ``batchsize`` into a queue. Iterating over
+    the thread object returns them, waiting for the next batch if needed.
+    `available` only returns rows already computed.
+    """
+    def __init__(self, repo, options, state=None, batchsize=100):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.repo = repo
+        self.options = options
+        self.batchsize = batchsize
+        if state is None:
+            state = GrapherState()
+        self._state = state # updated by the worker thread
+        # grapher state after the last row returned, only up to date at the
+        # end of each batch
+        self.state = GrapherState()
+        self.finished = False
+        self._queue = Queue.Queue()
+        self._stopped = threading.Event()
+        self._running = False
+        self._batch = []
+        self._batchstate = None
+        self._pos = 0
+
+    def run(self):
+        batch = []
+        try:
+            for row in revision_grapher(self.repo, state=self._state,
+                                        **self.options):
+                if self._stopped.isSet():
+                    return
+                batch.append(row)
+                if len(batch) >= self.batchsize:
+                    self._queue.put((batch, self._state.copy()))
+                    batch = []
+        except Exception, err:
+            # raised again in the consumer thread
+            self._queue.put(err)
+            return
+        self._queue.put((batch, self._state.copy()))
+        self._queue.put(None)
+
+    def stop(self):
+        """Stop computing rows"""
+        self._stopped.set()
+
+    def _next(self, block):
+        if not self._running:
+            self._running = True
+            self.start()
+        while self._pos >= len(self._batch):
+            if self.finished:
+                raise StopIteration
+            item = self._queue.get(block)
+            if item is None:
+                self.finished = True
+                raise StopIteration
+            if isinstance(item, Exception):
+                self.finished = True
+                raise item
+            self._batch, self._batchstate = item
+            self._pos = 0
+        row = self._batch[self._pos]
+        self._pos += 1
+        if self._pos == len(self._batch):
+            self.state = self._batchstate
+        return row
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._next(True)
+
+    def available(self):
+        """Generator of rows already computed by the worker thread"""
+        while True:
+            try:
+                row = self._next(False)
+            except (Queue.Empty, StopIteration):
+                return
+            yield row
+
+class WorkingDirStatus(threading.Thread):
+    """
+    Worker thread computing the status of the working directory of ``repo``,
+    which must not be used by other threads, against each of its parent
+    ``nodes``.
+
+    Once the thread is done, ``status`` holds the lists of modified, added,
+    removed and deleted files for each parent, unless an exception was
+    raised. It is then stored as ``error``.
+    """
+    def __init__(self, repo, nodes):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.repo = repo
+        self.nodes = nodes
+        self.status = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.status = [self.repo.status(node, None)[:4]
+                           for node in self.nodes]
+        except Exception, err:
+            # raised again in the consumer thread
+            self.error = err
+
+class GraphRows(object):
+    """
+    Columnar storage of the rows yielded by a grapher for history revisions.
+
+    Revision, column and color of rows are stored in integer arrays. Edges
+    and parents are flattened in integer buffers, indexed by the arrays of
+    their end offset for each row.
+    """
+    def __init__(self):
+        self.revs = array('i')
+        self.xs = array('i')
+        self.colors = array('i')
+        self.lineends = array('i')
+        self.lines = array('i') # (start, end, color, fill) for each edge
+        self.parentends = array('i')
+        self.parents = array('i') # (parent, level) for each parent
+        self.max_cols = 0
+
+    def __len__(self):
+        return len(self.revs)
+
+    def append(self, rev, xpos, color, lines, parents):
+        self.revs.append(rev)
+        self.xs.append(xpos)
+        self.colors.append(color)
+        for start, end, lcolor, fill in lines:
+            self.lines.extend((start, end, lcolor, bool(fill)))
+        self.lineends.append(len(self.lines))
+        for parent, level in parents:
+            self.parents.extend((parent, bool(level)))
+        self.parentends.append(len(self.parents))
+        self.max_cols = max(self.max_cols, len(lines) + (not parents))
+
+    def bottomlines(self, row):
+        lines = self.lines
+        start = row and self.lineends[row - 1]
+        return [(lines[idx], lines[idx + 1], lines[idx + 2], bool(lines[idx + 3]))
+                for idx in xrange(start, self.lineends[row], 4)]
+
+    def parentlist(self, row):
+        parents = self.parents
+        start = row and self.parentends[row - 1]
+        return [(parents[idx], bool(parents[idx + 1]))
+                for idx in xrange(start, self.parentends[row], 2)]
+
+    def columns(self, start, stop):
+        """Return arrays holding rows from ``start`` to ``stop``"""
+        linestart = start and self.lineends[start - 1]
+        parentstart = start and self.parentends[start - 1]
+        lineend = stop and self.lineends[stop - 1]
+        parentend = stop and self.parentends[stop - 1]
+        return [self.revs[start:stop], self.xs[start:stop],
+                self.colors[start:stop], self.lineends[start:stop],
+                self.lines[linestart:lineend], self.parentends[start:stop],
+                self.parents[parentstart:parentend]]
+
+    def maxcols(self, start, stop):
+        """Return the maximum number of columns of rows from ``start`` to
+        ``stop``"""
+        maxcols = 0
+        lineend = start and self.lineends[start - 1]
+        parentend = start and self.parentends[start - 1]
+        for row in xrange(start, stop):
+            nlines = (self.lineends[row] - lineend) // 4
+            root = self.parentends[row] == parentend
+            maxcols = max(maxcols, nlines + root)
+            lineend = self.lineends[row]
+            parentend = self.parentends[row]
+        return maxcols
+
+    def extend(self, columns, maxcols):
+        """Add rows held in ``columns`` (as returned by `columns`). Raise
+        ValueError if they are inconsistent."""
+        revs, xs, colors, lineends, lines, parentends, parents = columns
+        nrows = len(revs)
+        if not (nrows == len(xs) == len(colors) == len(lineends)
+                == len(parentends)):
+            raise ValueError('inconsistent row columns')
+        if nrows and (lineends[-1] != len(self.lines) + len(lines)
+                      or parentends[-1] != len(self.parents) + len(parents)):
+            raise ValueError('inconsistent row columns')
+        self.revs.extend(revs)
+        self.xs.extend(xs)
+        self.colors.extend(colors)
+        self.lineends.extend(lineends)
+        self.lines.extend(lines)
+        self.parentends.extend(parentends)
+        self.parents.extend(parents)
+        self.max_cols = max(self.max_cols, maxcols)
+
+    def extendrows(self, rows, start, stop):
+        """Add rows from ``start`` to ``stop`` of the `GraphRows` ``rows``"""
+        columns = rows.columns(start, stop)
+        # end offsets are relative to the buffers of rows
+        linedelta = len(self.lines) - (start and rows.lineends[start - 1])
+        parentdelta = len(self.parents) - (start and rows.parentends[start - 1])
+        columns[3] = array('i', [end + linedelta for end in columns[3]])
+        columns[5] = array('i', [end + parentdelta for end in columns[5]])
+        self.extend(columns, rows.maxcols(start, stop))
+
 class Graph(object):
     """
     Graph object to ease hg repo navigation. The Graph object
     instantiate a `revision_grapher` generator, and provide a `fill`
     method to build the graph progressively.
+
+    Rows of history revisions are kept in a `GraphRows` instance, `GraphNode`
+    objects are created on demand when rows are accessed.
+
+    If a `GraphLayoutCache` is given as ``layout``, history rows are read
+    from the on-disk cache when possible.
     """
     #@timeit
-    def __init__(self, repo, grapher, maxfilesize=100000):
+    def __init__(self, repo, grapher, maxfilesize=100000, layout=None,
+                 filecache=None):
         self.maxfilesize = maxfilesize
+        self.filecache = filecache # `FileDataCache` of `filedata` results
         self.repo = repo
         self.maxlog = len(self.repo.changelog)
         self.grapher = grapher
-        self.nodes = []
-        self.nodesdict = {}
-        self.max_cols = 0
+        self.layout = layout
+        # rows before history ones (unapplied patches, working directory)
+        self.toprows = []
+        self.rows = GraphRows()
+        self.extras = {} # row -> extra data yielded by the grapher
+        self._nodes = {} # row -> recently accessed GraphNode
+        # rows may be built from the thread of a `GotoQuery`
+        self._lock = threading.RLock()
+        # rev -> row of history rows (-1 if not in the graph), filled when
+        # needed by `index`
+        self._revrows = array('i', [-1]) * self.maxlog
+        self._nindexed = 0
+
+    @property
+    def max_cols(self):
+        return max([self.rows.max_cols] + [gnode.cols for gnode in self.toprows])
+
+    def _append(self, vnext):
+        nrev, xpos, color, lines, parents = vnext[:5]
+        if vnext[5:]:
+            self.extras[len(self)] = vnext[5:]
+        if isinstance(nrev, int):
+            self.rows.append(nrev, xpos, color, lines, parents)
+        else:
+            self.toprows.append(GraphNode(nrev, xpos, color, lines, parents))
 
-    def build_nodes(self, nnodes=None, rev=None):
+    def _openlayout(self, previous=True):
+        """Build rows which are not stored in the layout cache (unapplied
+        patches and working directory), then load cached rows.
+
+        If the cache holds the layout of the repository before changesets
+        were added, its rows are reused through `splice` unless
+        ``previous`` is False."""
+        layout = self.layout
+        wdparents = ()
+        for vnext in self.grapher:
+            if vnext is None:
+                continue
+            if isinstance(vnext[0], int):
+                break
+            if vnext[0] is None:
+                wdparents = [ctx.node() for ctx in self.repo[None].parents()]
+            self._append(vnext)
+        else:
+            self.grapher = None
+            return
+        if not layout.open(wdparents, self.rows):
+            stored, layout.previous = layout.previous, None
+            if previous and stored is not None and stored.checkpoints:
+                self._spliceprevious(stored, vnext)
+                return
+            self._append(vnext)
+            layout.record(getattr(self.grapher, 'state', None))
+            return
+        grapher = self.grapher
+        if self.isthreaded():
+            grapher.stop()
+        if layout.complete:
+            self.grapher = None
+        elif self.isthreaded():
+            self.grapher = GrapherThread(grapher.repo, grapher.options,
+                                         layout.resume(), grapher.batchsize)
+        else:
+            self.grapher = revision_grapher(self.repo, state=layout.resume(),
+                                            **layout.options)
+
+    def _spliceprevious(self, stored, vnext):
+        """Reuse rows of the ``stored`` layout read by `_openlayout`, given
+        the first history row ``vnext`` yielded by the grapher"""
+        layout = self.layout
+        old = Graph(self.repo, None, layout=stored)
+        old.rows = stored.rows
+        grapher = self.grapher
+        threaded = self.isthreaded()
+        if threaded:
+            # new rows are walked again in this thread, up to a checkpoint
+            grapher.stop()
+            layout.state = GrapherState()
+            self.grapher = (row for row in revision_grapher(
+                self.repo, state=layout.state, **layout.options)
+                            if isinstance(row[0], int))
+        else:
+            self.grapher = (row for row in chain([vnext], grapher))
+        self._splice(old)
+        if threaded and self.grapher is not None:
+            self.thread(grapher.repo, grapher.batchsize)
+
+    def build_nodes(self, nnodes=None, rev=None, block=True):
         """
         Build up to `nnodes` more nodes in our graph, or build as many
         nodes required to reach `rev`.
         If both rev and nnodes are set, build as many nodes as
         required to reach rev plus nnodes more.
+
+        If `block` is False and the grapher runs in a `GrapherThread`, only
+        nodes already computed are built.
         """
+        self._lock.acquire()
+        try:
+            return self._build_nodes(nnodes, rev, block)
+        finally:
+            self._lock.release()
+
+    def _build_nodes(self, nnodes, rev, block):
+        if self.grapher is not None and self.layout is not None \
+           and self.layout.key is None:
+            self._openlayout()
         if self.grapher is None:
             return False
         stopped = False
-        mcol = [self.max_cols]
-        for vnext in self.grapher:
+        layout = self.layout
+        grapher = rows = self.grapher
+        if not block and self.isthreaded():
+            rows = grapher.available()
+        for vnext in rows:
             if vnext is None:
                 continue
-            nrev, xpos, color, lines, parents = vnext[:5]
+            nrev = vnext[0]
             if isinstance(nrev, int) and nrev >= self.maxlog:
                 continue
-            gnode = GraphNode(nrev, xpos, color, lines, parents,
-                              extra=vnext[5:])
-            if self.nodes:
-                gnode.toplines = self.nodes[-1].bottomlines
-            self.nodes.append(gnode)
-            self.nodesdict[nrev] = gnode
-            mcol.append(gnode.cols)
+            self._append(vnext)
+            if layout is not None:
+                layout.record(getattr(grapher, 'state', None))
             if rev is not None and nrev <= rev:
                 rev = None # we reached rev, switching to nnodes counter
             if rev is None:
@@ -400,15 +824,183 @@ class Graph(object):
                 else:
                     break
         else:
+            if rows is grapher or grapher.finished:
+                self.grapher = None
+                stopped = True
+                if layout is not None:
+                    layout.finish()
+        return not stopped
+
+    def splice(self, old):
+        """
+        Reuse rows of the `Graph` ``old`` of the same repository, built
+        before changesets were added to it.
+
+        Rows of the new changesets are built until the grapher state matches
+        one of the checkpoints of the layout of ``old``. Rows below it are
+        then taken from ``old`` instead of being computed again.
+
+        Return None if no row was reused, or a ``(start, oldstart, count)``
+        tuple meaning that ``count`` rows starting at index ``oldstart`` in
+        ``old`` are now at index ``start``.
+        """
+        self._lock.acquire()
+        try:
+            return self._splice(old)
+        finally:
+            self._lock.release()
+
+    def _splice(self, old):
+        layout, oldlayout = self.layout, old.layout
+        if layout is None or oldlayout is None or self.isthreaded() \
+           or oldlayout.stamp is None or not oldlayout.checkpoints \
+           or layout.options != oldlayout.options:
+            return None
+        if self.grapher is not None and layout.key is None:
+            # rows of ``old`` are the ones a stored layout would give
+            self._openlayout(previous=False)
+        if self.grapher is None or layout.ncached or \
+           not appended(self.repo, oldlayout.stamp, layout.repostate,
+                        layout.options):
+            return None
+        checkpoints = oldlayout.checkpoints[:]
+        pending = dict((checkpoint.state.lastrev, idx)
+                       for idx, checkpoint in enumerate(checkpoints))
+        oldnrevs = oldlayout.stamp.nrevs
+        tries = SPLICE_TRIES
+        for vnext in self.grapher:
+            if vnext[0] >= self.maxlog:
+                continue
+            self._append(vnext)
+            layout.record()
+            idx = pending.get(vnext[0])
+            if idx is None:
+                continue
+            checkpoint = checkpoints[idx]
+            colormap = self._matchstate(old, checkpoint, oldnrevs)
+            if colormap is not None:
+                break
+            tries -= 1
+            if not tries:
+                return None
+        else:
+            self.grapher = None
+            layout.finish()
+            return None
+
+        # new rows, drawn with the colors of the lanes they share with old
+        # ones. Other colors are made distinct from old ones.
+        freecolors = count(max(old.rows.colors) + 1)
+        def remap(color):
+            if color not in colormap:
+                colormap[color] = freecolors.next()
+            return colormap[color]
+        rows = self.rows
+        rows.colors = array('i', [remap(color) for color in rows.colors])
+        rows.lines[2::4] = array('i', [remap(color)
+                                       for color in rows.lines[2::4]])
+        for gnode in self.toprows:
+            gnode.color = remap(gnode.color)
+            gnode.bottomlines = [(start, end, remap(color), fill)
+                                 for start, end, color, fill
+                                 in gnode.bottomlines]
+        # old rows, up to the last checkpoint unless they are complete
+        start, complete = checkpoint.row, oldlayout.complete
+        if complete:
+            stop = len(old.rows)
+        else:
+            stop = checkpoints[-1].row
+        delta = len(rows) - start
+        rows.extendrows(old.rows, start, stop)
+        layout.adopt([Checkpoint(row + delta, ckstate)
+                      for row, ckstate in checkpoints[idx:]], complete)
+        if complete:
             self.grapher = None
-            stopped = True
+        else:
+            self.grapher = revision_grapher(self.repo, state=layout.resume(),
+                                            **layout.options)
+        self._nodes.clear()
+        self._revrows = array('i', [-1]) * self.maxlog
+        self._nindexed = 0
+        ntop = len(self.toprows)
+        return ntop + start + delta, len(old.toprows) + start, stop - start
+
+    def _matchstate(self, old, checkpoint, oldnrevs):
+        """Return a mapping from colors of the current grapher state to the
+        ones of the ``checkpoint`` of the `Graph` ``old`` if both states
+        match, None otherwise."""
+        state, ckstate = self.layout.state, checkpoint.state
+        if state.revs != ckstate.revs or state.levels != ckstate.levels:
+            return None
+        colormap = {}
+        for rev in state.revs:
+            color = ckstate.rev_color[rev]
+            if colormap.setdefault(state.rev_color[rev], color) != color:
+                return None
+        if len(set(colormap.itervalues())) != len(colormap):
+            return None
+        # rows above the checkpoint shall hold the same old revisions
+        oldrevs = [rev for rev in self.rows.revs if rev < oldnrevs]
+        if len(oldrevs) != checkpoint.row or \
+           not set(old.rows.revs[:checkpoint.row]).issuperset(oldrevs):
+            return None
+        return colormap
+
+    def thread(self, repo, batchsize=100):
+        """Go on computing rows in a `GrapherThread` working on ``repo``"""
+        self._lock.acquire()
+        try:
+            layout = self.layout
+            if self.grapher is None or self.isthreaded() or layout is None \
+               or layout.state.lastrev is None:
+                return
+            self.grapher.close()
+            layout.state = layout.state.copy()
+            self.grapher = GrapherThread(repo, layout.options, layout.state,
+                                         batchsize)
+        finally:
+            self._lock.release()
+
+    def removewd(self):
+        """
+        Remove the working directory row if it does not alter the layout of
+        other rows, that is if its only parent is the first history row.
 
-        self.max_cols = max(mcol)
-        return not stopped
+        Return the index the row had, -1 if it was not removed.
+        """
+        self._lock.acquire()
+        try:
+            if not len(self.rows):
+                self._build_nodes(1, None, True)
+            idx = len(self.toprows) - 1
+            if idx < 0 or self.toprows[idx].rev is not None \
+               or not len(self.rows):
+                return -1
+            parents = [parent for parent, level in self.toprows[idx].parents]
+            if parents != [self.rows.revs[0]]:
+                return -1
+            del self.toprows[idx]
+            self._nodes.clear()
+            self.extras = dict((row - (row > idx), extra)
+                               for row, extra in self.extras.iteritems()
+                               if row != idx)
+            return idx
+        finally:
+            self._lock.release()
 
     def isfilled(self):
         return self.grapher is None
 
+    def isthreaded(self):
+        """Return True if rows are computed in a `GrapherThread`"""
+        return isinstance(self.grapher, GrapherThread)
+
+    def close(self):
+        """Stop computing rows"""
+        if self.isthreaded():
+            self.grapher.stop()
+        self.grapher = None
+
     def fill(self, step=100):
         """
         Return a generator that fills the graph by bursts of `step`
@@ -418,57 +1010,94 @@ class Graph(object):
             yield len(self)
         yield len(self)
 
+    def _node(self, idx):
+        """Return a GraphNode view of the row ``idx``"""
+        gnode = self._nodes.get(idx)
+        if gnode is not None:
+            return gnode
+        ntop = len(self.toprows)
+        if idx < ntop:
+            return self.toprows[idx]
+        rows = self.rows
+        row = idx - ntop
+        gnode = GraphNode(rows.revs[row], rows.xs[row], rows.colors[row],
+                          rows.bottomlines(row), rows.parentlist(row),
+                          extra=self.extras.get(idx, ()))
+        if row:
+            gnode.toplines = rows.bottomlines(row - 1)
+        elif ntop:
+            gnode.toplines = self.toprows[-1].bottomlines
+        if len(self._nodes) > 1000:
+            self._nodes.clear()
+        self._nodes[idx] = gnode
+        return gnode
+
     def __getitem__(self, idx):
         if isinstance(idx, slice):
-            # XXX TODO: ensure nodes are built
-            return self.nodes.__getitem__(idx)
-        if idx >= len(self.nodes):
+            return [self._node(i) for i in xrange(*idx.indices(len(self)))]
+        if idx >= len(self):
             # build as many graph nodes as required to answer the
             # requested idx
             self.build_nodes(idx)
         if idx > len(self):
-            return self.nodes[-1]
-        return self.nodes[idx]
+            idx = -1
+        if idx < 0:
+            idx += len(self)
+            if idx < 0:
+                raise IndexError('graph index out of range')
+        if idx >= len(self):
+            raise IndexError('graph index out of range')
+        return self._node(idx)
 
     def __len__(self):
         # len(graph) is the number of actually built graph nodes
-        return len(self.nodes)
-
-    def index(self, rev):
-        if len(self) == 0: # graph is empty, let's build some nodes
-            self.build_nodes(10)
-        if rev is not None and rev < self.nodes[-1].rev:
-            self.build_nodes(self.nodes[-1].rev - rev)
-        if rev in self.nodesdict:
-            return self.nodes.index(self.nodesdict[rev])
+        return len(self.toprows) + len(self.rows)
+
+    def _indexrows(self):
+        """Update the rev -> row mapping with rows built since last call"""
+        revs, revrows = self.rows.revs, self._revrows
+        for row in xrange(self._nindexed, len(revs)):
+            revrows[revs[row]] = row
+        self._nindexed = len(revs)
+
+    def index(self, rev, build=True):
+        """Return the row of ``rev``, -1 if it is not displayed. Rows are
+        built down to ``rev`` unless ``build`` is False, -1 is then also
+        returned if its row is not built yet."""
+        if build:
+            if len(self) == 0: # graph is empty, let's build some nodes
+                self.build_nodes(10)
+            if rev is not None and len(self) and rev < self[-1].rev:
+                self.build_nodes(self[-1].rev - rev)
+        if isinstance(rev, int):
+            if not 0 <= rev < self.maxlog:
+                return -1
+            if self._nindexed < len(self.rows):
+                self._indexrows()
+            row = self._revrows[rev]
+            if row < 0:
+                return -1
+            return len(self.toprows) + row
+        for idx, gnode in enumerate(self.toprows):
+            if gnode.rev == rev:
+                return idx
         return -1
 
-    def fileflags(self, filename, rev, _cache={}):
+    def fileflags(self, filename, rev):
         """
         Return a couple of flags ('=', '+', '-' or '?') depending on the nature
         of the diff for filename between rev and its parents.
         """
-        if rev not in _cache:
-            ctx = self.repo.changectx(rev)
-            _cache.clear()
-            _cache[rev] = (ctx,
-                           [self.repo.status(p.node(), ctx.node())[:5]
-                           for p in ctx.parents()])
-        ctx, allchanges = _cache[rev]
+        ctx = self.repo.changectx(rev)
         flags = []
-        for changes in allchanges:
-            # changes = modified, added, removed, deleted, unknown
-            for flag, lst in zip(["=", "+", "-", "-", "?"], changes):
-                if filename in lst:
-                    if flag == "+":
-                        renamed = ctx.filectx(filename).renamed()
-                        if renamed:
-                            flags.append(renamed)
-                            break
-                    flags.append(flag)
-                    break
-            else:
-                flags.append('')
+        for parent in ctx.parents():
+            status = repostatus(self.repo, parent.node(), ctx.node())
+            flag = status.flag(filename)
+            if flag == "+":
+                renamed = ctx.filectx(filename).renamed()
+                if renamed:
+                    flag = renamed
+            flags.append(flag)
         return flags
 
     def fileflag(self, filename, rev):
@@ -479,7 +1108,7 @@ class Graph(object):
         return self.fileflags(filename, rev)[0]
 
     def filename(self, rev):
-        return self.nodesdict[rev].extra[0]
+        return self.extras[self.index(rev)][0]
 
     def filedata(self, filename, rev, mode='diff', flag=None):
         """XXX written under dubious encoding assumptions
@@ -516,40 +1145,80 @@ class Graph(object):
                     sym = ''
                 data = "File too big ! (~%i%so)" % (val, sym)
                 return flag, data
+            cached = self.filecache is not None and isnode(self.repo,
+                                                           ctx.node())
             if flag == "+" or mode == 'file':
-                flag = '+'
-                # return the whole file
-                data = fctx.data()
-                if util.binary(data):
-                    data = "binary file"
-                else: # tries to convert to unicode
-                    data = tounicode(data)
+                kind = 'file'
+                compute = partial(self._filecontent, fctx)
+                pnode = None
             elif flag == "=" or isinstance(mode, int):
-                flag = "="
+                kind = 'diff'
                 if isinstance(mode, int):
                     parentctx = self.repo.changectx(mode)
                 else:
-                    parentctx = self.repo[self._fileparent(fctx)]
-                data = diff(self.repo, ctx, parentctx, files=[filename])
-                # we assume that \n@@ marks the end of the diff header
-                data = ''.join(data.partition(os.linesep + '@@')[1:]).lstrip()
+                    parentctx = self._diffparent(ctx, fctx)
+                compute = partial(self._filediff, ctx, parentctx, filename)
+                if cached:
+                    try:
+                        pnode = parentctx.filectx(filename).filenode()
+                    except LookupError:
+                        pnode = nullid
             elif flag == '':
-                data = ''
+                return '', ''
             else: # file renamed
-                oldname, node = flag
-                newdata = fctx.data().splitlines()
-                olddata = self.repo.filectx(oldname, fileid=node)
-                olddata = olddata.data().splitlines()
-                data = list(difflib.unified_diff(olddata, newdata, oldname,
-                                                 filename))[2:]
-                if data:
-                    flag = "="
-                else:
-                    data = newdata
-                    flag = "+"
-                data = u'\n'.join(tounicode(elt) for elt in data)
+                kind = 'copy'
+                oldname, pnode = flag
+                compute = partial(self._copydiff, fctx, oldname, pnode)
+            if not cached:
+                return compute()
+            key = (pnode, fctx.filenode(), kind)
+            result = self.filecache.get(key)
+            if result is None:
+                result = self.filecache[key] = compute()
+            return result
         return flag, data
 
+    def _filecontent(self, fctx):
+        data = fctx.data()
+        if util.binary(data):
+            data = "binary file"
+        else: # tries to convert to unicode
+            data = tounicode(data)
+        return '+', data
+
+    def _diffparent(self, ctx, fctx):
+        """Return the changeset the diff of ``fctx`` is computed against:
+        the first parent of ``ctx`` if it holds the parent revision of the
+        file, so that files of ``ctx`` are diffed together"""
+        prev = self._fileparent(fctx)
+        pctx = ctx.p1()
+        if prev != -1 and isnode(self.repo, ctx.node()) and \
+               pctx.manifest().get(fctx.path()) == fctx.p1().filenode():
+            return pctx
+        return self.repo[prev]
+
+    def _filediff(self, ctx, parentctx, filename):
+        if isnode(self.repo, ctx.node()) and \
+               isnode(self.repo, parentctx.node()):
+            return '=', changesetdiff(self.repo, parentctx,
+                                      ctx).filediff(filename)
+        data = diff(self.repo, ctx, parentctx, files=[filename])
+        # we assume that \n@@ marks the end of the diff header
+        return '=', ''.join(data.partition(os.linesep + '@@')[1:]).lstrip()
+
+    def _copydiff(self, fctx, oldname, node):
+        newdata = fctx.data().splitlines()
+        olddata = self.repo.filectx(oldname, fileid=node)
+        olddata = olddata.data().splitlines()
+        data = list(difflib.unified_diff(olddata, newdata, oldname,
+                                         fctx.path()))[2:]
+        if data:
+            flag = "="
+        else:
+            data = newdata
+            flag = "+"
+        return flag, u'\n'.join(tounicode(elt) for elt in data)
+
     def _fileparent(self, fctx):
         try:
             return fctx.p1().rev()
@@ -568,6 +1237,10 @@ class HgRepoListWalker(object):
     _columns = ('ID', 'Branch', 'Log', 'Author', 'Date', 'Tags', 'Bookmarks')
     _stretchs = {'Log': 1, }
     _getcolumns = "getChangelogColumns"
+    # compute the graph in a `GrapherThread`
+    threaded_fill = False
+    # budget of the data cache, see `_newdatacache`
+    datacache_size = 20000
 
     def __init__(self, repo, branch='', fromhead=None, follow=False, closed=False,
                  parent=None, *args, **kwargs):
@@ -575,11 +1248,16 @@ class HgRepoListWalker(object):
         repo is a hg repo instance
         """
         #XXX col radius
-        self._datacache = {}
+        self._datacache = self._newdatacache()
         self._hasmq = False
         self.mqueues = []
         self.wd_revs = []
+        self.wd_status = None
+        self._wdstatus = None # `WorkingDirStatus` thread
+        self.heads = []
+        self.marks = set()
         self.graph = None
+        self.graph_options = None # keyword arguments of `revision_grapher`
         self.rowcount = 0
         self.repo = repo
         self.show_hidden = False
@@ -596,39 +1274,142 @@ class HgRepoListWalker(object):
         self.repo = repo
         if oldrepo.root != repo.root:
             self.load_config()
-        self._datacache = {}
+        olddata, self._datacache = self._datacache, self._newdatacache()
         try:
             wdctxs = self.repo.changectx(None).parents()
         except error.Abort:
             # might occur if reloading during a mq operation (or
             # whatever operation playing with hg history)
             return
+        oldmarks = (self.mqueues, self.wd_revs, self.heads, self.marks)
         if self._hasmq:
             self.mqueues = self.repo.mq.series[:]
         self.wd_revs = [ctx.rev() for ctx in wdctxs]
-        self.wd_status = [self.repo.status(ctx.node(), None)[:4] for ctx in wdctxs]
+        # computed aside as it may be long, see `updateWdStatus`
+        self.wd_status = None
+        self._wdstatus = WorkingDirStatus(self._worker_repo(),
+                                          [ctx.node() for ctx in wdctxs])
+        self._wdstatus.start()
         self._user_colors = {}
-        self._branch_colors = {}
         # precompute named branch color for stable value.
-        for branch_name in chain(['default', 'stable'], sorted(repo.branchtags().keys())):
-            self.namedbranch_color(branch_name)
-        grapher = revision_grapher(self.repo, start_rev=fromhead,
-                                   follow=follow, branch=branch,
-                                   show_hidden=self.show_hidden,
-                                   reorder=self.reorder_changesets,
-                                   closed=closed,
-                                   show_obsolete=self.show_obsolete)
-
-        self.graph = Graph(self.repo, grapher, self.max_file_size)
+        self._branch_colors = dict(
+            (name, self.get_color(slot))
+            for name, slot in branchsummary(repo).colorslots.iteritems())
+        options = dict(start_rev=fromhead, follow=follow, branch=branch,
+                       show_hidden=self.show_hidden,
+                       reorder=self.reorder_changesets, closed=closed,
+                       show_obsolete=self.show_obsolete)
+        self.graph_options = options
+        oldgraph = self.graph
+        # rows of the previous graph may be reused (see `Graph.splice`)
+        splice = (oldgraph is not None and oldgraph.layout is not None
+                  and fromhead is None and oldrepo.root == repo.root)
+        if oldgraph is not None:
+            oldgraph.close()
+        self.graph = self._newgraph(options, self.threaded_fill and not splice)
         self.rowcount = 0
         self.heads = [self.repo.changectx(x).rev() for x in self.repo.heads()]
+        self.marks = self._getmarks()
+        if splice:
+            spliced = self.graph.splice(oldgraph)
+            if spliced is not None:
+                self._shiftdatacache(olddata, spliced,
+                                     self._staledata(oldgraph, *oldmarks))
+            if self.threaded_fill:
+                self.graph.thread(self._worker_repo(), self.fill_step)
+        self.ensureBuilt(row=self.fill_step)
+
+    def _newgraph(self, options, threaded):
+        """Return a new `Graph` laid out by `revision_grapher` with
+        ``options``, computed in a `GrapherThread` if ``threaded``"""
+        state = GrapherState()
+        layout = None
+        if options['start_rev'] is None:
+            # views started from a given revision are not worth a cache file
+            layout = GraphLayoutCache(self.repo, options, state,
+                                      persistent=self.graph_cache)
+        if threaded:
+            grapher = GrapherThread(self._worker_repo(), options, state,
+                                    self.fill_step)
+        else:
+            grapher = revision_grapher(self.repo, state=state, **options)
+        return Graph(self.repo, grapher, self.max_file_size, layout,
+                     self._filecache())
+
+    def _hidewd(self):
+        """Replace the graph by one without the working directory row"""
+        options = self.graph_options = dict(self.graph_options, show_wd=False)
+        self.graph.close()
+        self.graph = self._newgraph(options, self.threaded_fill)
+        self.rowcount = 0
+        self._datacache = self._newdatacache()
         self.ensureBuilt(row=self.fill_step)
 
+    def _getmarks(self):
+        """Return a set of (name, node) for tags and bookmarks of repo"""
+        return markindex(self.repo).marks
+
+    def _staledata(self, oldgraph, mqueues, wd_revs, heads, marks):
+        """Return revisions whose data changed since ``oldgraph`` was built,
+        given the former values of the ``mqueues``, ``wd_revs``, ``heads``
+        and ``marks`` attributes, or None if they may all have changed."""
+        oldstate = oldgraph.layout.repostate
+        newstate = self.graph.layout.repostate
+        if mqueues != self.mqueues or oldstate.obsstore != newstate.obsstore \
+           or oldstate.hidden != newstate.hidden \
+           or (oldstate.phases is None) != (newstate.phases is None):
+            return None
+        stale = set(wd_revs).union(self.wd_revs)
+        stale.update(set(heads).symmetric_difference(self.heads))
+        nodemap = self.repo.changelog.nodemap
+        stale.update(nodemap.get(node) for name, node
+                     in marks.symmetric_difference(self.marks))
+        oldphases = oldstate.phases
+        if oldphases is not None:
+            newphases = newstate.phases[:len(oldphases)]
+            if newphases != oldphases:
+                stale.update(rev for rev in xrange(len(oldphases))
+                             if oldphases[rev] != newphases[rev])
+        return stale
+
+    def _newdatacache(self):
+        """Return an empty cache of data computed for (row, column, role)
+        keys, holding at most `datacache_size` items"""
+        return LRUCache(self.datacache_size)
+
+    def _shiftdatacache(self, olddata, spliced, stale):
+        """Move cached data of rows taken from the previous graph (see
+        `Graph.splice`), except the one of revisions in ``stale``."""
+        if stale is None:
+            return
+        start, oldstart, nrows = spliced
+        delta = start - oldstart
+        ntop = len(self.graph.toprows)
+        revs = self.graph.rows.revs
+        for key, value in olddata.iteritems():
+            row = key[0]
+            # the first row is drawn with the edges of the one above it
+            if oldstart < row < oldstart + nrows \
+               and revs[row + delta - ntop] not in stale:
+                self._datacache[(row + delta,) + key[1:]] = value
+
+    def _worker_repo(self):
+        """Return a new instance of the repository for a worker thread"""
+        repo = build_repo(self.repo.ui, self.repo.root)
+        if self._hasmq:
+            mqsupport.reposetup(repo.ui, repo)
+        return repo
+
     def ensureBuilt(self, rev=None, row=None):
         """
         Make sure rev data is available (graph element created).
 
+        If the graph is computed in a thread, rows are only built if they are
+        already computed unless rev is given.
         """
+        # walkers filling the graph on demand, like the curses one, have no
+        # event loop polling the status, so they wait for it
+        self.updateWdStatus(block=not self.threaded_fill)
         if self.graph.isfilled():
             return
         required = 0
@@ -642,7 +1423,8 @@ class HgRepoListWalker(object):
         elif row is not None and row > (n - self.fill_step / 2):
             required = row - n + self.fill_step
         if required or buildrev:
-            self.graph.build_nodes(nnodes=required, rev=buildrev)
+            self.graph.build_nodes(nnodes=required, rev=buildrev,
+                                   block=rev is not None)
             self.updateRowCount()
         elif row and row > self.rowcount:
             # asked row was already built, but views where not aware of this
@@ -651,6 +1433,49 @@ class HgRepoListWalker(object):
             # asked rev was already built, but views where not aware of this
             self.updateRowCount()
 
+    def updateWdStatus(self, block=False):
+        """
+        Take the status of the working directory into account once it is
+        computed, removing the working directory row if it has no local
+        changes. Unless ``block`` is True, return at once if the status is
+        not available yet.
+
+        Return False if the status is still being computed.
+        """
+        thread = self._wdstatus
+        if thread is None:
+            return True
+        if block:
+            thread.join()
+        if thread.isAlive():
+            return False
+        self._wdstatus = None
+        if thread.error is not None:
+            raise thread.error
+        self.wd_status = thread.status
+        if self.graph is None:
+            return True
+        # drop data of rows displaying the status
+        stale = set(self.wd_revs)
+        stale.add(None)
+        nrows = len(self.graph)
+        self._datacache.discard(lambda key: key[0] >= nrows
+                                or self.graph[key[0]].rev in stale)
+        if self.wd_status and not [True for st in self.wd_status[0] if st]:
+            row = self.graph.removewd()
+            if row < 0 and self.graph.toprows and len(self.graph.rows) \
+                   and self.graph.toprows[-1].rev is None:
+                # other rows are laid out around the working directory one
+                self._hidewd()
+            elif row >= 0:
+                olddata, self._datacache = (self._datacache,
+                                            self._newdatacache())
+                self._shiftdatacache(olddata, (row, row + 1, nrows - row - 1),
+                                     set())
+                self.notify_row_removed(row)
+        self.notify_data_changed()
+        return True
+
     def updateRowCount(self):
         self.rowcount = None
         #raise NotImplementedError
@@ -661,6 +1486,11 @@ class HgRepoListWalker(object):
     def columnCount(self, parent=None):
         return len(self._columns)
 
+    def _filecache(self):
+        """Return the `FileDataCache` of graphs, None if disabled"""
+        return filedatacache(self.repo, self.filedata_cache_size,
+                             self.filedata_disk_cache)
+
     def load_config(self):
         cfg = HgConfig(self.repo.ui)
         self._users, self._aliases = cfg.getUsers()
@@ -672,6 +1502,9 @@ class HgRepoListWalker(object):
         self.show_hidden = cfg.getShowHidden()
         self.reorder_changesets = cfg.getNonPublicOnTop()
         self.show_obsolete = cfg.getShowObsolete()
+        self.graph_cache = cfg.getGraphCache()
+        self.filedata_cache_size = cfg.getFileDataCacheSize() * 1024
+        self.filedata_disk_cache = cfg.getFileDataDiskCache()
 
         cols = getattr(cfg, self._getcolumns)()
         if cols is not None:
@@ -709,17 +1542,22 @@ class HgRepoListWalker(object):
     def col2x(self, col):
         return (1.2*self.dot_radius + 0) * col + self.dot_radius/2 + 3
 
-    def rowFromRev(self, rev):
-        row = self.graph.index(rev)
+    def rowFromRev(self, rev, build=True):
+        row = self.graph.index(rev, build)
         if row == -1:
             row = None
         return row
 
     def clear(self):
         """empty the list"""
+        if self.graph is not None:
+            self.graph.close()
         self.graph = None
-        self._datacache = {}
+        self._datacache.clear()
         self.notify_data_changed()
 
     def notify_data_changed(self):
         pass
+
+    def notify_row_removed(self, row):
+        pass
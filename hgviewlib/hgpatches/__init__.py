@@ -68,6 +68,24 @@ except ImportError:
         return getattr(repo, 'hiddenrevs',
                        getattr(repo.changelog, 'hiddenrevs', ()))
 
+def phaseroots(repo):
+    """Return phase roots of ``repo`` (empty for old hg)"""
+    phasecache = getattr(repo, '_phasecache', None)
+    if phasecache is not None:
+        return phasecache.phaseroots
+    return getattr(repo, '_phaseroots', ())
+
+def phaserevs(repo):
+    """Return the phase of every revision of ``repo`` (None if unknown)"""
+    phasecache = getattr(repo, '_phasecache', None)
+    if phasecache is None:
+        # mercurial < 2.3
+        return getattr(repo, '_phaserev', None)
+    if hasattr(phasecache, 'getphaserevs'):
+        # computed lazily since mercurial 2.5
+        return phasecache.getphaserevs(repo)
+    return phasecache._phaserevs
+
 # obsolete feature
 if getattr(context.changectx, 'obsolete', None) is None:
     context.changectx.obsolete = lambda self: False
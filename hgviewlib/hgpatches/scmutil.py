@@ -16,6 +16,8 @@
 
 """
 
+from mercurial import error
+
 try:
     from mercurial.scmutil import match  #pylint: disable=E1101
 except ImportError:
@@ -27,3 +29,47 @@ try:
     from mercurial.scmutil import revrange
 except ImportError:
     revrange = lambda repo, rev: [repo.changectx(rev).rev()]
+
+try:
+    from mercurial import revset
+    revset.findaliases
+except (ImportError, AttributeError):
+    revset = None
+
+# functions of revsets which check revisions one by one, they give the same
+# result on the whole repository or slice by slice
+_FILTERS = frozenset(('adds', 'all', 'author', 'bookmark', 'branch', 'bumped',
+                      'closed', 'contains', 'date', 'desc', 'divergent',
+                      'draft', 'extinct', 'extra', 'file', 'grep', 'head',
+                      'hidden', 'id', 'keyword', 'merge', 'modifies',
+                      'obsolete', 'public', 'removes', 'rev', 'secret', 'tag',
+                      'tagged', 'unstable', 'user'))
+
+def _filtering(tree):
+    """Return True if the revset ``tree`` checks revisions one by one"""
+    op = tree[0]
+    if op in ('symbol', 'string'):
+        return True
+    if op in ('and', 'or', 'not', 'group'):
+        return all(_filtering(sub) for sub in tree[1:])
+    if op == 'func':
+        return tree[1][0] == 'symbol' and tree[1][1] in _FILTERS
+    return False
+
+def revchunks(repo, spec, size=1000):
+    """Yield lists of revisions matching the revision specification ``spec``,
+    from the newest to the oldest ones, slice of ``size`` revisions of the
+    repository by slice if the revset allows it"""
+    if revset is not None:
+        try:
+            single = spec in repo
+            tree, pos = revset.parse(spec)
+        except (error.RepoLookupError, error.ParseError):
+            single, pos = True, None
+        if not single and pos == len(spec) \
+           and _filtering(revset.findaliases(repo.ui, tree)):
+            match = revset.match(repo.ui, spec)
+            for stop in xrange(len(repo), 0, -size):
+                yield match(repo, range(stop - 1, max(stop - size, 0) - 1, -1))
+            return
+    yield revrange(repo, [spec])
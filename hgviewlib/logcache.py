@@ -0,0 +1,271 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""changeset metadata shown in the log columns
+
+Displaying author, date, branch or summary of a changeset requires to
+decompress its changelog entry. `LogColumns` reads them by blocks of
+consecutive revisions, sequentially from the changelog, and keeps them in
+arrays. Complete blocks are appended to ``.hg/cache/hgview-log`` which is
+memory mapped by later launches, so that rows are rendered without reading
+the changelog again.
+
+A block is stored as a header (see `RECORD`) followed by the users table,
+the branches table, the user and branch identifier of each revision, their
+dates and time zones, and their summaries. Tables and summaries are
+separated by newlines, as names and first lines of descriptions can not
+hold any.
+"""
+
+import sys
+import mmap
+import struct
+from array import array
+from collections import namedtuple
+
+from mercurial import util, encoding
+
+from hgviewlib.util import tounicode
+
+# bump this each time the file format changes
+CACHE_VERSION = 1
+
+CACHE_FILE = 'cache/hgview-log'
+
+# number of revisions in a block
+BLOCK_SIZE = 1024
+
+# block index, node of its last revision, size of users table, size of
+# branches table, size of summaries
+RECORD = struct.Struct('=i20siii')
+
+# type codes of the arrays of user identifiers, branch identifiers, dates
+# and time zones
+ARRAYS = 'iidi'
+
+LogBlock = namedtuple('LogBlock', 'users branches userids branchids dates '
+                                  'tzs summaries')
+
+
+class LogColumns(object):
+    """
+    Author, date, branch and summary of every revision of a repository.
+
+    Authors and summaries are returned as unicode, branches as given by
+    mercurial.
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        self.key = None
+        self._blocks = {} # block index -> LogBlock
+        self._summaries = {} # block index -> split summaries
+        self._records = {} # block index -> offset of the record in _map
+        self._map = None
+        self._interned = {} # user -> shared unicode user
+        self.read()
+
+    def _header(self):
+        return 'hgview-log %i %s %s %i\n' % (
+            CACHE_VERSION, sys.byteorder, encoding.encoding, BLOCK_SIZE)
+
+    def read(self):
+        """Map the cache file of the repository and index its blocks. The
+        file is removed if it holds revisions which are not in the
+        repository anymore."""
+        changelog = self.repo.changelog
+        self.key = (len(changelog), changelog.tip())
+        try:
+            fobj = self.repo.opener(CACHE_FILE, 'rb')
+            try:
+                if fobj.readline() != self._header():
+                    self.clear()
+                    return
+                self._map = mmap.mmap(fobj.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            finally:
+                fobj.close()
+        except (EnvironmentError, ValueError):
+            # ValueError is raised when mapping an empty file
+            return
+        arrayssize = BLOCK_SIZE * sum(array(typecode).itemsize
+                                      for typecode in ARRAYS)
+        offset = len(self._header())
+        while offset + RECORD.size <= len(self._map):
+            block, last, userslen, brancheslen, sumlen = RECORD.unpack(
+                self._map[offset:offset + RECORD.size])
+            size = RECORD.size + userslen + brancheslen + arrayssize + sumlen
+            lastrev = (block + 1) * BLOCK_SIZE - 1
+            if offset + size > len(self._map) or lastrev >= len(changelog) \
+                   or changelog.node(lastrev) != last:
+                # interrupted write or rewritten history
+                self.clear()
+                return
+            self._records[block] = offset
+            offset += size
+
+    def clear(self):
+        """Forget all blocks and remove the cache file"""
+        self._blocks.clear()
+        self._summaries.clear()
+        self._records.clear()
+        self._map = None
+        try:
+            util.unlink(self.repo.join(CACHE_FILE))
+        except (IOError, OSError):
+            pass
+
+    def refresh(self):
+        """Forget blocks which may not match the repository anymore"""
+        changelog = self.repo.changelog
+        nrevs, tip = self.key
+        self.key = (len(changelog), changelog.tip())
+        if self.key == (nrevs, tip):
+            return
+        if len(changelog) < nrevs or changelog.node(nrevs - 1) != tip:
+            # history was rewritten
+            self.clear()
+            return
+        # only the last block may be incomplete
+        block = (nrevs - 1) // BLOCK_SIZE
+        self._blocks.pop(block, None)
+        self._summaries.pop(block, None)
+
+    def _block(self, block):
+        """Return the `LogBlock` number ``block``"""
+        if block in self._blocks:
+            return self._blocks[block]
+        if block in self._records:
+            logblock = self._load(self._records[block])
+        else:
+            logblock = self._build(block)
+        self._blocks[block] = logblock
+        return logblock
+
+    def _load(self, offset):
+        data = self._map
+        _, _, userslen, brancheslen, sumlen = RECORD.unpack(
+            data[offset:offset + RECORD.size])
+        offset += RECORD.size
+        users = [self._intern(tounicode(name)) for name in
+                 data[offset:offset + userslen].split('\n')]
+        offset += userslen
+        branches = data[offset:offset + brancheslen].split('\n')
+        offset += brancheslen
+        arrays = []
+        for typecode in ARRAYS:
+            values = array(typecode)
+            size = BLOCK_SIZE * values.itemsize
+            values.fromstring(data[offset:offset + size])
+            arrays.append(values)
+            offset += size
+        summaries = data[offset:offset + sumlen]
+        return LogBlock(users, branches, *(arrays + [summaries]))
+
+    def _intern(self, user):
+        return self._interned.setdefault(user, user)
+
+    def _build(self, block):
+        """Read revisions of ``block`` from the changelog and append the
+        block to the cache file if it is complete"""
+        changelog = self.repo.changelog
+        start = block * BLOCK_SIZE
+        stop = min(start + BLOCK_SIZE, len(changelog))
+        if hasattr(changelog, '_chunkraw'):
+            # load entries of the block with a single read
+            changelog._chunkraw(start, stop - 1)
+        users, userids = [], {}
+        branches, branchids = [], {}
+        logblock = LogBlock(users, branches,
+                            *([array(typecode) for typecode in ARRAYS] + [[]]))
+        for rev in xrange(start, stop):
+            _, user, (date, tz), _, desc, extra = changelog.read(
+                changelog.node(rev))
+            if user not in userids:
+                userids[user] = len(users)
+                users.append(user)
+            logblock.userids.append(userids[user])
+            branch = encoding.tolocal(extra.get('branch', 'default'))
+            if branch not in branchids:
+                branchids[branch] = len(branches)
+                branches.append(branch)
+            logblock.branchids.append(branchids[branch])
+            logblock.dates.append(date)
+            logblock.tzs.append(tz)
+            summary = tounicode(desc)
+            summary = summary and summary.splitlines()[0]
+            logblock.summaries.append(summary.encode('utf-8'))
+        summaries = '\n'.join(logblock.summaries)
+        if stop - start == BLOCK_SIZE:
+            self._write(block, logblock._replace(summaries=summaries))
+        return logblock._replace(
+            users=[self._intern(tounicode(name)) for name in users],
+            summaries=summaries)
+
+    def _write(self, block, logblock):
+        users = '\n'.join(logblock.users)
+        branches = '\n'.join(logblock.branches)
+        summaries = logblock.summaries
+        last = self.repo.changelog.node((block + 1) * BLOCK_SIZE - 1)
+        record = [RECORD.pack(block, last, len(users), len(branches),
+                              len(summaries)),
+                  users, branches, logblock.userids.tostring(),
+                  logblock.branchids.tostring(), logblock.dates.tostring(),
+                  logblock.tzs.tostring(), summaries]
+        try:
+            fobj = self.repo.opener(CACHE_FILE, 'ab')
+            try:
+                fobj.seek(0, 2) # tell() is not at the end in append mode
+                if not fobj.tell():
+                    record.insert(0, self._header())
+                # a single write, to not interleave with another process
+                fobj.write(''.join(record))
+            finally:
+                fobj.close()
+        except (IOError, OSError, util.Abort):
+            # Abort may be raised by read only opener
+            pass
+
+    def user(self, rev):
+        """Return the author of ``rev``"""
+        logblock = self._block(rev // BLOCK_SIZE)
+        return logblock.users[logblock.userids[rev % BLOCK_SIZE]]
+
+    def branch(self, rev):
+        """Return the named branch of ``rev``"""
+        logblock = self._block(rev // BLOCK_SIZE)
+        return logblock.branches[logblock.branchids[rev % BLOCK_SIZE]]
+
+    def date(self, rev):
+        """Return the date of ``rev`` as a (timestamp, time zone) tuple"""
+        logblock = self._block(rev // BLOCK_SIZE)
+        idx = rev % BLOCK_SIZE
+        return logblock.dates[idx], logblock.tzs[idx]
+
+    def summary(self, rev):
+        """Return the first line of the description of ``rev``"""
+        block = rev // BLOCK_SIZE
+        summaries = self._summaries.get(block)
+        if summaries is None:
+            summaries = self._summaries[block] = \
+                        self._block(block).summaries.split('\n')
+        return summaries[rev % BLOCK_SIZE].decode('utf-8')
+
+def logcolumns(repo):
+    """Return the `LogColumns` of ``repo``"""
+    columns = getattr(repo, '_hgview_logcolumns', None)
+    if columns is None:
+        columns = repo._hgview_logcolumns = LogColumns(repo)
+    else:
+        columns.refresh()
+    return columns
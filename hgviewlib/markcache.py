@@ -0,0 +1,94 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""tags, bookmarks and mq patches of revisions
+
+`MarkIndex` maps revisions to their tags, bookmarks and mq patch, read once
+from the repository. It is kept across repository reloads as long as the
+changelog, the local tags, the bookmarks and the mq queue are unchanged
+(``.hgtags`` can not change without the changelog).
+"""
+
+from hgviewlib.util import filestate
+
+# repository root -> last `MarkIndex` computed for it
+_indexes = {}
+
+def _markstate(repo):
+    changelog = repo.changelog
+    state = [len(changelog), changelog.tip(),
+             filestate(repo.join('localtags')),
+             filestate(repo.join('bookmarks'))]
+    if hasattr(repo, 'mq'):
+        state.append(filestate(repo.mq.join(repo.mq.seriespath)))
+        state.append(filestate(repo.mq.join(repo.mq.statuspath)))
+    return tuple(state)
+
+
+class MarkIndex(object):
+    """
+    Tags, bookmarks and mq patch of the revisions of a repository.
+
+    :marks: set of (name, node) of tags and bookmarks, bookmark names being
+            prefixed by ``bookmark:``
+    """
+    def __init__(self, repo, key=None):
+        self.key = key
+        nodemap = repo.changelog.nodemap
+        self._tags = {} # rev -> sorted tags
+        self._bookmarks = {} # rev -> sorted bookmarks
+        self._mqpatches = {} # rev -> mq patch name
+        tags = repo.tags()
+        bookmarks = getattr(repo, '_bookmarks', {})
+        for marks, names in ((self._tags, tags),
+                             (self._bookmarks, bookmarks)):
+            for name, node in names.iteritems():
+                rev = nodemap.get(node)
+                if rev is not None:
+                    marks.setdefault(rev, []).append(name)
+            for revmarks in marks.itervalues():
+                revmarks.sort()
+        if hasattr(repo, 'mq'):
+            for name in repo.mq.series:
+                if name in tags: # applied patch
+                    rev = nodemap.get(tags[name])
+                    if rev is not None:
+                        self._mqpatches[rev] = name
+        self.marks = frozenset(tags.iteritems()).union(
+            ('bookmark:%s' % name, node)
+            for name, node in bookmarks.iteritems())
+
+    def tags(self, rev):
+        """Return the sorted tags of ``rev``"""
+        return self._tags.get(rev, [])
+
+    def bookmarks(self, rev):
+        """Return the sorted bookmarks of ``rev``"""
+        return self._bookmarks.get(rev, [])
+
+    def mqpatch(self, rev):
+        """Return the name of the mq patch applied as ``rev``, None if it is
+        not an mq patch"""
+        return self._mqpatches.get(rev)
+
+def markindex(repo):
+    """Return the `MarkIndex` of ``repo``"""
+    index = getattr(repo, '_hgview_markindex', None)
+    if index is None:
+        key = _markstate(repo)
+        index = _indexes.get(repo.root)
+        if index is None or index.key != key:
+            index = _indexes[repo.root] = MarkIndex(repo, key)
+        repo._hgview_markindex = index
+    return index
@@ -0,0 +1,186 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""nearest displayed precursors and successors of revisions
+
+Obsolescence markers relate changesets which may not be in the repository or
+not be displayed. `ObsIndex` walks markers once to relate every displayed
+revision to its nearest displayed precursors and successors. It is stored in
+``.hg/cache/hgview-obsolete`` for a given state of the obsolescence markers
+and set of excluded (hidden) revisions.
+"""
+
+import sys
+from array import array
+try:
+    from hashlib import sha1
+except ImportError: # python < 2.5
+    from sha import sha as sha1
+
+from mercurial.node import hex
+from mercurial import util
+
+from hgviewlib.util import filestate
+from hgviewlib.hgpatches import precursorsmarkers, successorsmarkers
+
+# bump this each time the file format changes
+CACHE_VERSION = 1
+
+CACHE_FILE = 'cache/hgview-obsolete'
+
+def _precursors(obsstore, node):
+    return [mark[0] for mark in precursorsmarkers(obsstore, node)]
+
+def _successors(obsstore, node):
+    return [succ for mark in successorsmarkers(obsstore, node)
+            for succ in mark[1]]
+
+def _nearest(obsstore, startnode, related, visible):
+    """Return revisions of the nearest changesets related to ``startnode`` by
+    ``related`` markers for which ``visible`` returns a revision, walking
+    through the other ones"""
+    candidates = set(related(obsstore, startnode))
+    seen = set(candidates)
+    seen.add(startnode)
+    candidates.discard(startnode)
+    revs = set()
+    while candidates:
+        current = candidates.pop()
+        rev = visible(current)
+        if rev is not None:
+            revs.add(rev)
+            continue
+        for node in related(obsstore, current):
+            if node not in seen:
+                candidates.add(node)
+                seen.add(node)
+    return tuple(sorted(revs))
+
+def _flatten(relations):
+    """Return an array of revision, number of related revisions and related
+    revisions for every item of the ``relations`` dictionary"""
+    flat = array('i')
+    for rev, related in relations.iteritems():
+        flat.append(rev)
+        flat.append(len(related))
+        flat.extend(related)
+    return flat
+
+def _unflatten(flat):
+    relations = {}
+    idx = 0
+    while idx < len(flat):
+        rev, count = flat[idx], flat[idx + 1]
+        relations[rev] = tuple(flat[idx + 2:idx + 2 + count])
+        idx += 2 + count
+    return relations
+
+
+class ObsIndex(object):
+    """
+    Nearest precursors and successors of revisions, among the revisions of a
+    repository which are not excluded.
+    """
+    def __init__(self, repo, excluded=()):
+        self.repo = repo
+        self.excluded = excluded
+        self._precursors = {} # rev -> sorted nearest precursors
+        self._successors = {} # rev -> sorted nearest successors
+        if not getattr(repo, 'obsstore', None):
+            return
+        if not self.read():
+            self.build()
+            self.write()
+
+    def _header(self):
+        repo = self.repo
+        changelog = repo.changelog
+        excluded = array('i', sorted(self.excluded)).tostring()
+        return 'hgview-obsolete %i %s %i %s %s %s\n' % (
+            CACHE_VERSION, sys.byteorder, len(changelog),
+            hex(changelog.tip()), filestate(repo.sjoin('obsstore')) or '-',
+            sha1(excluded).hexdigest())
+
+    def build(self):
+        """Walk obsolescence markers of the repository"""
+        obsstore = self.repo.obsstore
+        nodemap = self.repo.changelog.nodemap
+        excluded = self.excluded
+        def visible(node):
+            rev = nodemap.get(node)
+            if rev is not None and rev not in excluded:
+                return rev
+        # changesets being the precursor or a successor of a marker
+        nodes = set(obsstore.precursors).union(obsstore.successors)
+        for node in nodes:
+            rev = visible(node)
+            if rev is None:
+                continue
+            for relations, related in ((self._precursors, _precursors),
+                                       (self._successors, _successors)):
+                revs = _nearest(obsstore, node, related, visible)
+                if revs:
+                    relations[rev] = revs
+
+    def read(self):
+        """Read the index stored in the cache directory of the repository.
+        Return False if it is missing or outdated."""
+        try:
+            fobj = self.repo.opener(CACHE_FILE, 'rb')
+            try:
+                if fobj.readline() != self._header():
+                    return False
+                sizes = fobj.readline().split()
+                flat = array('i')
+                flat.fromstring(fobj.read())
+            finally:
+                fobj.close()
+            nprecursors, nsuccessors = [int(size) for size in sizes]
+        except (IOError, OSError, ValueError):
+            return False
+        if len(flat) != nprecursors + nsuccessors:
+            return False
+        self._precursors = _unflatten(flat[:nprecursors])
+        self._successors = _unflatten(flat[nprecursors:])
+        return True
+
+    def write(self):
+        """Store the index in the cache directory of the repository"""
+        precursors = _flatten(self._precursors)
+        successors = _flatten(self._successors)
+        try:
+            fobj = self.repo.opener(CACHE_FILE, 'wb', atomictemp=True)
+            fobj.write(self._header())
+            fobj.write('%i %i\n' % (len(precursors), len(successors)))
+            fobj.write(precursors.tostring())
+            fobj.write(successors.tostring())
+            fobj.close()
+        except (IOError, OSError, util.Abort):
+            # Abort may be raised by read only opener
+            pass
+
+    def precursors(self, rev):
+        """Return the nearest precursors of ``rev``, sorted"""
+        return self._precursors.get(rev, ())
+
+    def successors(self, rev):
+        """Return the nearest successors of ``rev``, sorted"""
+        return self._successors.get(rev, ())
+
+def obsindex(repo, excluded=()):
+    """Return the `ObsIndex` of ``repo`` ignoring ``excluded`` revisions"""
+    index = getattr(repo, '_hgview_obsindex', None)
+    if index is None or index.excluded != excluded:
+        index = repo._hgview_obsindex = ObsIndex(repo, excluded)
+    return index
@@ -352,7 +352,7 @@ class FileDiffViewer(AbstractFileDialog, _FileDiffViewer):
             side = 'right'
         else:
             side = 'left'
-        path = self.filerevmodel.graph.nodesdict[rev].extra[0]
+        path = self.filerevmodel.graph.filename(rev)
         fc = self.repo.changectx(rev).filectx(path)
         self.filedata[side] = fc.data().splitlines()
         self.update_diff(keeppos=otherside[side])
@@ -18,19 +18,26 @@ Qt4 model for hg repo changelogs and filelogs
 import sys
 import re
 import os, os.path as osp
+from collections import namedtuple
 
 from mercurial.node import nullrev
 from mercurial.node import hex, short as short_hex
 from mercurial.revlog import LookupError
 from mercurial import util, error
 
-from hgviewlib.hggraph import Graph, ismerge, diff as revdiff, HgRepoListWalker
+from hgviewlib.hggraph import Graph, ismerge, HgRepoListWalker
 from hgviewlib.hggraph import revision_grapher, filelog_grapher, getlog, gettags
+from hgviewlib.hggraph import getauthor, getbranch, getrevdate, getbookmarks
 from hgviewlib.config import HgConfig
-from hgviewlib.util import tounicode, isbfile, Curry
+from hgviewlib.util import isbfile, Curry, LRUCache
 from hgviewlib.qt4 import icon as geticon
 from hgviewlib.decorators import timeit
 from hgviewlib.hgpatches import phases
+from hgviewlib.branchcache import branchsummary
+from hgviewlib.markcache import markindex
+from hgviewlib.flagcache import revflags
+from hgviewlib.diffstat import diffstat, filestatpool
+from hgviewlib.statuscache import repostatus, REMOVED
 
 from PyQt4 import QtCore, QtGui
 connect = QtCore.QObject.connect
@@ -67,12 +74,13 @@ def cvrt_date(date):
 # in following lambdas, ctx is a hg changectx
 _columnmap = {'ID': lambda model, ctx, gnode: ctx.rev() is not None and str(ctx.rev()) or "",
               'Log': getlog,
-              'Author': lambda model, ctx, gnode: tounicode(ctx.user()),
-              'Date': lambda model, ctx, gnode: cvrt_date(ctx.date()),
+              'Author': getauthor,
+              'Date': lambda model, ctx, gnode: cvrt_date(getrevdate(model, ctx, gnode)),
               'Tags': gettags,
-              'Branch': lambda model, ctx, gnode: ctx.branch(),
+              'Branch': getbranch,
               'Filename': lambda model, ctx, gnode: gnode.extra[0],
-              'Phase': lambda model, ctx, gnode: ctx.phasestr(),
+              'Phase': lambda model, ctx, gnode: phases.phasenames[
+                  revflags(model.repo).phase(ctx.rev())],
               }
 
 _tooltips = {'ID': lambda model, ctx, gnode: ctx.rev() is not None and ctx.hex() or "Working Directory",
@@ -88,29 +96,46 @@ def auth_width(model, repo):
 _maxwidth = {'ID': lambda self, r: str(len(r.changelog)),
              'Date': lambda self, r: cvrt_date(r.changectx(0).date()),
              'Tags': lambda self, r: sorted(r.tags().keys(), key=len)[-1][:10],
-             'Branch': lambda self, r: sorted(r.branchtags().keys(), key=len)[-1]
-                                              if r.branchtags().keys() else None,
+             'Branch': lambda self, r: max(branchsummary(r).names(), key=len)
+                                              if branchsummary(r).heads else None,
              'Author': lambda self, r: 'author name',
              'Filename': lambda self, r: self.filename,
              'Phase': lambda self, r: sorted(phases.phasenames, key=len)[-1]
              }
 
+# role of the data displayed by the graph of the Log column, see
+# `hgviewlib.qt4.hgrepoview.GraphDelegate`
+GraphNodeRole = QtCore.Qt.UserRole
+
+# graph node of a row with what is needed to draw its dot
+GraphCell = namedtuple('GraphCell', 'gnode trimmed branch_color obsolete '
+                       'ishead phase icon redpen')
+
+def datasize(value):
+    """Return the approximate memory used by a value returned by the 'data'
+    method of Qt models, in bytes"""
+    if isinstance(value, QtCore.QVariant):
+        if value.type() == QtCore.QVariant.String:
+            return 64 + 2 * value.toString().length()
+    return 64
+
 def datacached(meth):
     """
     decorator used to cache 'data' method of Qt models. It will *not*
     cache nullvariant return values (so costly non-null values
     can be computed and filled as a background process)
     """
+    missing = object()
     def data(self, index, role):
         if not index.isValid():
             return nullvariant
-        row = index.row()
-        col = index.column()
-        if (row, col, role) in self._datacache:
-            return self._datacache[(row, col, role)]
+        key = (index.row(), index.column(), role)
+        result = self._datacache.get(key, missing)
+        if result is not missing:
+            return result
         result = meth(self, index, role)
         if result is not nullvariant:
-            self._datacache[(row, col, role)] = result
+            self._datacache[key] = result
         return result
     return data
 
@@ -122,30 +147,71 @@ class HgRepoListModel(QtCore.QAbstractTableModel, HgRepoListWalker):
     _columns = ('ID', 'Branch', 'Log', 'Author', 'Date', 'Tags',)
     _stretchs = {'Log': 1, }
     _getcolumns = "getChangelogColumns"
+    threaded_fill = True
+    # bytes
+    datacache_size = 4 * 1024 * 1024
 
     def __init__(self, repo, branch='', fromhead=None, follow=False, parent=None, show_hidden=False, closed=False):
         """
         repo is a hg repo instance
         """
         self._fill_timer = None
+        self._status_timer = None
         self.cfg = HgConfig(repo.ui)
         QtCore.QAbstractTableModel.__init__(self, parent)
         HgRepoListWalker.__init__(self, repo, branch, fromhead, follow, closed=closed)
-        self.highlights = []
+        self.highlights = None
+        self._trimmed = False # rows out of highlights are trimmed
 
     def setRepo(self, repo, branch='', fromhead=None, follow=False, closed=False):
         HgRepoListWalker.setRepo(self, repo, branch, fromhead, follow, closed=closed)
         self.emit(SIGNAL('layoutChanged()'))
         QtCore.QTimer.singleShot(0, Curry(self.emit, SIGNAL('filled')))
+        if self._fill_timer is not None:
+            self.killTimer(self._fill_timer)
         self._fill_timer = self.startTimer(50)
+        if self._status_timer is None:
+            self._status_timer = self.startTimer(100)
+
+    def _newdatacache(self):
+        return LRUCache(self.datacache_size, datasize)
+
+    def _hidewd(self):
+        HgRepoListWalker._hidewd(self)
+        if self._fill_timer is None:
+            self._fill_timer = self.startTimer(50)
+
+    def _shiftdatacache(self, olddata, spliced, stale):
+        if (spliced[0] - spliced[1]) % 2:
+            # background colors alternate from one row to the next one
+            olddata.discard(lambda key: key[2] == QtCore.Qt.BackgroundRole)
+        HgRepoListWalker._shiftdatacache(self, olddata, spliced, stale)
 
     def highlight_rows(self, rows):
         """mark ``rows`` to be highlighted."""
+        oldrows, oldtrimmed = self.highlights, self._trimmed
+        if rows is not None:
+            rows = frozenset(rows)
         self.highlights = rows # None (no revset ~ not filtered) != [] (empty revset)
-        self._datacache.clear()
+        self._trimmed = bool(rows) and self.cfg.getRevsetView() == 'trim'
+        if self._trimmed != oldtrimmed:
+            # every row is drawn differently when highlights come or go
+            self._datacache.clear()
+            return
+        changed = (oldrows or frozenset()).symmetric_difference(rows or ())
+        if self._trimmed:
+            self._datacache.discard(lambda key: key[0] in changed)
+        else:
+            # only the background of rows (un)highlighted changes
+            self._datacache.discard(lambda key: key[0] in changed
+                                    and key[2] == QtCore.Qt.BackgroundRole)
 
     def timerEvent(self, event):
-        if event.timerId() == self._fill_timer:
+        if event.timerId() == self._status_timer:
+            if self.updateWdStatus():
+                self.killTimer(self._status_timer)
+                self._status_timer = None
+        elif event.timerId() == self._fill_timer:
             self.emit(SIGNAL('showMessage'),
                       'filling (%s)' % (len(self.graph)),
                       -1)
@@ -156,11 +222,20 @@ class HgRepoListModel(QtCore.QAbstractTableModel, HgRepoListWalker):
             # we fill the graph data structures without telling
             # views until we are done - this gives
             # maximal GUI responsiveness
-            elif not self.graph.build_nodes(nnodes=self.fill_step):
+            elif not self.graph.build_nodes(nnodes=self.fill_step, block=False):
                 self.killTimer(self._fill_timer)
                 self._fill_timer = None
                 self.updateRowCount()
                 self.emit(SIGNAL('showMessage'), '', -1)
+            elif self.graph.isthreaded():
+                # rows are computed aside, views can display them at once
+                self.updateRowCount()
+
+    def notify_row_removed(self, row):
+        if row < self.rowcount:
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            self.rowcount -= 1
+            self.endRemoveRows()
 
     def updateRowCount(self):
         currentlen = self.rowcount
@@ -202,30 +277,33 @@ class HgRepoListModel(QtCore.QAbstractTableModel, HgRepoListWalker):
         if not index.isValid():
             return nullvariant
         row = index.row()
-        is_trimmed = (self.highlights) and (row not in self.highlights) \
-            and (self.cfg.getRevsetView() == 'trim')
+        is_trimmed = self._trimmed and row not in self.highlights
         self.ensureBuilt(row=row)
         column = self._columns[index.column()]
         gnode = self.graph[row]
         ctx = self.repo.changectx(gnode.rev)
+        flags = revflags(self.repo)
         if role == QtCore.Qt.DisplayRole and not is_trimmed:
             if column == 'Author': #author
-                user = _columnmap[column](self, ctx, gnode) if ctx.node() else u'' 
+                user = _columnmap[column](self, ctx, gnode)
                 return QtCore.QVariant(self.user_name(user))
             elif column == 'Log':
                 msg = _columnmap[column](self, ctx, gnode)
-                bookmarks = ctx.bookmarks()
+                bookmarks = getbookmarks(self, ctx, gnode)
                 if bookmarks:
                     msg = '<%s> ~ %s' % (','.join(bookmarks), msg)
                 return QtCore.QVariant(msg)
             return QtCore.QVariant(_columnmap[column](self, ctx, gnode))
         elif role == QtCore.Qt.ToolTipRole:
-            msg = "<b>Branch:</b> %s<br>\n" % ctx.branch()
-            msg += "<b>Phase:</b> %s<br>\n" % ctx.phasestr()
+            msg = "<b>Branch:</b> %s<br>\n" % getbranch(self, ctx, gnode)
+            msg += "<b>Phase:</b> %s<br>\n" % phases.phasenames[
+                flags.phase(gnode.rev)]
             if gnode.rev in self.wd_revs:
                 msg += " <i>Working Directory position"
                 states = 'modified added removed deleted'.split()
-                status = self.wd_status[self.wd_revs.index(gnode.rev)]
+                status = ()
+                if self.wd_status is not None:
+                    status = self.wd_status[self.wd_revs.index(gnode.rev)]
                 status = [state for st, state in zip(status, states) if st]
                 if status:
                     msg += ' (%s)' % (', '.join(status))
@@ -235,15 +313,15 @@ class HgRepoListModel(QtCore.QAbstractTableModel, HgRepoListWalker):
         elif role == QtCore.Qt.ForegroundRole and not is_trimmed:
             color = None
             if column == 'Author': #author
-                user = ctx.user() if ctx.node() else ''
+                user = getauthor(self, ctx, gnode)
                 color = QtGui.QColor(self.user_color(user))
-                if ctx.obsolete():
+                if flags.obsolete(gnode.rev):
                     color = color.lighter()
             elif column == 'Branch': #branch
-                color = QtGui.QColor(self.namedbranch_color(ctx.branch()))
-                if ctx.obsolete():
+                color = QtGui.QColor(self.namedbranch_color(getbranch(self, ctx, gnode)))
+                if flags.obsolete(gnode.rev):
                     color = color.lighter()
-            elif ctx.obsolete():
+            elif flags.obsolete(gnode.rev):
                 color = QtGui.QColor('grey')
             if color is not None:
                 return QtCore.QVariant(color)
@@ -252,120 +330,39 @@ class HgRepoListModel(QtCore.QAbstractTableModel, HgRepoListWalker):
             row = index.row()
             if self.highlights and row in self.highlights:
                 return COLOR_BG_HIGHLIGHT[row % 2]
-            elif ctx.obsolete():
+            elif flags.obsolete(gnode.rev):
                 return COLOR_BG_OBSOLETE[row % 2]
-            elif ctx.troubles():
+            elif flags.troubled(gnode.rev):
                 return COLOR_BG_TROUBLED[row % 2]
 
-        elif role == QtCore.Qt.DecorationRole:
+        elif role == GraphNodeRole:
             if column == 'Log':
                 if not getattr(ctx, 'applied', True):
                     return nullvariant
-                radius = self.dot_radius
-                pan = 2
-                w = self.col2x(gnode.cols, pan)
-                if is_trimmed:
-                    h = self.cfg.getRowHeightTrimmed()
-                else:
-                    h = self.rowheight
-
-                dot_x = self.col2x(gnode.x, pan)
-                dot_y = h / 2
-
-                pix = QtGui.QPixmap(w, h)
-                pix.fill(QtGui.QColor(0,0,0,0))
-                painter = QtGui.QPainter(pix)
-                painter.setRenderHint(QtGui.QPainter.Antialiasing)
-
-                pen = QtGui.QPen(QtCore.Qt.blue)
-                pen.setWidth(2)
-                painter.setPen(pen)
-
-                lpen = QtGui.QPen(pen)
-                lpen.setColor(QtCore.Qt.black)
-                painter.setPen(lpen)
-
-                for y1, y2, lines in ((0, h, gnode.bottomlines),
-                                      (-h, 0, gnode.toplines)):
-                    for start, end, color, fill in lines:
-                        lpen = QtGui.QPen(pen)
-                        color = QtGui.QColor(self.get_color(color))
-                        if not fill:
-                             lpen.setStyle(QtCore.Qt.DotLine)
-                             color.setAlpha(150)
-                        lpen.setColor(color)
-                        lpen.setWidth(2)
-                        painter.setPen(lpen)
-                        x1 = self.col2x(start, pan) + radius / 2
-                        x2 = self.col2x(end, pan) + radius / 2
-                        painter.drawLine(x1, dot_y + y1, x2, dot_y + y2)
-
-                dot_color = QtGui.QColor(self.namedbranch_color(ctx.branch()))
-                dotcolor = QtGui.QColor(dot_color)
-                if ctx.obsolete():
-                    penradius = 1
-                    pencolor = dotcolor.setAlpha(150)
-                elif gnode.rev in self.heads:
-                    penradius = 2
-                    pencolor = dotcolor.darker()
-                else:
-                    penradius = 1
-                    pencolor = QtCore.Qt.black
-
-                dot_y = (h/2) - radius / 2
-
-                painter.setBrush(dotcolor)
-                pen = QtGui.QPen(pencolor)
-                pen.setWidth(penradius)
-                painter.setPen(pen)
-                tags = set(ctx.tags())
+                phase = flags.phase(gnode.rev)
                 icn = None
-
-                modified = False
-                atwd = False
-                if gnode.rev in self.wd_revs:
-                    atwd = True
-                    status = self.wd_status[self.wd_revs.index(gnode.rev)]
-                    if [True for st in status if st]:
-                        modified = True
-
-                phase = ctx.phase()
-
+                redpen = False
                 if gnode.rev is None:
-                    # WD is displayed only if there are local
-                    # modifications, so let's use the modified icon
-                    icn = geticon('modified')
-                elif tags.intersection(self.mqueues):
-                    icn = geticon('mqpatch')
-                #elif modified:
-                #    icn = geticon('modified')
-                elif atwd:
+                    # WD is mostly displayed when there are local
+                    # modifications, so let's use the modified icon until
+                    # its status is known
+                    if self.wd_status is not None and \
+                       not [True for st in self.wd_status[0] if st]:
+                        icn = 'clean'
+                    else:
+                        icn = 'modified'
+                elif markindex(self.repo).mqpatch(gnode.rev):
+                    icn = 'mqpatch'
+                elif gnode.rev in self.wd_revs:
                     if phase > phases.public:
-                        pen_color = QtCore.Qt.red
-                        pen = QtGui.QPen(pen_color)
-                        pen.setWidth(penradius)
-                        painter.setPen(pen)
+                        redpen = True
                     else:
-                        icn = geticon('clean')
-
-                if is_trimmed:
-                    pass
-                elif icn:
-                    icn.paint(painter, dot_x-5, dot_y-5, 17, 17)
-                elif phase == phases.draft:
-                    painter.drawRect(dot_x, dot_y, radius, radius)
-                elif phase == phases.secret:
-                    P = QtCore.QPointF
-                    painter.drawPolygon(
-                        P(dot_x + (radius//2), dot_y),
-                        P(dot_x, dot_y + radius),
-                        P(dot_x + radius, dot_y+radius)
-                        )
-                else:
-                    painter.drawEllipse(dot_x, dot_y, radius, radius)
-                painter.end()
-                ret = QtCore.QVariant(pix)
-                return ret
+                        icn = 'clean'
+                return GraphCell(
+                    gnode, bool(is_trimmed),
+                    self.namedbranch_color(getbranch(self, ctx, gnode)),
+                    flags.obsolete(gnode.rev), gnode.rev in self.heads,
+                    phase, icn, redpen)
         return nullvariant
 
     def headerData(self, section, orientation, role):
@@ -382,7 +379,7 @@ class HgRepoListModel(QtCore.QAbstractTableModel, HgRepoListWalker):
     def clear(self):
         """empty the list"""
         self.graph = None
-        self._datacache = {}
+        self._datacache.clear()
         self.notify_data_changed()
 
     def notify_data_changed(self):
@@ -414,7 +411,7 @@ class FileRevModel(HgRepoListModel):
 
     def setRepo(self, repo, branch='', fromhead=None, follow=False, closed=False):
         self.repo = repo
-        self._datacache = {}
+        self._datacache = self._newdatacache()
         self.load_config()
 
     def setFilename(self, filename):
@@ -424,11 +421,12 @@ class FileRevModel(HgRepoListModel):
         self._branch_colors = {}
 
         self.rowcount = 0
-        self._datacache = {}
+        self._datacache = self._newdatacache()
 
         if self.filename:
             grapher = filelog_grapher(self.repo, self.filename)
-            self.graph = Graph(self.repo, grapher, self.max_file_size)
+            self.graph = Graph(self.repo, grapher, self.max_file_size,
+                               filecache=self._filecache())
             fl = self.repo.file(self.filename)
             # we use fl.index here (instead of linkrev) cause
             # linkrev API changed between 1.0 and 1.?. So this
@@ -452,6 +450,8 @@ class HgFileListModel(QtCore.QAbstractTableModel):
 
     _description_desc = dict(path='', flag='', desc='Display revision description',
                              bfile=None, parent=None, fromside=None, infiles=False)
+    # stats of larger file lists are computed by a `FileStatPool`
+    pool_threshold = 500
 
     def __init__(self, repo, parent=None):
         """
@@ -467,6 +467,9 @@ class HgFileListModel(QtCore.QAbstractTableModel):
         self.diffwidth = 100
         self._fulllist = False
         self._fill_iter = None
+        self._pool = None
+        self._pool_timer = QtCore.QTimer(self)
+        connect(self._pool_timer, SIGNAL('timeout()'), self._fill_pool_step)
 
     def toggleFullFileList(self):
         self._fulllist = not self._fulllist
@@ -482,6 +485,7 @@ class HgFileListModel(QtCore.QAbstractTableModel):
         self._flagcolor['+'] = cfg.getFileAddedColor()
         self._flagcolor[''] = cfg.getFileDescriptionColor()
         self._displaydiff = cfg.getDisplayDiffStats()
+        self._statprocesses = cfg.getDiffStatProcesses()
         self._descriptionview = cfg.getFileDescriptionView()
 
     def setDiffWidth(self, w):
@@ -544,7 +548,7 @@ class HgFileListModel(QtCore.QAbstractTableModel):
         _files = []
         ctx = self.current_ctx
         ctxfiles = ctx.files()
-        changes = self.repo.status(parent.node(), ctx.node())[:3]
+        changes = repostatus(self.repo, parent.node(), ctx.node()).changes[:3]
         modified, added, removed = changes
         for lst, flag in ((added, '+'), (modified, '='), (removed, '-')):
             for f in [x for x in lst if self._filterFile(x, ctxfiles)]:
@@ -585,8 +589,73 @@ class HgFileListModel(QtCore.QAbstractTableModel):
         Method called to start the background process of computing
         file stats, which are to be displayed in the 'Stats' column
         """
-        self._fill_iter = self._fill()
-        self._fill_one_step()
+        pool = None
+        if len(self._files) >= self.pool_threshold \
+               and getattr(self.current_ctx, 'applied', True):
+            pool = filestatpool(self.repo, self._statprocesses)
+        if self._pool is not None:
+            self._pool.submit(())
+            self._pool_timer.stop()
+        self._pool = pool
+        if pool is None:
+            self._fill_iter = self._fill()
+            self._fill_one_step()
+        else:
+            self._fill_iter = None
+            pool.submit(self._pool_jobs())
+            self._pool_timer.start(50)
+
+    def _pool_jobs(self):
+        ctx = self.current_ctx
+        rev, prev = ctx.rev(), ctx.p1().rev()
+        for row, desc in enumerate(self._files):
+            if desc is self._description_desc:
+                continue
+            if desc['flag'] == '=' and self._displaydiff:
+                yield row, 'stat', rev, prev, desc['path']
+            if desc['flag'] == '+':
+                yield row, 'renamed', rev, None, desc['path']
+
+    def _fill_pool_step(self):
+        if self._pool is None:
+            self._pool_timer.stop()
+            return
+        rows = []
+        for (row, kind, rev, prev, filename), result in self._pool.results():
+            if kind == 'stat':
+                self._setstats(self._files[row], result)
+                rows.append(row)
+            elif result:
+                self._setrenamed(self._files[row], result)
+                rows.append(row)
+        if rows:
+            self.emit(SIGNAL('dataChanged(const QModelIndex &, const QModelIndex &)'),
+                      self.index(min(rows), 0), self.index(max(rows), 1))
+        if not self._pool.busy():
+            self._pool_timer.stop()
+
+    def _setstats(self, desc, stats):
+        """Set the 'stats' of ``desc`` from the `diffstat` of its file"""
+        tot, add, rem = stats or (0, 0, 0)
+        if tot == 0:
+            tot = max(add + rem, 1)
+        desc['stats'] = (tot, add, rem)
+
+    def _setrenamed(self, desc, renamed):
+        """Mark ``desc`` as renamed or copied given the ``renamed()`` value
+        of its file"""
+        status = repostatus(self.repo, desc['parent'].node(),
+                            self.current_ctx.node())
+        oldname, node = renamed
+        if status.kind(oldname) == REMOVED:
+            # removed.remove(oldname) XXX
+            desc['renamedfrom'] = (oldname, node)
+            desc['flag'] = '='
+            desc['desc'] += '\n (was %s)' % oldname
+        else:
+            desc['copiedfrom'] = (oldname, node)
+            desc['flag'] = '='
+            desc['desc'] += '\n (copy of %s)' % oldname
 
     def _fill_one_step(self):
         if self._fill_iter is None:
@@ -612,33 +681,22 @@ class HgFileListModel(QtCore.QAbstractTableModel):
             filename = desc['path']
             if desc['flag'] == '=' and self._displaydiff:
                 try:
-                    diff = revdiff(self.repo, self.current_ctx, None, files=[filename])
-                    tot = self.current_ctx.filectx(filename).data().count('\n')
-                    add = len(replus.findall(diff))
-                    rem = len(reminus.findall(diff))
+                    if getattr(self.current_ctx, 'applied', True):
+                        tot, add, rem = diffstat(self.current_ctx, filename)
+                    else: # files of unapplied patches hold their diff
+                        diff = self.current_ctx.filectx(filename).data()
+                        tot = diff.count('\n')
+                        add = len(replus.findall(diff))
+                        rem = len(reminus.findall(diff))
                 except (LookupError, TypeError): # unknown revision and mq support
                     tot, add, rem = 0, 0, 0
-
-                if tot == 0:
-                    tot = max(add + rem, 1)
-                desc['stats'] = (tot, add, rem)
+                self._setstats(desc, (tot, add, rem))
                 yield row, 1
 
             if desc['flag'] == '+':
                 m = self.current_ctx.filectx(filename).renamed()
                 if m:
-                    removed = self.repo.status(desc['parent'].node(),
-                                               self.current_ctx.node())[2]
-                    oldname, node = m
-                    if oldname in removed:
-                        # removed.remove(oldname) XXX
-                        desc['renamedfrom'] = (oldname, node)
-                        desc['flag'] = '='
-                        desc['desc'] += '\n (was %s)' % oldname
-                    else:
-                        desc['copiedfrom'] = (oldname, node)
-                        desc['flag'] = '='
-                        desc['desc'] += '\n (copy of %s)' % oldname
+                    self._setrenamed(desc, m)
                     yield row, 0
             yield None
 
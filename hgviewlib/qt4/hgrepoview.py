@@ -17,7 +17,7 @@ Qt4 high level widgets for hg repo changelogs and filelogs
 """
 import sys
 from collections import namedtuple, defaultdict
-from operator import le, ge, lt, gt
+from bisect import bisect_left, bisect_right
 
 from mercurial import cmdutil, ui
 from mercurial.node import hex, short as short_hex, bin as short_bin
@@ -34,10 +34,12 @@ nullvariant = QtCore.QVariant()
 
 from hgviewlib.decorators import timeit
 from hgviewlib.config import HgConfig
-from hgviewlib.hgpatches.scmutil import revrange
+from hgviewlib.hgpatches.scmutil import revchunks
 from hgviewlib.util import format_desc, xml_escape, tounicode
-from hgviewlib.util import first_known_precursors, first_known_successors
+from hgviewlib.obscache import obsindex
+from hgviewlib.hgpatches import phases
 from hgviewlib.qt4 import icon as geticon
+from hgviewlib.qt4.hgrepomodel import GraphNodeRole, GraphCell
 from hgviewlib.qt4.hgmanifestdialog import ManifestViewer
 from hgviewlib.qt4.quickbar import QuickBar
 from hgviewlib.qt4.helpviewer import HgHelpViewer
@@ -67,47 +69,77 @@ except ImportError:
 
 class GotoQuery(QtCore.QThread):
     """A dedicated thread that queries a revset to the repo related to
-    the model"""
-    def __init__(self):
+    the model.
+
+    Rows found so far are sent with a 'revset_progress' signal while the
+    revset is evaluated, slice of the repository by slice (see
+    `revchunks`), and while the graph of the model is filled. Signals also
+    carry the ``generation`` of the query, which tells the results of a
+    query from the ones of the queries it replaced."""
+    # delay between two looks at the graph being filled, in ms
+    poll_delay = 100
+
+    def __init__(self, revexp, model, generation, build=False):
         super(GotoQuery, self).__init__()
-        self.rows = None
-        self.revexp = None
-        self.model = None
+        self.revexp = revexp
+        self.model = model
+        self.generation = generation
+        self._cancelled = False
+        self._build = build # build the graph down to found revisions
 
-    def __del__(self):
-        self.terminate()
+    def cancel(self):
+        """Stop the query once the current slice is evaluated, without
+        waiting for it"""
+        self._cancelled = True
 
     def run(self):
-        revset = None
+        revexp = self.revexp
+        rows, pending = set(), []
         try:
-            revset = revrange(self.model.repo, [self.revexp.encode('utf-8')])
+            for revs in revchunks(self.model.repo, revexp.encode('utf-8')):
+                if self._cancelled:
+                    return
+                pending.extend(revs)
+                pending = self._maprows(pending, rows)
         except (RepoError, ParseError, LookupError, RepoLookupError, Abort), err:
-            self.rows = None
-            self.emit(SIGNAL('failed_revset'), err)
+            self.emit(SIGNAL('failed_revset'), err, self.generation)
             return
-        if revset is None:
-            self.rows = ()
-            self.emit(SIGNAL('new_revset'), self.rows, self.revexp)
+        if self._build:
+            # the graph was built down to each revision: the other ones are
+            # not displayed (closed branch, filtered out or hidden). The
+            # graph of a threaded model is filled by the GUI thread, which
+            # may be the one running this query, so do not wait for it.
+            pending = []
+        # rows of other revisions are found as the graph is filled
+        while pending and not self._cancelled:
+            graph = self.model.graph
+            filled = graph is None or graph.isfilled()
+            pending = self._maprows(pending, rows)
+            if filled:
+                break
+            self.msleep(self.poll_delay)
+        if self._cancelled:
             return
-        rows = (idx.row() for idx in
-                (self.model.indexFromRev(rev) for rev in revset)
-                if idx is not None)
-        self.rows = tuple(sorted(rows))
-        self.emit(SIGNAL('new_revset'), self.rows, self.revexp)
-
-    def perform(self, revexp, model):
-        self.terminate()
-        self.revexp = revexp
-        self.model = model
-        self.start()
-
-    def perform_now(self, revexp, model):
-        self.revexp = revexp
-        self.model = model
-        self.run()
-
-    def get_last_results(self):
-        return self.rows
+        self.emit(SIGNAL('new_revset'), tuple(sorted(rows)), self.generation)
+
+    def _maprows(self, revs, rows):
+        """Add the rows of ``revs`` which are built to ``rows`` and return
+        the other revisions"""
+        if self.model.graph is None:
+            return []
+        pending = []
+        nrows = len(rows)
+        for rev in revs:
+            row = self.model.rowFromRev(rev, self._build)
+            if row is None:
+                pending.append(rev)
+            else:
+                rows.add(row)
+        if len(rows) != nrows:
+            # `goto` may go to rows found so far
+            self.emit(SIGNAL('revset_progress'), tuple(sorted(rows)),
+                      self.generation)
+        return pending
 
 class CompleterModel(QtGui.QStringListModel):
     def add_to_string_list(self, *values):
@@ -164,11 +196,15 @@ class QueryLineEdit(QtGui.QLineEdit):
 class GotoQuickBar(QuickBar):
     def __init__(self, parent):
         self._parent = parent
-        self._goto_query = None
+        self._queries = [] # running `GotoQuery`, the last one is current
+        self._generation = 0 # generation of the current query
+        self._rows = None # rows found by the current query
         self.compl_model = None
         self.completer = None
         self.row_before = 0
         self._standby_revexp = None # revexp that requires an action from user
+        self._revexp = None # revexp being queried
+        self._found = False # rows were found for the revexp being queried
         QuickBar.__init__(self, "Goto", "Ctrl+G", "Goto", parent)
 
     def createActions(self, openkey, desc):
@@ -210,10 +246,6 @@ class GotoQuickBar(QuickBar):
         self.addAction(self._actions['prev'])
         self.addAction(self._actions['next'])
         self.addAction(self._actions['help'])
-        # querier (threaded)
-        self._goto_query = GotoQuery()
-        connect(self._goto_query, SIGNAL('failed_revset'), self.on_failed)
-        connect(self._goto_query, SIGNAL('new_revset'), self.on_queried)
 
     def setVisible(self, visible=True):
         QuickBar.setVisible(self, visible)
@@ -225,6 +257,7 @@ class GotoQuickBar(QuickBar):
         #  QObject::startTimer: QTimer can only be used with threads
         #  started with QThread
         self.entry.setCompleter(None)
+        self.cancel_queries()
 
     def show_help(self):
         w = HgHelpViewer(self._parent.model().repo, 'revset', self)
@@ -263,7 +296,7 @@ class GotoQuickBar(QuickBar):
             return
         if self._standby_revexp is not None:
             self.search(self._standby_revexp, threaded=False)
-        rows = self._goto_query.get_last_results()
+        rows = self._rows
         if rows is None:
             self.entry.status = 'failed'
             return
@@ -283,6 +316,8 @@ class GotoQuickBar(QuickBar):
             revexp = self._standby_revexp
         self._standby_revexp = None
         if not revexp:
+            self.cancel_queries()
+            self._revexp = None
             self.emit(SIGNAL('new_set'), None)
             self.emit(SIGNAL('goto_next_from'), (self.row_before,))
             return
@@ -290,31 +325,197 @@ class GotoQuickBar(QuickBar):
         self._actions['next'].setEnabled(False)
         self._actions['prev'].setEnabled(False)
         self.entry.status = 'query'
+        self._revexp = revexp
+        self._found = False
+        self.cancel_queries()
+        # the graph is filled by the query if it is not threaded
+        query = GotoQuery(revexp, self._parent.model(), self._generation,
+                          build=not threaded)
+        connect(query, SIGNAL('failed_revset'), self.on_failed)
+        connect(query, SIGNAL('new_revset'), self.on_queried)
+        connect(query, SIGNAL('revset_progress'), self.on_progress)
         if threaded:
-            self._goto_query.perform(revexp, self._parent.model())
+            # keep cancelled queries until their thread ends
+            self._queries = [old for old in self._queries if old.isRunning()]
+            self._queries.append(query)
+            query.start()
         else:
-            self._goto_query.perform_now(revexp, self._parent.model())
+            query.run()
+
+    def cancel_queries(self):
+        """Cancel running queries, their results are ignored from now on"""
+        self._generation += 1
+        self._rows = None
+        for query in self._queries:
+            query.cancel()
 
     def show_message(self, message, delay=-1):
         self.parent().statusBar().showMessage(message, delay)
 
-    def on_queried(self, rows=None, revexp=''):
+    def on_progress(self, rows, generation):
+        """Slot to handle rows found so far for a revset."""
+        if generation != self._generation: # sent before it was cancelled
+            return
+        self._rows = rows
+        self.emit(SIGNAL('new_set'), rows)
+        if not self._found:
+            self._found = True
+            self.emit(SIGNAL('goto_next_from'), rows)
+            self._actions['next'].setEnabled(True)
+            self._actions['prev'].setEnabled(True)
+
+    def on_queried(self, rows, generation):
         """Slot to handle new revset."""
+        if generation != self._generation: # sent before it was cancelled
+            return
+        self._rows = rows
         self.entry.status = 'valid'
         self.emit(SIGNAL('new_set'), rows)
-        self.emit(SIGNAL('goto_next_from'), rows)
+        if not self._found:
+            self.emit(SIGNAL('goto_next_from'), rows)
         self._actions['next'].setEnabled(True)
         self._actions['prev'].setEnabled(True)
-        if rows and revexp:
-            self.compl_model.add_to_string_list(revexp)
+        if rows:
+            self.compl_model.add_to_string_list(self._revexp)
 
-    def on_failed(self, err):
+    def on_failed(self, err, generation):
+        if generation != self._generation: # sent before it was cancelled
+            return
+        self._rows = None
         self.entry.status = 'failed'
         self.show_message(unicode(err))
         self._actions['next'].setEnabled(False)
         self._actions['prev'].setEnabled(False)
 
 
+class GraphDelegate(QtGui.QStyledItemDelegate):
+    """
+    Delegate painting the graph of a row of a `HgRepoListModel` left to its
+    text, from the `GraphCell` of its `GraphNodeRole` data.
+    """
+    pan = 2
+
+    def __init__(self, parent=None):
+        QtGui.QStyledItemDelegate.__init__(self, parent)
+        self._pens = {}
+        self._brushes = {}
+
+    def _pen(self, color, width, style=Qt.SolidLine, alpha=255):
+        key = (color, width, style, alpha)
+        pen = self._pens.get(key)
+        if pen is None:
+            qcolor = QtGui.QColor(color)
+            qcolor.setAlpha(alpha)
+            pen = self._pens[key] = QtGui.QPen(qcolor)
+            pen.setWidth(width)
+            pen.setStyle(style)
+        return pen
+
+    def _brush(self, color, alpha=255):
+        key = (color, alpha)
+        brush = self._brushes.get(key)
+        if brush is None:
+            qcolor = QtGui.QColor(color)
+            qcolor.setAlpha(alpha)
+            brush = self._brushes[key] = QtGui.QBrush(qcolor)
+        return brush
+
+    def _cell(self, index):
+        cell = index.model().data(index, GraphNodeRole)
+        if isinstance(cell, GraphCell):
+            return cell
+        return None
+
+    def graphwidth(self, index, cell):
+        return index.model().col2x(cell.gnode.cols, self.pan)
+
+    def paint(self, painter, option, index):
+        cell = self._cell(index)
+        if cell is None:
+            QtGui.QStyledItemDelegate.paint(self, painter, option, index)
+            return
+        width = self.graphwidth(index, cell)
+        # background of the whole cell, the text is drawn next to the graph
+        opt = QtGui.QStyleOptionViewItemV4(option)
+        self.initStyleOption(opt, index)
+        if opt.widget is not None:
+            style = opt.widget.style()
+        else:
+            style = QtGui.QApplication.style()
+        style.drawPrimitive(QtGui.QStyle.PE_PanelItemViewItem, opt, painter,
+                            opt.widget)
+        painter.save()
+        try:
+            painter.setClipRect(option.rect)
+            painter.translate(option.rect.left(), option.rect.top())
+            self.paint_graph(painter, index.model(), cell,
+                             option.rect.height())
+        finally:
+            painter.restore()
+        opt = QtGui.QStyleOptionViewItemV4(option)
+        opt.rect = option.rect.adjusted(width, 0, 0, 0)
+        QtGui.QStyledItemDelegate.paint(self, painter, opt, index)
+
+    def paint_graph(self, painter, model, cell, h):
+        """Paint the graph ``cell`` of a row of height ``h``"""
+        gnode = cell.gnode
+        radius = model.dot_radius
+        col2x = model.col2x
+        pan = self.pan
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+
+        dot_x = col2x(gnode.x, pan)
+        dot_y = h / 2
+        for y1, y2, lines in ((0, h, gnode.bottomlines),
+                              (-h, 0, gnode.toplines)):
+            for start, end, color, fill in lines:
+                if fill:
+                    pen = self._pen(model.get_color(color), 2)
+                else:
+                    pen = self._pen(model.get_color(color), 2,
+                                    Qt.DotLine, 150)
+                painter.setPen(pen)
+                x1 = col2x(start, pan) + radius / 2
+                x2 = col2x(end, pan) + radius / 2
+                painter.drawLine(x1, dot_y + y1, x2, dot_y + y2)
+
+        if cell.trimmed:
+            return
+        dot_y = (h/2) - radius / 2
+        if cell.icon:
+            geticon(cell.icon).paint(painter, dot_x-5, dot_y-5, 17, 17)
+            return
+        if cell.obsolete:
+            painter.setBrush(self._brush(cell.branch_color, 150))
+            pen = self._pen(cell.branch_color, 1, alpha=150)
+        elif cell.ishead:
+            painter.setBrush(self._brush(cell.branch_color))
+            pen = self._pen(QtGui.QColor(cell.branch_color).darker().name(), 2)
+        else:
+            painter.setBrush(self._brush(cell.branch_color))
+            pen = self._pen(Qt.black, 1)
+        if cell.redpen:
+            pen = self._pen(Qt.red, pen.width())
+        painter.setPen(pen)
+        if cell.phase == phases.draft:
+            painter.drawRect(dot_x, dot_y, radius, radius)
+        elif cell.phase == phases.secret:
+            P = QtCore.QPointF
+            painter.drawPolygon(
+                P(dot_x + (radius//2), dot_y),
+                P(dot_x, dot_y + radius),
+                P(dot_x + radius, dot_y+radius)
+                )
+        else:
+            painter.drawEllipse(dot_x, dot_y, radius, radius)
+
+    def sizeHint(self, option, index):
+        size = QtGui.QStyledItemDelegate.sizeHint(self, option, index)
+        cell = self._cell(index)
+        if cell is not None:
+            size.setWidth(size.width() + self.graphwidth(index, cell))
+        return size
+
 class HgRepoView(QtGui.QTableView):
     """
     A QTableView for displaying a FileRevModel or a HgRepoListModel,
@@ -329,6 +530,7 @@ class HgRepoView(QtGui.QTableView):
         self.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
         self.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
         self.setAlternatingRowColors(True)
+        self.graph_delegate = GraphDelegate(self)
 
         self.createActions()
         self.createToolbars()
@@ -508,6 +710,7 @@ class HgRepoView(QtGui.QTableView):
         self.goto_toolbar.compl_model.add_to_string_list(*revaliases)
         col = list(model._columns).index('Log')
         self.horizontalHeader().setResizeMode(col, QtGui.QHeaderView.Stretch)
+        self.setItemDelegateForColumn(col, self.graph_delegate)
         self.cfg = HgConfig(model.repo.ui)
         self.rowheight = self.cfg.getRowHeight()
         self.verticalHeader().setDefaultSectionSize(self.rowheight)
@@ -651,23 +854,20 @@ class HgRepoView(QtGui.QTableView):
         if not rows:
             return
         currow = self.currentIndex().row()
-        if strict:
-            greater, less = gt, lt
-        else:
-            greater, less = ge, le
+        # rows are sorted
         if forward:
-            comparer, _rows = greater, rows
+            pos = (strict and bisect_right or bisect_left)(rows, currow)
+            if pos == len(rows):
+                self.visual_bell()
+                pos = 0
         else:
-            comparer, _rows = less, reversed(rows)
-        try:
-            row = (row for row in _rows if comparer(row, currow)).next()
-        except StopIteration:
-            self.visual_bell()
-            row = rows[0 if forward else -1]
-        self.setCurrentIndex(self.model().index(row, 0))
-        pos = rows.index(row) + 1
+            pos = (strict and bisect_left or bisect_right)(rows, currow) - 1
+            if pos < 0:
+                self.visual_bell()
+                pos = len(rows) - 1
+        self.setCurrentIndex(self.model().index(rows[pos], 0))
         self.emit(SIGNAL('showMessage'),
-                  "revision #%i of %i" % (pos, len(rows)),
+                  "revision #%i of %i" % (pos + 1, len(rows)),
                   -1)
 
     def nextRev(self):
@@ -683,21 +883,32 @@ class HgRepoView(QtGui.QTableView):
         if rows is None:
             self.visual_bell()
             self.emit(SIGNAL('showMessage'), 'Revision set cleared.', 2000)
-            self.verticalHeader().setDefaultSectionSize(self.rowheight)
         else:
             self.emit(SIGNAL('showMessage'),
                       '%i revisions found.' % len(rows),
                       2000)
-            if rows and self.cfg.getRevsetView() == 'trim':
-                rowheight = self.cfg.getRowHeightTrimmed()
-            else:
-                rowheight = self.rowheight
-            self.verticalHeader().setDefaultSectionSize(rowheight)
-            for row in rows:
-                self.setRowHeight(row, self.rowheight)
+        if rows and self.cfg.getRevsetView() == 'trim':
+            self.set_row_heights(self.cfg.getRowHeightTrimmed(), rows)
+        else:
+            self.set_row_heights(self.rowheight)
         self.model().highlight_rows(rows)
         self.refresh_display()
 
+    def set_row_heights(self, rowheight, fullrows=()):
+        """Set the height of rows to ``rowheight`` except for ``fullrows``"""
+        header = self.verticalHeader()
+        # the view is laid out once for all rows instead of once per row
+        header.blockSignals(True)
+        try:
+            header.setDefaultSectionSize(rowheight)
+            if rowheight != self.rowheight:
+                for row in fullrows:
+                    header.resizeSection(row, self.rowheight)
+        finally:
+            header.blockSignals(False)
+        self.updateGeometries()
+        self.viewport().update()
+
     def refresh_display(self):
         for item in self.children():
             try:
@@ -861,11 +1072,12 @@ class RevDisplay(QtGui.QTextBrowser):
             r = p.rev()
             if r > -1 and r not in self.excluded:
                 buf += self._html_ctx_info(p, 'Child', 'Direct descendant of this changeset')
-        for prec in first_known_precursors(ctx, self.excluded):
-            buf += self._html_ctx_info(prec, 'Precursor',
+        obsolete = obsindex(ctx._repo, self.excluded)
+        for prec in obsolete.precursors(ctx.rev()):
+            buf += self._html_ctx_info(ctx._repo[prec], 'Precursor',
                 'Previous version obsolete by this changeset')
-        for suc in first_known_successors(ctx, self.excluded):
-            buf += self._html_ctx_info(suc, 'Successors',
+        for suc in obsolete.successors(ctx.rev()):
+            buf += self._html_ctx_info(ctx._repo[suc], 'Successors',
                 'Updated version that make this changeset obsolete')
         bookmarks = ', '.join(ctx.bookmarks())
         if bookmarks:
@@ -33,6 +33,7 @@ from hgviewlib.qt4.hgdialogmixin import HgDialogMixin
 from hgviewlib.qt4.quickbar import FindInGraphlogQuickBar
 from hgviewlib.qt4.helpviewer import HgviewHelpViewer
 from hgviewlib.hgpatches import hiddenrevs
+from hgviewlib.branchcache import branchsummary
 
 from mercurial.error import RepoError
 
@@ -117,15 +118,10 @@ class HgRepoViewer(QtGui.QMainWindow, HgDialogMixin, _HgRepoViewer):
         self.reload()
 
     def setupBranchCombo(self, *args):
-        allbranches = sorted(self.repo.branchtags().items())
-
-        openbr = []
-        for branch, brnode in allbranches:
-            openbr.extend(self.repo.branchheads(branch, closed=False))
-        clbranches = [br for br, node in allbranches if node not in openbr]
-        branches = [br for br, node in allbranches if node in openbr]
+        summary = branchsummary(self.repo)
+        branches = summary.names(closed=False)
         if self.branch_checkBox_action.isChecked():
-            branches = branches + clbranches
+            branches = branches + sorted(summary.closed)
 
         if len(branches) == 1:
             self.branch_label_action.setEnabled(False)
@@ -365,6 +361,18 @@ class HgRepoViewer(QtGui.QMainWindow, HgDialogMixin, _HgRepoViewer):
         self.textview_status.setModel(self.repomodel)
         self.find_toolbar.setModel(self.repomodel)
 
+    def resetModels(self):
+        """Point the existing models to the current repository"""
+        view = self.tableView_revisions
+        if self.repomodel.highlights is not None:
+            # rows of the revision set may not exist any more
+            view.goto_toolbar.cancel_queries()
+            view.highlight_rows(None)
+        self.repomodel.setRepo(self.repo)
+        view.goto_toolbar.compl_model.add_to_string_list(
+            *self.repo.tags().keys())
+        self.filelistmodel = HgFileListModel(self.repo)
+        self.tableView_filelist.setModel(self.filelistmodel)
 
     def displaySelectedFile(self, filename=None, rev=None):
         if filename == '':
@@ -534,12 +542,16 @@ class HgRepoViewer(QtGui.QMainWindow, HgDialogMixin, _HgRepoViewer):
         self._reload_rev = self.tableView_revisions.current_rev
         self._reload_file = self.tableView_filelist.currentFile()
         self.repo = build_repo(self.repo.ui, self.repo.root)
-        self._finish_load()
+        # the revision model is kept so that rows of its graph are reused
+        self._finish_load(reuse_models=True)
 
-    def _finish_load(self):
+    def _finish_load(self, reuse_models=False):
         self._repodate = self._getrepomtime()
         self.setupBranchCombo()
-        self.setupModels()
+        if reuse_models:
+            self.resetModels()
+        else:
+            self.setupModels()
 
     #@timeit
     def refreshRevisionTable(self, *args, **kw):
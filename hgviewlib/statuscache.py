@@ -0,0 +1,76 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""changes between two revisions
+
+The file list of a changeset, its file flags and the detection of renamed
+files all need the status of the changeset against its parents. `repostatus`
+keeps the recent ones of a repository so that they are computed once.
+"""
+
+from hgviewlib.util import LRUCache, isnode
+
+# kinds of changes, indexes of the lists of a status
+MODIFIED, ADDED, REMOVED, DELETED, UNKNOWN = range(5)
+
+# flags of files, see `hgviewlib.hggraph.Graph.fileflags`
+FLAGS = ('=', '+', '-', '-', '?')
+
+# number of statuses kept for a repository
+CACHE_SIZE = 64
+
+class RepoStatus(object):
+    """
+    Modified, added, removed, deleted and unknown files between two
+    revisions, with a constant time lookup of the change of a file.
+    """
+    def __init__(self, changes):
+        self.changes = tuple(changes[:5])
+        (self.modified, self.added, self.removed, self.deleted,
+         self.unknown) = self.changes
+        self._kinds = None
+
+    def kind(self, filename):
+        """Return the kind of change of ``filename`` (`MODIFIED`...), None if
+        it is unchanged"""
+        if self._kinds is None:
+            kinds = {}
+            # a file is given the first kind of change it is listed in
+            for kind in xrange(len(self.changes) - 1, -1, -1):
+                for name in self.changes[kind]:
+                    kinds[name] = kind
+            self._kinds = kinds
+        return self._kinds.get(filename)
+
+    def flag(self, filename):
+        """Return the flag of ``filename`` ('=', '+', '-', '?' or '')"""
+        kind = self.kind(filename)
+        if kind is None:
+            return ''
+        return FLAGS[kind]
+
+def repostatus(repo, node1, node2):
+    """Return the `RepoStatus` of ``repo`` between ``node1`` and ``node2``.
+    It is kept unless one of them is not a changeset (working directory,
+    mq patch)."""
+    cache = getattr(repo, '_hgview_status', None)
+    if cache is None:
+        cache = repo._hgview_status = LRUCache(CACHE_SIZE)
+    key = (node1, node2)
+    status = cache.get(key)
+    if status is None:
+        status = RepoStatus(repo.status(node1, node2))
+        if isnode(repo, node1) and isnode(repo, node2):
+            cache[key] = status
+    return status
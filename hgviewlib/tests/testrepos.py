@@ -0,0 +1,100 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""repositories built from scratch for tests"""
+
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+from unittest import TestCase
+
+from mercurial import ui as uimod, dispatch, context
+
+from hgviewlib.util import build_repo
+
+class Options(object):
+    """command line options of hgview, see `hgviewlib.config.HgConfig`"""
+    interface = 'raw'
+
+def newui():
+    ui = uimod.ui()
+    ui.setconfig('ui', 'quiet', 'true')
+    ui.setconfig('ui', 'username', 'test <test@example.org>')
+    ui.setconfig('extensions', 'mq', '')
+    ui.opts = Options()
+    return ui
+
+class RepoTestCase(TestCase):
+    """
+    Test case working on a new repository, built by `hg` commands.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='hgview-test-')
+        self.hg('init')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def hg(self, *args):
+        """Run the hg command ``args`` in the repository"""
+        out = StringIO()
+        req = dispatch.request(['--cwd', self.path] + list(args), newui(),
+                               fout=out, ferr=out)
+        if dispatch.dispatch(req):
+            self.fail('hg %s failed: %s' % (' '.join(args), out.getvalue()))
+
+    def write(self, filename, data):
+        """Write ``data`` in ``filename`` of the working directory"""
+        fobj = open(os.path.join(self.path, filename), 'wb')
+        try:
+            fobj.write(data)
+        finally:
+            fobj.close()
+
+    def commit(self, message, **files):
+        """Write ``files`` (a mapping of names to contents) and commit them"""
+        for filename, data in files.iteritems():
+            self.write(filename, data)
+        self.hg('commit', '-A', '-m', message)
+
+    def repo(self):
+        """Return a new instance of the repository"""
+        repo = build_repo(newui(), self.path)
+        repo.ui.opts = Options()
+        return repo
+
+    def lanes(self, nlanes, nrounds, start=0):
+        """Commit a changeset on each of ``nlanes`` lines of development in
+        turn, ``nrounds`` times, the first lane merging the last one every
+        third round. Lanes fork from the tip, rounds are numbered from
+        ``start``."""
+        repo = self.repo()
+        def filectxfn(repo, memctx, path):
+            return context.memfilectx(path, '%s\n' % memctx.description(),
+                                      False, False, None)
+        lock = repo.lock()
+        try:
+            heads = [repo.changelog.tip()] * nlanes
+            for step in xrange(start, start + nrounds):
+                for lane in xrange(nlanes):
+                    parents = (heads[lane], None)
+                    if not lane and step % 3 == 2:
+                        parents = (heads[lane], heads[-1])
+                    ctx = context.memctx(repo, parents,
+                                         'lane %i step %i' % (lane, step),
+                                         ['lane%i' % lane], filectxfn, 'test')
+                    heads[lane] = repo.commitctx(ctx)
+        finally:
+            lock.release()
@@ -0,0 +1,174 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import TestCase, main
+
+from mercurial import mdiff, patch
+
+from hgviewlib.util import LRUCache
+from hgviewlib.hggraph import Graph, revision_grapher, diff
+from hgviewlib.diffcache import ChangesetDiff, FileDataCache
+from hgviewlib import diffstat as diffstatmod
+from hgviewlib.diffstat import diffstat
+
+from testrepos import RepoTestCase
+
+def hunks(text):
+    """Return the hunks of the decoded diff ``text``"""
+    return ''.join(text.partition(os.linesep + '@@')[1:]).lstrip()
+
+class ChangesetDiffTC(RepoTestCase):
+    def setUp(self):
+        super(ChangesetDiffTC, self).setUp()
+        self.commit('0', a='a\nb\nc\n', b='b\n', c='c\n', d='d\n')
+        self.hg('copy', 'a', 'copied')
+        self.write('a', 'a\nB\nc\n')
+        self.write('copied', 'a\nb\nc\nd\n')
+        self.write('d', 'd\0\n')
+        self.hg('remove', 'b')
+        self.commit('1', c='C\n', e='e\n')
+
+    def check_files(self, git):
+        repo = self.repo()
+        repo.ui.setconfig('diff', 'git', str(git))
+        ctx = repo[1]
+        csdiff = ChangesetDiff(repo, ctx.p1(), ctx)
+        filenames = ctx.files() + ['unchanged']
+        for filename in reversed(filenames):
+            self.assertEqual(csdiff.filediff(filename),
+                             hunks(diff(repo, ctx, files=[filename])))
+
+    def test_files(self):
+        self.check_files(False)
+
+    def test_files_git(self):
+        self.check_files(True)
+
+    def diffed(self, func, *args):
+        """Return the result of ``func(*args)`` and the names of the files
+        it diffed"""
+        diffed = []
+        unidiff = mdiff.unidiff
+        def countdiff(a, ad, b, bd, fn1, fn2, *args, **kwargs):
+            diffed.append(fn2)
+            return unidiff(a, ad, b, bd, fn1, fn2, *args, **kwargs)
+        mdiff.unidiff = countdiff
+        try:
+            return func(*args), diffed
+        finally:
+            mdiff.unidiff = unidiff
+
+    def test_single_file(self):
+        repo = self.repo()
+        ctx = repo[1]
+        text, diffed = self.diffed(ChangesetDiff(repo, ctx.p1(), ctx).filediff,
+                                   'e')
+        self.assertEqual(text, u'@@ -0,0 +1,1 @@\n+e\n')
+        self.assertEqual(diffed, ['e'])
+
+    def test_switch_files(self):
+        repo = self.repo()
+        cache = FileDataCache(repo, 1 << 20)
+        graph = Graph(repo, revision_grapher(repo), filecache=cache)
+        for filename in ('a', 'c'):
+            result, diffed = self.diffed(graph.filedata, filename, 1)
+            self.assertEqual(diffed, [filename])
+        self.assertEqual((cache._items.hits, cache._items.misses), (0, 2))
+        # switching back to a file of the changeset does not diff it again
+        for filename in ('a', 'c', 'a'):
+            result, diffed = self.diffed(graph.filedata, filename, 1)
+            self.assertEqual(diffed, [])
+            self.assertEqual(result[0], '=')
+        self.assertEqual((cache._items.hits, cache._items.misses), (3, 2))
+
+    def test_diffstat(self):
+        repo = self.repo()
+        # file headers are needed to tell files apart
+        repo.ui.setconfig('ui', 'quiet', 'false')
+        ctx = repo[1]
+        lines = ''.join(patch.diff(repo, ctx.p1().node(), ctx.node()))
+        stats = patch.diffstatdata(lines.splitlines())
+        self.assertEqual(len(stats), len(ctx.files()))
+        for filename, added, removed, binary in stats:
+            if filename not in ctx:
+                continue
+            self.assertEqual(diffstat(ctx, filename)[1:], (added, removed))
+
+    def test_worker_config(self):
+        repo = self.repo()
+        repo.ui.setconfig('diff', 'git', 'True')
+        diffstatmod._initworker(self.path, list(repo.ui.walkconfig()))
+        try:
+            workerui = diffstatmod._workerrepo.ui
+        finally:
+            diffstatmod._workerrepo = None
+        self.assertEqual(workerui.config('diff', 'git'), 'True')
+        self.assertEqual(workerui.config('extensions', 'mq'), '')
+
+class LRUCacheTC(TestCase):
+    def test_budget(self):
+        cache = LRUCache(100, len)
+        for idx in xrange(10):
+            cache[idx] = 'x' * 10
+        self.assertEqual((len(cache), cache.size), (10, 100))
+        cache[0] # most recently used now
+        cache[10] = 'x' * 10
+        # the least recently used items are dropped down to 3/4 of the budget
+        self.assertEqual(cache.size, 70)
+        self.assertEqual(sorted(cache._items), [0, 5, 6, 7, 8, 9, 10])
+        self.assertEqual(cache.get(1), None)
+        self.assertEqual(cache.get(0), 'x' * 10)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_replace(self):
+        cache = LRUCache(100, len)
+        cache['a'] = 'x' * 60
+        cache['a'] = 'x' * 30
+        cache['b'] = 'x' * 60
+        self.assertEqual((len(cache), cache.size), (2, 90))
+        del cache['a']
+        self.assertEqual(cache.size, 60)
+
+    def test_too_big(self):
+        cache = LRUCache(100, len)
+        cache['a'] = 'x' * 10
+        cache['b'] = 'x' * 101
+        self.assertFalse('b' in cache)
+        self.assertTrue(cache.size <= 100)
+
+    def test_items(self):
+        cache = LRUCache(3)
+        for idx in xrange(4):
+            cache[idx] = None
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(3 in cache)
+
+class FileDataCacheTC(TestCase):
+    def test_budget(self):
+        cache = FileDataCache(None, 100)
+        for idx in xrange(10):
+            cache[(None, str(idx), 'diff')] = ('=', 'x' * 10)
+        self.assertEqual(len(cache), 10)
+        for idx in xrange(10, 20):
+            # unicode characters take several bytes
+            cache[(None, str(idx), 'diff')] = ('=', u'x' * 10)
+        self.assertTrue(len(cache) < 10)
+        self.assertTrue(cache._items.size <= 100)
+        self.assertEqual(cache.get((None, '19', 'diff')), ('=', u'x' * 10))
+        self.assertEqual(cache.get((None, '0', 'diff')), None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import main
+
+from hgviewlib.hggraph import HgRepoListWalker, Graph, revision_grapher
+from hgviewlib.hggraph import GrapherThread, _graph_iterator
+from hgviewlib.hgpatches import phases, phaserevs
+from hgviewlib.graphcache import GraphLayoutCache, GrapherState
+from hgviewlib.hggraph import getlog, getauthor, getbranch, getdate
+from hgviewlib.hggraph import gettags, getbookmarks
+from hgviewlib.flagcache import revflags
+from hgviewlib.branchcache import BranchIndex, branchindex
+
+from testrepos import RepoTestCase
+
+def layout(graph):
+    """Return the rows of ``graph`` as (rev, column, edges)"""
+    list(graph.fill())
+    return [(gnode.rev, gnode.x, [line[:2] for line in gnode.bottomlines])
+            for gnode in graph]
+
+class WorkingDirectoryRowTC(RepoTestCase):
+    def setUp(self):
+        super(WorkingDirectoryRowTC, self).setUp()
+        self.commit('0', a='0\n')
+        self.commit('1', a='1\n')
+        self.commit('2', a='2\n')
+
+    def walker_layout(self, walkerclass=HgRepoListWalker):
+        walker = walkerclass(self.repo())
+        walker.updateWdStatus(block=True)
+        return layout(walker.graph)
+
+    def history_layout(self):
+        repo = self.repo()
+        grapher = revision_grapher(repo, start_rev=len(repo) - 1)
+        return layout(Graph(repo, grapher))
+
+    def test_clean_at_tip(self):
+        self.assertEqual(self.walker_layout(), self.history_layout())
+
+    def test_clean_below_tip(self):
+        self.hg('update', '0')
+        self.assertEqual(self.walker_layout(), self.history_layout())
+
+    def test_clean_below_tip_threaded(self):
+        class ThreadedWalker(HgRepoListWalker):
+            threaded_fill = True
+        self.hg('update', '0')
+        self.assertEqual(self.walker_layout(ThreadedWalker),
+                         self.history_layout())
+
+    def test_clean_null(self):
+        self.hg('update', 'null')
+        self.assertEqual(self.walker_layout(), self.history_layout())
+
+    def test_modified(self):
+        self.hg('update', '0')
+        self.write('a', 'modified\n')
+        rows = self.walker_layout()
+        self.assertEqual([row[0] for row in rows], [None, 2, 1, 0])
+
+class HiddenWalker(HgRepoListWalker):
+    """walker showing unapplied mq patches"""
+    def load_config(self):
+        HgRepoListWalker.load_config(self)
+        self.show_hidden = True
+
+class MqRowsTC(RepoTestCase):
+    def setUp(self):
+        super(MqRowsTC, self).setUp()
+        self.commit('root', a='0\n')
+        self.hg('qnew', '-m', 'patch one', 'one')
+        self.write('a', '1\n')
+        self.hg('qrefresh')
+        self.hg('qnew', '-m', 'patch two', '-u', 'patcher', '-d', '1000000 0',
+                'two')
+        self.write('a', '2\n')
+        self.hg('qrefresh')
+        self.hg('qpop')
+        self.walker = HiddenWalker(self.repo())
+        list(self.walker.graph.fill())
+        self.rows = dict((gnode.rev, gnode) for gnode in self.walker.graph)
+
+    def columns(self, rev, getters):
+        ctx = self.walker.repo.changectx(rev)
+        return [getter(self.walker, ctx, self.rows[rev]) for getter in getters]
+
+    def test_rows(self):
+        self.assertEqual([gnode.rev for gnode in self.walker.graph],
+                         ['two', 1, 0])
+
+    def test_log_columns(self):
+        # patches without a branch in their header have None
+        self.assertEqual(self.columns('two', (getlog, getauthor, getbranch)),
+                         [u'patch two', u'patcher', None])
+        self.assertEqual(self.columns(1, (getlog, getbranch)),
+                         [u'patch one', 'default'])
+        self.assertTrue(self.columns('two', (getdate,))[0])
+
+    def test_marks(self):
+        self.assertEqual(self.columns('two', (gettags, getbookmarks)),
+                         ['two', []])
+        self.walker.hide_mq_tags = True
+        self.assertEqual(self.columns(1, (gettags,)), ['one,tip'])
+
+    def test_flags(self):
+        flags = revflags(self.walker.repo)
+        for rev in self.rows:
+            self.assertEqual(flags.phase(rev),
+                             self.walker.repo.changectx(rev).phase())
+            self.assertFalse(flags.obsolete(rev))
+            self.assertFalse(flags.troubled(rev))
+
+class MarksTC(RepoTestCase):
+    def test_moved_bookmark(self):
+        self.commit('0', a='0\n')
+        self.commit('1', a='1\n')
+        self.hg('bookmark', '-r', '0', 'mark')
+        walker = HgRepoListWalker(self.repo())
+        self.assertEqual(getbookmarks(walker, walker.repo[0], None), ['mark'])
+        # same size and same modification time
+        path = os.path.join(self.path, '.hg', 'bookmarks')
+        stat = os.stat(path)
+        self.hg('bookmark', '-f', '-r', '1', 'mark')
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        walker = HgRepoListWalker(self.repo())
+        self.assertEqual(getbookmarks(walker, walker.repo[1], None), ['mark'])
+
+class LayoutCacheTC(RepoTestCase):
+    options = dict(start_rev=None, show_wd=False)
+
+    def setUp(self):
+        super(LayoutCacheTC, self).setUp()
+        self.lanes(3, 10)
+
+    def graph(self, threaded=False, persistent=True):
+        repo = self.repo()
+        state = GrapherState()
+        layout = GraphLayoutCache(repo, self.options, state, step=5,
+                                  persistent=persistent)
+        if threaded:
+            grapher = GrapherThread(self.repo(), self.options, state, 7)
+        else:
+            grapher = revision_grapher(repo, state=state, **self.options)
+        return Graph(repo, grapher, layout=layout)
+
+    def fresh_layout(self):
+        repo = self.repo()
+        return layout(Graph(repo, revision_grapher(repo, **self.options)))
+
+    def test_roundtrip(self):
+        expected = self.fresh_layout()
+        self.assertEqual(layout(self.graph()), expected)
+        graph = self.graph()
+        graph.build_nodes(1)
+        self.assertTrue(graph.isfilled())
+        self.assertEqual(graph.layout.ncached, len(expected))
+        self.assertEqual(layout(graph), expected)
+
+    def test_resume(self):
+        graph = self.graph()
+        graph.build_nodes(12)
+        graph.close()
+        graph = self.graph()
+        self.assertEqual(layout(graph), self.fresh_layout())
+        # rows down to the last checkpoint were read back
+        self.assertEqual(graph.layout.ncached, 10)
+
+    def check_appended(self, threaded):
+        list(self.graph().fill())
+        self.lanes(3, 2, start=10)
+        graph = self.graph(threaded)
+        graph.build_nodes(1)
+        # stored rows were reused at once
+        self.assertTrue(graph.isfilled())
+        self.assertEqual(layout(graph), self.fresh_layout())
+        # and written back with the new ones
+        graph = self.graph(threaded)
+        graph.build_nodes(1)
+        self.assertEqual(graph.layout.ncached, len(graph))
+
+    def test_appended(self):
+        self.check_appended(False)
+
+    def test_appended_threaded(self):
+        self.check_appended(True)
+
+    def test_appended_interrupted(self):
+        graph = self.graph()
+        graph.build_nodes(22)
+        graph.close()
+        self.lanes(3, 2, start=10)
+        graph = self.graph()
+        graph.build_nodes(1)
+        self.assertTrue(len(graph) > 20)
+        self.assertEqual(layout(graph), self.fresh_layout())
+
+    def test_stripped(self):
+        list(self.graph().fill())
+        self.hg('strip', str(len(self.repo()) - 4))
+        self.lanes(2, 1, start=20)
+        graph = self.graph()
+        self.assertEqual(layout(graph), self.fresh_layout())
+        self.assertEqual(graph.layout.ncached, 0)
+
+    def test_splice(self):
+        old = self.graph(persistent=False)
+        list(old.fill())
+        self.lanes(3, 2, start=10)
+        graph = self.graph(persistent=False)
+        self.assertNotEqual(graph.splice(old), None)
+        self.assertEqual(layout(graph), self.fresh_layout())
+
+class ReorderTC(RepoTestCase):
+    def setUp(self):
+        super(ReorderTC, self).setUp()
+        self.lanes(3, 6)
+        # public revisions of the second lane are interleaved with drafts
+        self.hg('phase', '--public', '-r', '13')
+        self.hg('phase', '--secret', '--force', '-r', '17')
+
+    def sorted_revs(self, repo, start_rev, stop_rev, after=None):
+        """Return the revisions in the order they used to be sorted"""
+        revphases = phaserevs(repo)
+        _cmp = lambda a, b: cmp(phases.public == revphases[a],
+                                phases.public == revphases[b])
+        revs = sorted(xrange(start_rev, stop_rev - 1, -1), cmp=_cmp)
+        if after is not None:
+            revs = revs[revs.index(after) + 1:]
+        return revs
+
+    def test_order(self):
+        repo = self.repo()
+        for start_rev, stop_rev in ((17, 0), (15, 0), (12, 5), (17, 14)):
+            self.assertEqual(list(_graph_iterator(repo, start_rev, stop_rev,
+                                                  reorder=True)),
+                             self.sorted_revs(repo, start_rev, stop_rev))
+        self.assertEqual(list(_graph_iterator(repo, None, 0, reorder=True)),
+                         [None] + self.sorted_revs(repo, 17, 0))
+
+    def test_after(self):
+        repo = self.repo()
+        for after in xrange(18):
+            self.assertEqual(list(_graph_iterator(repo, 17, 0, reorder=True,
+                                                  after=after)),
+                             self.sorted_revs(repo, 17, 0, after))
+
+class BranchIndexTC(RepoTestCase):
+    def setUp(self):
+        super(BranchIndexTC, self).setUp()
+        self.commit('0', a='0\n')
+        self.hg('branch', 'stable')
+        self.commit('1', a='1\n')
+        self.commit('2', a='2\n')
+        self.hg('update', '0')
+        self.commit('3', b='3\n')
+        self.hg('branch', 'old')
+        self.commit('4', b='4\n')
+        self.hg('commit', '--close-branch', '-m', '5')
+        self.hg('update', '3')
+        self.hg('merge', '2')
+        self.commit('6')
+        self.hg('update', '2')
+        self.commit('7', a='7\n')
+
+    def revs(self, **options):
+        repo = self.repo()
+        return [row[0] for row in revision_grapher(repo, show_wd=False,
+                                                   **options)]
+
+    def check_index(self, repo, index):
+        self.assertEqual([index.branch(rev) for rev in repo],
+                         [repo[rev].branch() for rev in repo])
+
+    def test_branch(self):
+        # parents of the branch revisions are shown too
+        self.assertEqual(self.revs(branch='stable'), [7, 2, 1, 0])
+        self.assertEqual(self.revs(branch='old', closed=True), [5, 4, 3])
+        self.assertEqual(self.revs(branch='unknown'), [])
+
+    def test_closed(self):
+        self.assertEqual(self.revs(), [7, 6, 3, 2, 1, 0])
+        self.assertEqual(self.revs(closed=True), range(7, -1, -1))
+
+    def test_stored(self):
+        self.check_index(self.repo(), branchindex(self.repo()))
+        self.commit('8', a='8\n')
+        repo = self.repo()
+        index = BranchIndex()
+        self.assertTrue(index.read(repo))
+        self.assertEqual(len(index), 8)
+        self.assertTrue(index.update(repo))
+        self.check_index(repo, index)
+
+    def test_stripped(self):
+        branchindex(self.repo())
+        self.hg('strip', '7')
+        self.hg('update', '2')
+        self.commit('7', c='7\n')
+        repo = self.repo()
+        index = BranchIndex()
+        self.assertTrue(index.read(repo))
+        self.assertFalse(index.uptodate(repo))
+        index.update(repo)
+        self.check_index(repo, index)
+        self.assertEqual(index.tip, repo.changelog.tip())
+
+if __name__ == '__main__':
+    main()
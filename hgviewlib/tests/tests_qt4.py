@@ -0,0 +1,59 @@
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+from unittest import main, skipIf
+
+try:
+    from PyQt4 import QtCore
+except ImportError: # the Qt interface is optional
+    QtCore = None
+else:
+    from hgviewlib.qt4.hgrepomodel import HgRepoListModel
+    from hgviewlib.qt4.hgrepoview import GotoQuery
+
+from testrepos import RepoTestCase
+
+_app = None
+
+@skipIf(QtCore is None, 'PyQt4 is not installed')
+class GotoQueryTC(RepoTestCase):
+    def setUp(self):
+        global _app
+        super(GotoQueryTC, self).setUp()
+        if QtCore.QCoreApplication.instance() is None:
+            _app = QtCore.QCoreApplication([])
+        self.commit('0', a='0\n')
+        self.hg('branch', 'other')
+        self.commit('1', a='1\n')
+        self.hg('update', 'default')
+        self.commit('2', a='2\n')
+
+    def test_undisplayed_rev(self):
+        # as `GotoQuickBar.goto` does for revision numbers
+        model = HgRepoListModel(self.repo(), branch='default')
+        query = GotoQuery('1', model, 1, build=True)
+        results = []
+        QtCore.QObject.connect(query, QtCore.SIGNAL('new_revset'),
+                               lambda rows, generation: results.append(rows))
+        runner = Thread(target=query.run)
+        runner.setDaemon(True)
+        runner.start()
+        runner.join(10)
+        self.assertFalse(runner.isAlive())
+        self.assertEqual(results, [()])
+
+if __name__ == '__main__':
+    main()
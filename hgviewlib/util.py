@@ -13,7 +13,6 @@ import string
 from mercurial import ui, hg
 
 from hgviewlib.hgpatches.scmutil import match
-from hgviewlib.hgpatches import precursorsmarkers, successorsmarkers
 
 def tounicode(string):
     """
@@ -97,6 +96,90 @@ class Curry(object):
         kwarguments.update(kwargs)
         return self.func(*args, **kwarguments)
 
+class LRUCache(object):
+    """
+    Mapping which keeps its most recently used items within a size budget.
+
+    The size of an item is given by ``sizeof(value)``, 1 by default so that
+    ``maxsize`` is a number of items. When the budget is exceeded, least
+    recently used items are dropped until a quarter of it is free again.
+    ``hits`` and ``misses`` count the lookups done through `get`.
+    """
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = {} # key -> [last use, size, value]
+        self._clock = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        item = self._items[key]
+        self._clock += 1
+        item[0] = self._clock
+        return item[2]
+
+    def get(self, key, default=None):
+        """Return the value of ``key`` or ``default``, counting hits and
+        misses"""
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._clock += 1
+        item[0] = self._clock
+        return item[2]
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(value)
+        if key in self._items:
+            self.size -= self._items[key][1]
+        self._clock += 1
+        self._items[key] = [self._clock, size, value]
+        self.size += size
+        if self.size > self.maxsize:
+            self._shrink()
+
+    def __delitem__(self, key):
+        self.size -= self._items.pop(key)[1]
+
+    def _shrink(self):
+        """Drop least recently used items down to 3/4 of the budget"""
+        budget = self.maxsize * 3 // 4
+        kept = {}
+        size = 0
+        items = sorted(self._items.iteritems(), key=lambda item: item[1][0],
+                       reverse=True)
+        for key, item in items:
+            if size + item[1] > budget:
+                break
+            kept[key] = item
+            size += item[1]
+        self._items = kept
+        self.size = size
+
+    def discard(self, predicate):
+        """Drop items whose key satisfies ``predicate``"""
+        for key in [key for key in self._items if predicate(key)]:
+            del self[key]
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+    def iteritems(self):
+        """Iterate over (key, value), without marking them as used"""
+        for key, item in self._items.iteritems():
+            yield key, item[2]
+
 # XXX duplicates logilab.mtconverter.__init__ code
 CONTROL_CHARS = [chr(ci) for ci in range(32)]
 TR_CONTROL_CHARS = [' '] * len(CONTROL_CHARS)
@@ -127,58 +210,23 @@ def format_desc(desc, width):
     return udesc
 
 
-def first_known_precursors(ctx, excluded=()):
-    obsstore = getattr(ctx._repo, 'obsstore', None)
-    startnode = ctx.node()
-    nm = ctx._repo.changelog.nodemap
-    if obsstore is not None:
-        markers = precursorsmarkers(obsstore, startnode)
-        # consider all precursors
-        candidates = set(mark[0] for mark in markers)
-        seen = set(candidates)
-        if startnode in candidates:
-            candidates.remove(startnode)
-        else:
-            seen.add(startnode)
-        while candidates:
-            current = candidates.pop()
-            # is this changeset in the displayed set ?
-            crev = nm.get(current)
-            if crev is not None and crev not in excluded:
-                yield ctx._repo[crev]
-            else:
-                for mark in precursorsmarkers(obsstore, current):
-                    if mark[0] not in seen:
-                        candidates.add(mark[0])
-                        seen.add(mark[0])
-
-def first_known_successors(ctx, excluded=()):
-    obsstore = getattr(ctx._repo, 'obsstore', None)
-    startnode = ctx.node()
-    nm = ctx._repo.changelog.nodemap
-    if obsstore is not None:
-        markers = successorsmarkers(obsstore, startnode)
-        # consider all precursors
-        candidates = set()
-        for mark in markers:
-            candidates.update(mark[1])
-        seen = set(candidates)
-        if startnode in candidates:
-            candidates.remove(startnode)
-        else:
-            seen.add(startnode)
-        while candidates:
-            current = candidates.pop()
-            # is this changeset in the displayed set ?
-            crev = nm.get(current)
-            if crev is not None and crev not in excluded:
-                yield ctx._repo[crev]
-            else:
-                for mark in successorsmarkers(obsstore, current):
-                    for succ in mark[1]:
-                        if succ not in seen:
-                            candidates.add(succ)
-                            seen.add(succ)
+def filestate(path):
+    """Return a string which changes when the file at ``path`` is modified"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ''
+    # files rewritten by mercurial are renamed over the former ones, which
+    # gives them a new inode even when size and times are the same
+    return '%i:%i:%r:%r' % (stat.st_size, stat.st_ino, stat.st_mtime,
+                            stat.st_ctime)
+
+def isnode(repo, node):
+    """Return True if ``node`` is a changeset of ``repo`` (not the working
+    directory nor an unapplied mq patch)"""
+    # nodemap of C parsers only accepts 20 bytes strings
+    return isinstance(node, str) and len(node) == 20 \
+           and node in repo.changelog.nodemap
 
 def build_repo(ui, path):
     """build a repo like hg.repository
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the diffs of every file of a large changeset
+
+A synthetic repository is built with a changeset adding ``--files`` files of
+``--lines`` lines and a second one modifying every one of them. The diff of
+each file of the second changeset is then computed in turn, once with
+`hggraph.diff` for a single file, as done before, and once through a
+`ChangesetDiff` of the changeset. The time to show the last file alone
+through a new `ChangesetDiff` is measured too. The repository is kept in the
+given directory and reused by later runs.
+
+usage: bench_filediff.py [options] [REPOSITORY]
+"""
+
+import os
+import sys
+import tempfile
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mercurial import ui as uimod, hg, context
+
+from hgviewlib.hggraph import diff
+from hgviewlib.diffcache import ChangesetDiff
+
+def make_files_repo(path, nfiles, nlines):
+    """Create a repository at ``path`` whose second changeset modifies the
+    ``nfiles`` files added by the first one. Return the repository."""
+    ui = uimod.ui()
+    ui.setconfig('ui', 'quiet', 'true')
+    if os.path.exists(os.path.join(path, '.hg')):
+        repo = hg.repository(ui, path)
+        if len(repo) == 2 and len(repo[1].files()) == nfiles:
+            return repo
+        raise ValueError('%s does not hold the expected changesets' % path)
+    repo = hg.repository(ui, path, create=True)
+    files = ['dir%i/file%i' % (idx % 10, idx) for idx in xrange(nfiles)]
+    def filectxfn(repo, memctx, path):
+        lines = ['line %i of %s\n' % (idx, path) for idx in xrange(nlines)]
+        if memctx.description() == 'modify':
+            lines[::10] = ['changed %s' % line for line in lines[::10]]
+        return context.memfilectx(path, ''.join(lines), False, False, None)
+    lock = repo.lock()
+    try:
+        parent = None
+        for desc in ('add', 'modify'):
+            parent = repo.commitctx(context.memctx(repo, (parent, None), desc,
+                                                   files, filectxfn, 'bench'))
+    finally:
+        lock.release()
+    return repo
+
+def bench_single(repo):
+    """Diff every file of the tip changeset on its own"""
+    ctx = repo['tip']
+    pctx = ctx.p1()
+    start = time()
+    for filename in ctx.files():
+        diff(repo, ctx, pctx, files=[filename])
+    return time() - start
+
+def bench_batched(repo):
+    """Diff every file of the tip changeset through a `ChangesetDiff`"""
+    ctx = repo['tip']
+    start = time()
+    csdiff = ChangesetDiff(repo, ctx.p1(), ctx)
+    for filename in ctx.files():
+        csdiff.filediff(filename)
+    return time() - start
+
+def bench_last(repo):
+    """Diff the last file of the tip changeset through a new
+    `ChangesetDiff`"""
+    ctx = repo['tip']
+    start = time()
+    ChangesetDiff(repo, ctx.p1(), ctx).filediff(sorted(ctx.files())[-1])
+    return time() - start
+
+def main():
+    parser = OptionParser(__doc__.strip().splitlines()[-1])
+    parser.add_option('-f', '--files', type='int', default=1000,
+                      help='number of files of the changeset [%default]')
+    parser.add_option('-l', '--lines', type='int', default=200,
+                      help='number of lines per file [%default]')
+    parser.add_option('-n', '--repeat', type='int', default=3,
+                      help='number of runs, the best one is shown [%default]')
+    opts, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error('too many arguments')
+    if args:
+        path = args[0]
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'hgview-bench-files-%i-%i'
+                            % (opts.files, opts.lines))
+    print 'building repository %s...' % path
+    repo = make_files_repo(path, opts.files, opts.lines)
+    for name, bench in (('single file diffs', bench_single),
+                        ('changeset diff', bench_batched)):
+        duration = min(bench(repo) for run in xrange(opts.repeat))
+        print '%s: %.2fs, %.0f files/s' % (name, duration,
+                                           opts.files / duration)
+    duration = min(bench_last(repo) for run in xrange(opts.repeat))
+    print 'last file alone: %.3fs' % duration
+
+if __name__ == '__main__':
+    main()
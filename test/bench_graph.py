@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the revision graph filling rate on wide graphs
+
+A synthetic repository is built with ``--lanes`` branches growing in
+parallel from a common root, so that most rows of the graph hold as many
+ongoing edges. The repository is kept in the given directory and reused by
+later runs.
+
+usage: bench_graph.py [options] [REPOSITORY]
+"""
+
+import os
+import sys
+import tempfile
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mercurial import ui as uimod, hg, context
+
+from hgviewlib.hggraph import Graph, revision_grapher
+
+def make_lanes_repo(path, lanes, rounds):
+    """Create a repository at ``path`` where ``lanes`` branches get one new
+    changeset each in turn, ``rounds`` times. Return the repository."""
+    ui = uimod.ui()
+    ui.setconfig('ui', 'quiet', 'true')
+    if os.path.exists(os.path.join(path, '.hg')):
+        repo = hg.repository(ui, path)
+        if len(repo) == lanes * rounds + 1:
+            return repo
+        raise ValueError('%s does not hold the expected graph' % path)
+    repo = hg.repository(ui, path, create=True)
+    def filectxfn(repo, memctx, path):
+        return context.memfilectx(path, '%s\n' % memctx.description(),
+                                  False, False, None)
+    lock = repo.lock()
+    try:
+        root = repo.commitctx(context.memctx(repo, (None, None), 'root',
+                                             ['root'], filectxfn, 'bench'))
+        heads = [root] * lanes
+        for step in xrange(rounds):
+            for lane in xrange(lanes):
+                ctx = context.memctx(repo, (heads[lane], None),
+                                     'lane %i step %i' % (lane, step),
+                                     ['lane%i' % lane], filectxfn, 'bench')
+                heads[lane] = repo.commitctx(ctx)
+    finally:
+        lock.release()
+    return repo
+
+def bench_fill(repo, step=500):
+    """Fill a graph of ``repo`` and return the number of rows and the time
+    spent."""
+    graph = Graph(repo, revision_grapher(repo, start_rev=len(repo) - 1))
+    start = time()
+    for nrows in graph.fill(step):
+        pass
+    return len(graph), time() - start
+
+def main():
+    parser = OptionParser(__doc__.strip().splitlines()[-1])
+    parser.add_option('-l', '--lanes', type='int', default=300,
+                      help='number of concurrent branches [%default]')
+    parser.add_option('-r', '--rounds', type='int', default=20,
+                      help='number of changesets per branch [%default]')
+    parser.add_option('-n', '--repeat', type='int', default=3,
+                      help='number of runs, the best one is shown [%default]')
+    opts, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error('too many arguments')
+    if args:
+        path = args[0]
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'hgview-bench-lanes-%i-%i'
+                            % (opts.lanes, opts.rounds))
+    print 'building repository %s...' % path
+    repo = make_lanes_repo(path, opts.lanes, opts.rounds)
+    results = [bench_fill(repo) for run in xrange(opts.repeat)]
+    nrows, duration = min(results, key=lambda result: result[1])
+    print '%i rows, %i lanes: %.2fs, %.0f rows/s' % (
+        nrows, opts.lanes, duration, nrows / duration)
+
+if __name__ == '__main__':
+    main()
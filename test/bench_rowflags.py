@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the row styling lookups on a repository with many obsolescence
+markers
+
+The phase, obsolete and troubled state of ``--rows`` rows is looked up as the
+Qt model does to paint them (foreground of each column, background and
+decoration of the row), through changeset contexts and through
+`hgviewlib.flagcache.RevFlags`. A synthetic repository of ``--revs`` draft
+changesets with ``--markers`` obsolescence markers is kept in the given
+directory and reused by later runs.
+
+usage: bench_rowflags.py [options] [REPOSITORY]
+"""
+
+import os
+import sys
+import random
+import tempfile
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mercurial import ui as uimod, hg, context, obsolete
+
+from hgviewlib.util import build_repo
+from hgviewlib.flagcache import revflags
+
+# number of columns of the Qt model
+NCOLUMNS = 6
+
+# markers are not read otherwise
+obsolete._enabled = True
+
+def make_obsolete_repo(path, nrevs, nmarkers):
+    """Create a repository at ``path`` with ``nrevs`` linear changesets, one
+    out of ten of the last thousand being obsoleted, and ``nmarkers``
+    obsolescence markers. Return the repository."""
+    ui = uimod.ui()
+    ui.setconfig('ui', 'quiet', 'true')
+    if os.path.exists(os.path.join(path, '.hg')):
+        repo = build_repo(ui, path)
+        if len(repo) == nrevs and len(repo.obsstore._all) == nmarkers:
+            return repo
+        raise ValueError('%s does not hold the expected history' % path)
+    repo = hg.repository(ui, path, create=True)
+    def filectxfn(repo, memctx, path):
+        return context.memfilectx(path, '%s\n' % memctx.description(),
+                                  False, False, None)
+    rand = random.Random(0)
+    randnode = lambda: ''.join(chr(rand.randrange(256)) for i in xrange(20))
+    lock = repo.lock()
+    try:
+        node = None
+        for rev in xrange(nrevs):
+            node = repo.commitctx(context.memctx(repo, (node, None),
+                                                 'rev %i' % rev, ['file'],
+                                                 filectxfn, 'bench'))
+        obsoleted = [repo.changelog.node(rev)
+                     for rev in xrange(max(0, nrevs - 1000), nrevs, 10)]
+        markers = [(node, (randnode(),), 0, obsolete.encodemeta({}))
+                   for node in obsoleted]
+        markers.extend((randnode(), (randnode(),), 0, obsolete.encodemeta({}))
+                       for i in xrange(nmarkers - len(markers)))
+        tr = repo.transaction('bench')
+        try:
+            repo.obsstore.add(tr, markers)
+            tr.close()
+        finally:
+            tr.release()
+    finally:
+        lock.release()
+    return build_repo(ui, path)
+
+def style_contexts(repo, revs):
+    for rev in revs:
+        ctx = repo.changectx(rev)
+        for column in xrange(NCOLUMNS): # foreground
+            ctx.obsolete()
+        ctx.obsolete() or ctx.troubles() # background
+        ctx.obsolete(), ctx.phase() # decoration
+
+def style_flags(repo, revs):
+    for rev in revs:
+        flags = revflags(repo)
+        for column in xrange(NCOLUMNS): # foreground
+            flags.obsolete(rev)
+        flags.obsolete(rev) or flags.troubled(rev) # background
+        flags.obsolete(rev), flags.phase(rev) # decoration
+
+def bench(path, style, nrows):
+    """Return the time spent by ``style`` on the last ``nrows`` revisions of
+    a freshly loaded repository, the first time and once more"""
+    repo = build_repo(uimod.ui(), path)
+    revs = xrange(len(repo) - 1, max(-1, len(repo) - 1 - nrows), -1)
+    start = time()
+    style(repo, revs)
+    first = time()
+    style(repo, revs)
+    return first - start, time() - first
+
+def main():
+    parser = OptionParser(__doc__.strip().splitlines()[-1])
+    parser.add_option('-r', '--revs', type='int', default=5000,
+                      help='number of changesets [%default]')
+    parser.add_option('-m', '--markers', type='int', default=50000,
+                      help='number of obsolescence markers [%default]')
+    parser.add_option('-n', '--rows', type='int', default=1000,
+                      help='number of painted rows [%default]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='number of runs, the best one is shown [%default]')
+    opts, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error('too many arguments')
+    if args:
+        path = args[0]
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'hgview-bench-obsolete-%i-%i'
+                            % (opts.revs, opts.markers))
+    print 'building repository %s...' % path
+    make_obsolete_repo(path, opts.revs, opts.markers)
+    for label, style in (('contexts', style_contexts),
+                         ('flags', style_flags)):
+        results = [bench(path, style, opts.rows)
+                   for run in xrange(opts.repeat)]
+        first = min(result[0] for result in results)
+        again = min(result[1] for result in results)
+        print '%s: %i rows in %.3fs, %.3fs when painted again' % (
+            label, opts.rows, first, again)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright (c) 2003-2013 LOGILAB S.A. (Paris, FRANCE).
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the frame rate of the revision view while scrolling
+
+A `HgRepoView` of ``--width`` by ``--height`` pixels displays the graph of a
+synthetic repository of ``--lanes`` branches (see `bench_graph`). It is
+scrolled down by ``--step`` rows at a time and repainted at once, a first
+time with an empty data cache of the model and once more. With
+``--no-graph``, the Log column is painted by a plain delegate to give the cost
+of the graph painting.
+
+usage: bench_scroll.py [options] [REPOSITORY]
+"""
+
+import os
+import sys
+import tempfile
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mercurial import ui as uimod
+from PyQt4 import QtGui
+
+from hgviewlib.util import build_repo
+from hgviewlib.qt4.hgrepomodel import HgRepoListModel
+from hgviewlib.qt4.hgrepoview import HgRepoView
+
+from bench_graph import make_lanes_repo
+
+def scroll(view, step):
+    """Scroll ``view`` from top to bottom, repainting it after each move of
+    ``step`` rows. Return the number of frames and the time spent."""
+    bar = view.verticalScrollBar()
+    bar.setValue(0)
+    nframes = 0
+    start = time()
+    for value in xrange(0, bar.maximum() + step, step):
+        bar.setValue(value)
+        view.viewport().repaint()
+        nframes += 1
+    return nframes, time() - start
+
+def bench(app, path, opts):
+    """Return the frame rates of a first scroll and of a second one in the
+    application ``app``"""
+    model = HgRepoListModel(build_repo(uimod.ui(), path))
+    while model.graph.build_nodes(nnodes=1000):
+        pass
+    model.updateRowCount()
+    view = HgRepoView()
+    view.setModel(model)
+    if opts.no_graph:
+        col = list(model._columns).index('Log')
+        view.setItemDelegateForColumn(col, QtGui.QStyledItemDelegate(view))
+    view.resize(opts.width, opts.height)
+    view.show()
+    app.processEvents()
+    rates = []
+    for run in xrange(2):
+        nframes, duration = scroll(view, opts.step)
+        rates.append(nframes / duration)
+    view.close()
+    return rates
+
+def main():
+    parser = OptionParser(__doc__.strip().splitlines()[-1])
+    parser.add_option('-l', '--lanes', type='int', default=30,
+                      help='number of concurrent branches [%default]')
+    parser.add_option('-r', '--rounds', type='int', default=100,
+                      help='number of changesets per branch [%default]')
+    parser.add_option('-W', '--width', type='int', default=3840,
+                      help='width of the view [%default]')
+    parser.add_option('-H', '--height', type='int', default=2160,
+                      help='height of the view [%default]')
+    parser.add_option('-s', '--step', type='int', default=3,
+                      help='number of rows scrolled per frame [%default]')
+    parser.add_option('--no-graph', action='store_true', default=False,
+                      help='do not paint the graph')
+    parser.add_option('-n', '--repeat', type='int', default=3,
+                      help='number of runs, the best one is shown [%default]')
+    opts, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error('too many arguments')
+    if args:
+        path = args[0]
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'hgview-bench-lanes-%i-%i'
+                            % (opts.lanes, opts.rounds))
+    print 'building repository %s...' % path
+    make_lanes_repo(path, opts.lanes, opts.rounds)
+    app = QtGui.QApplication(sys.argv)
+    results = [bench(app, path, opts) for run in xrange(opts.repeat)]
+    print 'first scroll: %.1f frames/s, scrolled again: %.1f frames/s' % (
+        max(result[0] for result in results),
+        max(result[1] for result in results))
+
+if __name__ == '__main__':
+    main()